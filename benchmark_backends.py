@@ -0,0 +1,93 @@
+"""比较各推理后端的速度和与PyTorch结果的一致性
+
+用法:
+    python benchmark_backends.py <图片目录> [模型路径] [量化数据集目录]
+
+目录下的普通图片和zip内图片都会参与测试（最多BENCHMARK_IMAGES张），
+输出每个可用后端的每秒图片数、class2概率与torch的最大差异和判定一致率。
+"""
+import os
+import sys
+import time
+import numpy as np
+from zip_reader import scan_zip_images, decode_image, to_model_input
+from inference_backend import BACKENDS, load_classifier
+from classifier import predict_probs
+
+SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+BENCHMARK_IMAGES = 200
+BATCH_SIZE = 16
+THREADS = 0
+CLASS2_CONFIDENCE_THRESHOLD = 0.5
+# 与torch相比class2概率允许的最大差异
+PROB_TOLERANCE = 1e-3
+
+
+def load_images(path, limit=BENCHMARK_IMAGES):
+    """预先解码好图片，计时只包含预处理和推理"""
+    image_infos = []
+    for root, _, files in os.walk(path):
+        for file in sorted(files):
+            if file.lower().endswith(SUPPORTED_FORMATS):
+                image_infos.append({'path': os.path.join(root, file)})
+    image_infos.extend(scan_zip_images(path, SUPPORTED_FORMATS))
+    images = []
+    for image_info in image_infos[:limit]:
+        try:
+            with decode_image(image_info) as img:
+                images.append(to_model_input(img))
+        except Exception as e:
+            print(f"跳过 {image_info['path']}: {str(e)}")
+    return images
+
+
+def run_backend(model, images, batch_size=BATCH_SIZE):
+    """返回(class2概率数组, 耗时秒数)"""
+    # 先跑一批预热，不计入耗时
+    predict_probs(model, images[:batch_size])
+    start = time.perf_counter()
+    probs = []
+    for begin in range(0, len(images), batch_size):
+        probs.extend(predict_probs(model, images[begin:begin + batch_size]))
+    return np.array([p[1] for p in probs]), time.perf_counter() - start
+
+
+def report(name, class2, seconds, reference):
+    line = f"{name:<10} {len(class2) / seconds:8.1f} 张/秒"
+    if reference is not None:
+        diff = np.abs(class2 - reference).max()
+        agreement = np.mean((class2 >= CLASS2_CONFIDENCE_THRESHOLD) == (reference >= CLASS2_CONFIDENCE_THRESHOLD))
+        status = '✓' if diff <= PROB_TOLERANCE else '✗'
+        line += f"  最大概率差 {diff:.2e} {status}  判定一致率 {agreement * 100:.2f}%"
+    print(line)
+
+
+def main(image_dir, model_path, quant_dataset=None):
+    images = load_images(image_dir)
+    if not images:
+        print("没有找到图片")
+        return
+    print(f"图片数: {len(images)}  批大小: {BATCH_SIZE}")
+    reference = None
+    for backend in BACKENDS:
+        try:
+            model = load_classifier(model_path, backend, THREADS, quant_dataset,
+                                    threshold=CLASS2_CONFIDENCE_THRESHOLD)
+        except Exception as e:
+            print(f"{backend:<10} 不可用: {str(e)}")
+            continue
+        if getattr(model, 'backend', 'torch') != backend:
+            print(f"{backend:<10} 不可用，已跳过")
+            continue
+        class2, seconds = run_backend(model, images)
+        report(backend, class2, seconds, reference)
+        if backend == 'torch':
+            reference = class2
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+    else:
+        main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else os.path.join('models', 'best.pt'),
+             sys.argv[3] if len(sys.argv) > 3 else None)
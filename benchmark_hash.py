@@ -0,0 +1,92 @@
+"""对比完整解码与JPEG快速解码计算pHash的耗时和一致率
+
+用法:
+    python benchmark_hash.py <目录>     # 目录下的图片和zip内的图片
+    python benchmark_hash.py            # 生成一批4000×3000的合成照片测试
+"""
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageFilter
+from image_hash import compute_phash, HASH_DRAFT_TOLERANCE
+from zip_reader import scan_zip_images, open_image_source
+
+HASH_SIZE = 8
+SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+SYNTHETIC_COUNT = 20
+SYNTHETIC_SIZE = (4000, 3000)
+
+
+def collect_sources(path):
+    """目录下的普通图片文件和zip内图片，返回可反复打开的读取函数"""
+    sources = []
+    for root, _, files in os.walk(path):
+        for file in sorted(files):
+            if file.lower().endswith(SUPPORTED_FORMATS):
+                full_path = os.path.join(root, file)
+                sources.append((full_path, lambda p=full_path: p))
+    for image_info in scan_zip_images(path, SUPPORTED_FORMATS):
+        sources.append((image_info['path'], lambda i=image_info: open_image_source(i)))
+    return sources
+
+
+def synthetic_sources(count=SYNTHETIC_COUNT, size=SYNTHETIC_SIZE):
+    """生成带大块结构、细节纹理和噪点的JPEG，模拟手机照片"""
+    rng = np.random.default_rng(0)
+    sources = []
+    for i in range(count):
+        coarse = rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)
+        img = Image.fromarray(coarse).resize(size, Image.BICUBIC)
+        noise = rng.normal(0, 12, (size[1], size[0], 3))
+        pixels = np.clip(np.asarray(img, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+        img = Image.fromarray(pixels).filter(ImageFilter.DETAIL)
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=90)
+        data = buffer.getvalue()
+        sources.append((f'synthetic_{i}.jpg', lambda d=data: io.BytesIO(d)))
+    return sources
+
+
+def readable(sources):
+    """去掉无法解码的文件"""
+    result = []
+    for name, open_source in sources:
+        try:
+            compute_phash(open_source(), HASH_SIZE)
+            result.append((name, open_source))
+        except Exception as e:
+            print(f"跳过 {name}: {str(e)}")
+    return result
+
+
+def run(sources):
+    timings = {}
+    hashes = {}
+    for fast_decode in (False, True):
+        start = time.perf_counter()
+        hashes[fast_decode] = [compute_phash(open_source(), HASH_SIZE, fast_decode) for _, open_source in sources]
+        timings[fast_decode] = time.perf_counter() - start
+
+    distances = np.array([a - b for a, b in zip(hashes[False], hashes[True])])
+    print(f"图片数: {len(sources)}")
+    print(f"完整解码: {timings[False]:.2f}s  快速解码: {timings[True]:.2f}s  "
+          f"加速: {timings[False] / max(timings[True], 1e-9):.1f}x")
+    print(f"哈希完全一致: {np.mean(distances == 0) * 100:.1f}%  "
+          f"差异≤{HASH_DRAFT_TOLERANCE}位: {np.mean(distances <= HASH_DRAFT_TOLERANCE) * 100:.1f}%  "
+          f"最大差异: {distances.max()}位")
+    for (name, _), distance in zip(sources, distances):
+        if distance > HASH_DRAFT_TOLERANCE:
+            print(f"  超出容差: {name} ({distance}位)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sources = readable(collect_sources(sys.argv[1]))
+    else:
+        sources = synthetic_sources()
+    if not sources:
+        print("没有找到图片")
+    else:
+        run(sources)
@@ -0,0 +1,65 @@
+"""Web服务冷启动耗时测试
+
+在新的Python进程中导入Flask应用，并依次请求/health和/，记录导入耗时和首个请求就绪的总耗时，
+同时检查启动阶段是否已经加载了torch、ultralytics、OpenCV、ONNX Runtime等推理依赖
+（这些依赖应当在第一次分类时才加载）。
+
+用法：
+    python benchmark_startup.py [应用目录 ...]
+
+不指定目录时测试web_frontend；总耗时超过STARTUP_BUDGET或提前加载了推理依赖时返回非0。
+"""
+import os
+import sys
+import json
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_BUDGET = 1.0  # 从进程启动到/health和/都能响应的耗时上限（秒）
+HEAVY_MODULES = ('torch', 'torchvision', 'ultralytics', 'cv2', 'onnxruntime', 'openvino')
+
+# 在子进程中执行，保证每次都是冷启动
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+with app.app.test_client() as client:
+    codes = [client.get('/health').status_code, client.get('/').status_code]
+ready = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'ready_seconds': ready - started,
+    'status_codes': codes,
+    'heavy_modules': sorted(m for m in %r if m in sys.modules),
+}))
+"""
+
+
+def measure(app_dir):
+    """冷启动一次app_dir下的app.py，返回耗时和启动阶段已加载的推理依赖"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (ROOT_DIR, env.get('PYTHONPATH')) if p)
+    result = subprocess.run([sys.executable, '-c', PROBE % (HEAVY_MODULES,)], cwd=app_dir, env=env,
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"启动 {app_dir} 失败:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(app_dirs, budget=STARTUP_BUDGET):
+    ok = True
+    for app_dir in app_dirs:
+        report = measure(app_dir)
+        passed = (report['ready_seconds'] <= budget and not report['heavy_modules']
+                  and all(code == 200 for code in report['status_codes']))
+        ok = ok and passed
+        print(f"{app_dir}: 导入 {report['import_seconds']:.3f}s，/health和/就绪 {report['ready_seconds']:.3f}s"
+              f"（上限 {budget:.1f}s），启动时加载的推理依赖: {report['heavy_modules'] or '无'}"
+              f" -> {'通过' if passed else '未通过'}")
+    return ok
+
+
+if __name__ == "__main__":
+    dirs = sys.argv[1:] or [os.path.join(ROOT_DIR, 'web_frontend')]
+    sys.exit(0 if run(dirs) else 1)
@@ -0,0 +1,359 @@
+"""跨案件的持久化相似照片索引
+
+每次运行原来只在本次上传的照片之间分组，哈希算完就丢弃；同一张照片隔几个月换个案件号再次提交时无法发现。
+这里把每张处理过的照片的pHash、案件号、来源ZIP、ZIP内路径和入库时间追加到一个索引目录，
+新上传的照片先在索引中查找汉明距离不超过HASH_THRESHOLD的历史照片，案件号不同的命中写进单独的CSV。
+
+索引目录的文件都是定长数组或紧凑的字符串表，可以直接用np.memmap映射，不必整体读入内存：
+
+- hashes.u64：每张照片的64位pHash（uint64）
+- refs.u32：每张照片的(案件号编号, 来源ZIP编号, 入库时间)（uint32×3）
+- paths.end / paths.txt：ZIP内路径的UTF-8拼接文本及每条的结束偏移（uint64）
+- index.json：条目数和案件号、来源ZIP的字符串表（写入时最后原子替换）
+- search.json 及 mih_*：多索引哈希的排序表（见HashIndex.save），新进程直接映射，不必对全部条目重新排序
+
+追加时先写数据文件再替换index.json，中途失败时多出的数据不在条目数之内，下次写入前截掉。
+同一进程内的多个任务共用一个CaseIndex对象（线程锁），多个进程写同一索引时用文件锁排队。
+查询用多索引哈希(HashIndex)，一批哈希一起查找；索引建好后新追加的条目较少时直接暴力比较，
+超过REBUILD_TAIL（且超过已建索引条目数的10%）才重建并保存，重建的代价按追加的条目数分摊。
+"""
+import os
+import csv
+import glob
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+from hash_index import HashIndex, hash_to_int, hamming_pairs
+
+logger = logging.getLogger(__name__)
+
+CASE_INDEX_FORMAT = 1
+CROSS_CASE_CSV = '跨案件重复照片.csv'
+# 建好多索引后新追加的条目超过这么多（且超过已建索引条目数的10%）时重建，否则新条目暴力比较
+REBUILD_TAIL = 50000
+
+_HASHES = 'hashes.u64'
+_REFS = 'refs.u32'
+_PATH_ENDS = 'paths.end'
+_PATH_TEXT = 'paths.txt'
+_HEADER = 'index.json'
+_SEARCH = 'search.json'
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _map_array(path, dtype, count, columns=None):
+    """只读映射文件开头的count条记录，count为0时返回空数组（空文件不能映射）"""
+    shape = (count,) if columns is None else (count, columns)
+    if count == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class CaseIndex:
+    """索引目录的读写，查询和追加都是线程安全的"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._header_mtime = None
+        self._search_index = None
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        """读取index.json并重新映射数据文件（其他进程追加后调用）"""
+        try:
+            mtime = os.stat(self._path(_HEADER)).st_mtime_ns
+            with open(self._path(_HEADER), 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        except FileNotFoundError:
+            mtime, header = None, {'format': CASE_INDEX_FORMAT, 'count': 0, 'cases': [], 'archives': []}
+        if header.get('format') != CASE_INDEX_FORMAT:
+            raise ValueError(f"索引格式版本 {header.get('format')} 与当前版本 {CASE_INDEX_FORMAT} 不一致: {self.directory}")
+        self._header_mtime = mtime
+        self.count = header['count']
+        self.cases = header['cases']
+        self.archives = header['archives']
+        self._case_ids = {name: i for i, name in enumerate(self.cases)}
+        self._archive_ids = {name: i for i, name in enumerate(self.archives)}
+        self.hashes = _map_array(self._path(_HASHES), '<u8', self.count)
+        self.refs = _map_array(self._path(_REFS), '<u4', self.count, 3)
+        self.path_ends = _map_array(self._path(_PATH_ENDS), '<u8', self.count)
+        text_size = int(self.path_ends[-1]) if self.count else 0
+        self.path_text = _map_array(self._path(_PATH_TEXT), np.uint8, text_size)
+        if self._search_index is not None and len(self._search_index) > self.count:
+            self._search_index = None
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self._path(_HEADER)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._header_mtime:
+            self._load()
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, i):
+        """第i条记录：{'hash', 'case', 'source_zip', 'relative_path', 'added_at'}"""
+        case_id, archive_id, added_at = (int(v) for v in self.refs[i])
+        start = int(self.path_ends[i - 1]) if i else 0
+        return {
+            'hash': int(self.hashes[i]),
+            'case': self.cases[case_id],
+            'source_zip': self.archives[archive_id],
+            'relative_path': bytes(self.path_text[start:int(self.path_ends[i])]).decode('utf-8'),
+            'added_at': added_at,
+        }
+
+    def search(self, values, threshold):
+        """在索引中查找与values（uint64数组）各哈希距离不超过threshold的条目，返回(values下标, 条目下标, 距离)"""
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        with self._lock:
+            self._refresh()
+            count = self.count
+            index = self._search_index
+            if index is None or index.threshold != threshold:
+                index = self._open_search_index(threshold)
+            if index is None or count - len(index) > max(REBUILD_TAIL, len(index) // 10):
+                index = self._build_search_index(threshold)
+            self._search_index = index
+            hashes = self.hashes
+        found_i, found_j, found_d = [], [], []
+        indexed = len(index)
+        if indexed:
+            index_i, index_j, index_d = index.query_many(values)
+            found_i.append(index_i)
+            found_j.append(index_j)
+            found_d.append(index_d)
+        if count > indexed:
+            # 索引建好之后追加的条目
+            tail_i, tail_j, tail_d = hamming_pairs(values, threshold, right=hashes[indexed:count])
+            found_i.append(tail_i)
+            found_j.append(tail_j + indexed)
+            found_d.append(tail_d)
+        if not found_i:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, np.zeros(0, dtype=np.uint8)
+        return (np.concatenate(found_i).astype(np.intp), np.concatenate(found_j).astype(np.intp),
+                np.concatenate(found_d))
+
+    def _open_search_index(self, threshold):
+        """映射保存的多索引，没有、阈值不同或读取失败时返回None"""
+        try:
+            with open(self._path(_SEARCH), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved['threshold'] != threshold or saved['count'] > self.count:
+                return None
+            return HashIndex.load(self._path(saved['name']), self.hashes[:saved['count']])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取跨案件索引的多索引失败，重新建立: {str(e)}")
+            return None
+
+    def _build_search_index(self, threshold):
+        """对当前全部条目建多索引并保存，之后的进程直接映射；保存失败时只在本进程内使用"""
+        count = self.count
+        index = HashIndex(self.hashes[:count], threshold)
+        name = f"mih_{threshold}_{count}_{uuid.uuid4().hex[:8]}"
+        try:
+            with self._writing():
+                index.save(self._path(name))
+                previous = None
+                try:
+                    with open(self._path(_SEARCH), 'r', encoding='utf-8') as f:
+                        previous = json.load(f)['name']
+                except (OSError, ValueError, KeyError):
+                    pass
+                temp_path = f"{self._path(_SEARCH)}.{uuid.uuid4().hex[:8]}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'name': name, 'threshold': threshold, 'count': count}, f)
+                os.replace(temp_path, self._path(_SEARCH))
+                if previous:
+                    # 其他进程已映射的旧文件在关闭前仍然可读
+                    for path in glob.glob(glob.escape(self._path(previous)) + '.*'):
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+        except Exception as e:
+            logger.warning(f"保存跨案件索引的多索引失败，只在本进程内使用: {str(e)}")
+        return index
+
+    @contextmanager
+    def _writing(self):
+        """写入时持有线程锁和索引目录的文件锁（多个进程共用同一索引时排队）"""
+        with self._lock, open(self._path('.lock'), 'a') as lock_file:
+            try:
+                import fcntl
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            except ImportError:
+                fcntl = None
+            try:
+                self._refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _intern(self, table, ids, name):
+        if name not in ids:
+            ids[name] = len(table)
+            table.append(name)
+        return ids[name]
+
+    def add(self, records):
+        """追加[{'hash': int, 'case', 'source_zip', 'relative_path'}]，返回追加的条数"""
+        if not records:
+            return 0
+        with self._writing():
+            added_at = int(time.time())
+            cases, archives = list(self.cases), list(self.archives)
+            case_ids, archive_ids = dict(self._case_ids), dict(self._archive_ids)
+            hashes = np.fromiter((record['hash'] for record in records), dtype='<u8', count=len(records))
+            refs = np.array([(self._intern(cases, case_ids, record['case']),
+                              self._intern(archives, archive_ids, record['source_zip']),
+                              added_at) for record in records], dtype='<u4')
+            paths = [record['relative_path'].encode('utf-8') for record in records]
+            text_start = int(self.path_ends[-1]) if self.count else 0
+            ends = text_start + np.cumsum([len(p) for p in paths], dtype=np.uint64)
+
+            # 截掉上次中途失败留下的、不在条目数之内的数据后再追加
+            for name, size in ((_HASHES, self.count * 8), (_REFS, self.count * 12),
+                               (_PATH_ENDS, self.count * 8), (_PATH_TEXT, text_start)):
+                with open(self._path(name), 'ab') as f:
+                    f.truncate(size)
+                    if name == _HASHES:
+                        f.write(hashes.tobytes())
+                    elif name == _REFS:
+                        f.write(refs.tobytes())
+                    elif name == _PATH_ENDS:
+                        f.write(ends.astype('<u8').tobytes())
+                    else:
+                        f.write(b''.join(paths))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            header = {'format': CASE_INDEX_FORMAT, 'count': self.count + len(records),
+                      'cases': cases, 'archives': archives}
+            temp_path = f"{self._path(_HEADER)}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(header, f, ensure_ascii=False)
+            os.replace(temp_path, self._path(_HEADER))
+            self._load()
+        return len(records)
+
+
+def open_case_index(directory):
+    """按目录复用索引对象，directory为空时返回None（不使用索引），打不开时记录错误并返回None"""
+    if not directory:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            try:
+                index = CaseIndex(directory)
+            except Exception as e:
+                logger.error(f"打开跨案件索引 {directory} 失败，本次不做跨案件比对: {str(e)}")
+                return None
+            _indexes[directory] = index
+        return index
+
+
+def screen_records(index, records, threshold):
+    """把本次的照片与索引及彼此比对，返回案件号不同的命中，然后把新照片追加进索引
+
+    同一ZIP、同一路径、哈希完全相同的照片已在索引中（重复上传同一个ZIP）时不再追加。
+    返回[(本次记录, 命中记录, 距离)]，命中记录来自本次上传时'added_at'为None。
+    """
+    values = np.fromiter((record['hash'] for record in records), dtype=np.uint64, count=len(records))
+    hits = []
+    known = set()
+    for i, j, distance in zip(*index.search(values, threshold)):
+        record, stored = records[i], index.entry(j)
+        if distance == 0 and (stored['source_zip'], stored['relative_path']) == (
+                record['source_zip'], record['relative_path']):
+            known.add(i)
+        if stored['case'] != record['case']:
+            hits.append((record, stored, int(distance)))
+
+    # 同一次上传中不同案件之间的重复
+    if len(records) > 1:
+        pairs_i, pairs_j, pairs_d = HashIndex(values, threshold).pairs()
+        for i, j, distance in zip(pairs_i, pairs_j, pairs_d):
+            if records[i]['case'] != records[j]['case']:
+                hits.append((records[i], dict(records[j], added_at=None), int(distance)))
+
+    added = index.add([record for i, record in enumerate(records) if i not in known])
+    logger.info(f"跨案件比对：索引中共 {len(index)} 张照片，本次新增 {added} 张，发现 {len(hits)} 处跨案件重复")
+    return hits
+
+
+def write_cross_case_csv(hits, output_dir):
+    """把跨案件命中写成CSV，返回文件路径"""
+    csv_path = os.path.join(output_dir, CROSS_CASE_CSV)
+    headers = ['本次案件号', '本次来源ZIP', '本次ZIP内路径', '历史案件号', '历史来源ZIP', '历史ZIP内路径', '历史入库时间', '汉明距离']
+    rows = []
+    for record, stored, distance in sorted(hits, key=lambda hit: (hit[2], hit[0]['case'], hit[0]['relative_path'])):
+        added_at = stored['added_at']
+        rows.append([
+            record['case'], record['source_zip'], record['relative_path'],
+            stored['case'], stored['source_zip'], stored['relative_path'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(added_at)) if added_at is not None else '本次上传',
+            distance,
+        ])
+    with open(csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    return csv_path
+
+
+def screen_case_records(index_dir, records, threshold, output_dir):
+    """对本次的照片做跨案件比对并写出CSV，返回命中数
+
+    records为可迭代的 {'hash': 64位整数, 'case', 'source_zip', 'relative_path'}。
+    index_dir为空时不做比对；比对出错只记录日志，不影响分组结果。
+    """
+    index = open_case_index(index_dir)
+    if index is None:
+        return 0
+    try:
+        records = list(records)
+        if not records:
+            return 0
+        hits = screen_records(index, records, threshold)
+        if hits:
+            os.makedirs(output_dir, exist_ok=True)
+            csv_path = write_cross_case_csv(hits, output_dir)
+            logger.info(f"跨案件重复记录已生成: {csv_path}")
+        return len(hits)
+    except Exception as e:
+        logger.error(f"跨案件比对失败: {str(e)}")
+        return 0
+
+
+def screen_hash_records(index_dir, hashes, threshold, case_of, output_dir):
+    """对 {路径: {'hash': ImageHash, 'info': 图片信息}} 做跨案件比对，case_of(来源ZIP文件名)返回案件号"""
+    def records():
+        for record in hashes.values():
+            info = record['info']
+            source_zip = info.get('source_zip', '')
+            yield {
+                'hash': hash_to_int(record['hash']),
+                'case': case_of(source_zip) or 'unknown',
+                'source_zip': source_zip,
+                'relative_path': info.get('relative_path') or os.path.basename(info['path']),
+            }
+    return screen_case_records(index_dir, records(), threshold, output_dir)
@@ -0,0 +1,174 @@
+"""YOLO分类的批量推理与后台预取
+
+逐张调用model()时每次都有固定开销，CPU部署下核心也用不满。这里把图片按批送入模型，
+当前批推理的同时，后台线程已在读取、解码、预处理下一批（PIL解码时会释放GIL）。
+
+后台线程每张图片只读取、解码一次：同一份完整解码的像素既算出pHash（与fast_decode=False相同），
+又把短边缩放到imgsz（分类预处理的第一步）作为模型输入，随后释放大图，
+排队等待推理的只有小图和哈希值，不再保留1200万像素照片的完整解码。
+模型对缩放后的图片不再改变像素，class2概率与送入完整解码图片时相同
+（差异上限见MODEL_INPUT_TOLERANCE，由test_system.py的测试13检查）。
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import imagehash
+from PIL import Image
+from zip_reader import read_image_bytes, to_model_input, resize_model_input
+from image_hash import phash_image
+from feature_cache import digest_images
+
+logger = logging.getLogger(__name__)
+
+YOLO_BATCH_SIZE = 16
+PREFETCH_WORKERS = 2
+DEFAULT_IMGSZ = 224  # 读不到模型输入尺寸时使用
+# 共用解码算出的pHash按完整解码计算，特征缓存中按该参数存取
+SHARED_HASH_FAST_DECODE = False
+# 预取时缩放好的模型输入经模型预处理后，与完整解码图片经同样预处理的最大像素差（0~1）
+MODEL_INPUT_TOLERANCE = 0.0
+
+_model_locks = {}
+_model_locks_guard = threading.Lock()
+
+
+def model_imgsz(model):
+    """分类模型的输入尺寸：非torch后端有imgsz属性，Ultralytics模型记录在训练参数里"""
+    imgsz = getattr(model, 'imgsz', None)
+    if imgsz is None:
+        args = getattr(getattr(model, 'model', None), 'args', None)
+        imgsz = args.get('imgsz', DEFAULT_IMGSZ) if isinstance(args, dict) else DEFAULT_IMGSZ
+    return imgsz if isinstance(imgsz, int) else max(imgsz)
+
+
+def _prepare(image_info, imgsz, hash_size):
+    """读取并解码一张图片，返回(pHash或None, 缩小到模型输入尺寸的图片)；hash_size为None时不计算哈希"""
+    with Image.open(io.BytesIO(read_image_bytes(image_info))) as img:
+        img.load()
+        phash = None
+        if hash_size:
+            try:
+                phash = phash_image(img, hash_size)
+            except Exception as e:
+                logger.error(f"计算图片哈希值时出错 {image_info['path']}: {str(e)}")
+        return phash, resize_model_input(to_model_input(img), imgsz)
+
+
+def _iter_prepared(image_infos, batch_size, imgsz, hash_size, workers):
+    """按批产出[(图片信息, pHash, 模型输入, 异常)]，产出当前批时下一批已在后台准备"""
+    batches = [image_infos[start:start + batch_size] for start in range(0, len(image_infos), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        def submit(batch):
+            return [executor.submit(_prepare, image_info, imgsz, hash_size) for image_info in batch]
+
+        next_futures = submit(batches[0]) if batches else None
+        for index, batch in enumerate(batches):
+            futures = next_futures
+            next_futures = submit(batches[index + 1]) if index + 1 < len(batches) else None
+            prepared = []
+            for image_info, future in zip(batch, futures):
+                try:
+                    phash, inputs = future.result()
+                    prepared.append((image_info, phash, inputs, None))
+                except Exception as e:
+                    prepared.append((image_info, None, None, e))
+            yield prepared
+
+
+def _model_lock(model):
+    with _model_locks_guard:
+        return _model_locks.setdefault(id(model), threading.Lock())
+
+
+def predict_probs(model, inputs):
+    """对一批模型输入推理，返回每张图片的各类别概率列表，无结果时为None
+
+    多个任务共用同一个模型时，除ONNX Runtime会话外的模型不能并发推理，按模型加锁。
+    """
+    if getattr(model, 'thread_safe', False):
+        return model.predict_probs(inputs)
+    with _model_lock(model):
+        if hasattr(model, 'predict_probs'):
+            # openvino后端
+            return model.predict_probs(inputs)
+        results = model(inputs, verbose=False)
+        return [result.probs.data.tolist() if result.probs is not None else None for result in results]
+
+
+def _predict_batch(model, prepared):
+    """推理一批图片，整批失败时逐张重试，只让出错的图片失败"""
+    ready = [item for item in prepared if item[3] is None]
+    try:
+        probs = predict_probs(model, [inputs for _, _, inputs, _ in ready]) if ready else []
+        outcomes = {id(item): (p, None) for item, p in zip(ready, probs)}
+    except Exception:
+        outcomes = {}
+        for item in ready:
+            try:
+                outcomes[id(item)] = (predict_probs(model, [item[2]])[0], None)
+            except Exception as e:
+                outcomes[id(item)] = (None, e)
+    for item in prepared:
+        image_info, phash, _, error = item
+        if error is None:
+            probs, error = outcomes[id(item)]
+        else:
+            probs = None
+        yield image_info, phash, probs, error
+
+
+def _classify_all(model, image_infos, batch_size, hash_size, workers):
+    imgsz = model_imgsz(model)
+    for prepared in _iter_prepared(image_infos, batch_size, imgsz, hash_size, workers):
+        yield from _predict_batch(model, prepared)
+
+
+def classify_batches(model, image_infos, batch_size=YOLO_BATCH_SIZE, shared_decode=True, workers=PREFETCH_WORKERS,
+                     cache=None, model_digest=None, hash_size=8):
+    """按输入顺序逐张产出(图片信息, pHash, 各类别概率, 异常)
+
+    shared_decode=True时用同一次解码按hash_size算出pHash（完整解码），调用方不必再读取；
+    否则pHash为None。传入cache和model_digest时先按内容摘要查缓存，命中的图片不解码也不推理
+    （缓存里有同样参数的哈希时一并产出）；新算出的概率和哈希在每批结束时写回缓存。
+    """
+    cached_probs = {}
+    cached_hashes = {}
+    if cache is not None and model_digest:
+        digests = digest_images(image_infos)
+        cached_probs = cache.get_probs(digests, model_digest)
+        if shared_decode:
+            cached_hashes = cache.get_hashes(list(cached_probs), hash_size, SHARED_HASH_FAST_DECODE)
+        if cached_probs:
+            logger.info(f"特征缓存命中 {len(cached_probs)}/{len(image_infos)} 张图片的分类结果")
+
+    pending = [image_info for image_info in image_infos if image_info.get('content_digest') not in cached_probs]
+    computed = _classify_all(model, pending, batch_size, hash_size if shared_decode else None, workers)
+    new_probs = {}
+    new_hashes = {}
+
+    def flush():
+        if cache is not None and model_digest:
+            cache.put_probs(new_probs, model_digest)
+            cache.put_hashes(new_hashes, hash_size, SHARED_HASH_FAST_DECODE)
+        new_probs.clear()
+        new_hashes.clear()
+
+    try:
+        for image_info in image_infos:
+            digest = image_info.get('content_digest')
+            if digest in cached_probs:
+                phash = imagehash.hex_to_hash(cached_hashes[digest]) if digest in cached_hashes else None
+                yield image_info, phash, cached_probs[digest], None
+                continue
+
+            image_info, phash, probs, error = next(computed)
+            yield image_info, phash, probs, error
+            if digest and probs is not None:
+                new_probs[digest] = probs
+                if phash is not None:
+                    new_hashes[digest] = str(phash)
+                if len(new_probs) >= batch_size:
+                    flush()
+    finally:
+        flush()
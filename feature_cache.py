@@ -0,0 +1,233 @@
+"""按图片内容寻址的特征缓存（YOLO概率与pHash）
+
+同一批案件zip重复上传、或只调整了阈值再跑一遍时，不必重新推理和计算哈希。
+缓存存放在SQLite文件中，键由图片内容摘要加上模型文件摘要（概率）或
+HASH_SIZE与解码方式（哈希）组成，换了模型或哈希参数自然不会命中旧结果。
+
+多个进程/线程同时读写依靠SQLite自身的文件锁（WAL模式），
+总大小超过上限时按最近使用时间淘汰最旧的条目（LRU）。总大小由触发器记在meta表里，
+每次写入后只读这一行，不必扫描整张表。
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import imagehash
+from zip_reader import content_digest
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_MB = 512
+# 超出上限时淘汰到上限的这个比例，避免每次写入都触发淘汰
+CACHE_EVICT_RATIO = 0.9
+# 计算图片摘要的线程数
+DIGEST_WORKERS = 4
+SQLITE_TIMEOUT = 30
+
+_caches = {}
+_caches_lock = threading.Lock()
+_model_digests = {}
+
+
+def file_digest(path):
+    """模型文件的摘要，按(路径, 修改时间, 大小)记忆，文件不变时不重复计算；读取失败时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        logger.warning(f"无法读取模型文件 {path}，分类结果不使用缓存: {str(e)}")
+        return None
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    digest = _model_digests.get(key)
+    if digest is None:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        _model_digests[key] = digest
+    return digest
+
+
+def image_digest(image_info):
+    """图片内容摘要，已算过（如精确去重时）则直接复用"""
+    if 'content_digest' not in image_info:
+        image_info['content_digest'] = content_digest(image_info)
+    return image_info['content_digest']
+
+
+def digest_images(image_infos, workers=DIGEST_WORKERS):
+    """并行计算一批图片的内容摘要，读取失败的图片返回None"""
+    def safe_digest(image_info):
+        try:
+            return image_digest(image_info)
+        except Exception:
+            return None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(safe_digest, image_infos))
+
+
+def probs_key(digest, model_digest):
+    return f"probs:{model_digest}:{digest}"
+
+
+def phash_key(digest, hash_size, fast_decode):
+    return f"phash:{hash_size}:{'draft' if fast_decode else 'full'}:{digest}"
+
+
+class FeatureCache:
+    """SQLite键值缓存，每个线程使用独立连接"""
+
+    def __init__(self, path, max_mb=CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # 旧版本的缓存文件第一次打开时按现有条目算出总大小，之后由触发器维护
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) "
+                         "SELECT 'total_size', COALESCE(SUM(size), 0) FROM entries")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN "
+                         "UPDATE meta SET value = value + new.size WHERE name = 'total_size'; END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN "
+                         "UPDATE meta SET value = value + new.size - old.size WHERE name = 'total_size'; END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN "
+                         "UPDATE meta SET value = value - old.size WHERE name = 'total_size'; END")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        """批量读取，返回{键: 值}，命中的条目刷新最近使用时间"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        conn = self._connect()
+        # SQLite单条语句的参数个数有限，分批查询
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f"SELECT key, value FROM entries WHERE key IN ({placeholders})", chunk)
+            found.update(rows.fetchall())
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_many(self, items):
+        """批量写入{键: 值}，写入后检查总大小并淘汰"""
+        if not items:
+            return
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            # 用UPSERT而不是INSERT OR REPLACE：REPLACE删除旧行时不触发删除触发器，总大小会算错
+            conn.executemany(
+                "INSERT INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "last_used = excluded.last_used",
+                [(key, value, len(key) + len(value), now) for key, value in items.items()]
+            )
+        self._evict()
+
+    def _evict(self):
+        conn = self._connect()
+        total = conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * CACHE_EVICT_RATIO)
+        with conn:
+            # 按最近使用时间从旧到新累计，删除到释放足够空间为止
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY last_used")
+            doomed = []
+            freed = 0
+            for key, size in rows:
+                if freed >= target:
+                    break
+                doomed.append((key,))
+                freed += size
+            conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        logger.info(f"特征缓存超出 {self.max_bytes / 1024 / 1024:.0f} MB，淘汰了 {len(doomed)} 条最久未用的记录")
+
+    def get_probs(self, digests, model_digest):
+        """{摘要: 各类别概率列表}"""
+        keys = {probs_key(digest, model_digest): digest for digest in digests if digest}
+        return {keys[key]: json.loads(value) for key, value in self.get_many(keys).items()}
+
+    def put_probs(self, probs_by_digest, model_digest):
+        self.put_many({probs_key(digest, model_digest): json.dumps(probs)
+                       for digest, probs in probs_by_digest.items()})
+
+    def get_hashes(self, digests, hash_size, fast_decode):
+        """{摘要: 十六进制哈希}"""
+        keys = {phash_key(digest, hash_size, fast_decode): digest for digest in digests if digest}
+        return {keys[key]: value for key, value in self.get_many(keys).items()}
+
+    def put_hashes(self, hashes_by_digest, hash_size, fast_decode):
+        self.put_many({phash_key(digest, hash_size, fast_decode): hex_hash
+                       for digest, hex_hash in hashes_by_digest.items()})
+
+
+def open_feature_cache(path, max_mb=CACHE_MAX_MB):
+    """按路径复用缓存对象，path为空时返回None（不使用缓存），打不开时记录错误并返回None"""
+    if not path:
+        return None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            try:
+                cache = FeatureCache(path, max_mb)
+            except Exception as e:
+                logger.error(f"打开特征缓存 {path} 失败，本次不使用缓存: {str(e)}")
+                return None
+            _caches[path] = cache
+        return cache
+
+
+def iter_cached_hashes(image_infos, compute, cache=None, hash_size=8, fast_decode=True):
+    """按输入顺序产出(图片信息, 哈希值)
+
+    已带'phash'的图片（YOLO分类时用同一次解码算好的）直接使用，其次查缓存，
+    其余交给compute(待计算的图片列表)按顺序计算，结果写回缓存。
+    """
+    if cache is not None:
+        rest = [image_info for image_info in image_infos if 'phash' not in image_info]
+        digests = digest_images(rest)
+        hits = cache.get_hashes(digests, hash_size, fast_decode)
+        for image_info, digest in zip(rest, digests):
+            if digest in hits:
+                image_info['phash'] = imagehash.hex_to_hash(hits[digest])
+        if hits:
+            logger.info(f"特征缓存命中 {len(hits)} 张图片的哈希值")
+
+    pending = [image_info for image_info in image_infos if 'phash' not in image_info]
+    computed = iter(compute(pending))
+    new_hashes = {}
+    try:
+        for image_info in image_infos:
+            if 'phash' in image_info:
+                yield image_info, image_info['phash']
+                continue
+            _, hash_value = next(computed)
+            if hash_value is not None and image_info.get('content_digest'):
+                new_hashes[image_info['content_digest']] = str(hash_value)
+            yield image_info, hash_value
+    finally:
+        if cache is not None:
+            cache.put_hashes(new_hashes, hash_size, fast_decode)
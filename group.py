@@ -3,10 +3,13 @@ import shutil
 import zipfile
 import tempfile
 import csv
-from PIL import Image
-import imagehash
-from collections import defaultdict
 import logging
+from hash_index import group_hash_records
+from parallel_ingest import scan_zip_images_parallel, iter_image_hashes
+from feature_cache import open_feature_cache, iter_cached_hashes
+from image_hash import compute_phash
+from zip_reader import scan_zip_images, plan_zip_entries, new_scan_stats, log_scan_stats, dedupe_exact_images, with_duplicates, open_image_source, close_archives
+from output_store import OutputStore
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,12 +20,24 @@ INPUT_DIR = r"F:\75笔案件\75笔案件\果洛"  # 包含zip文件的目录
 OUTPUT_DIR = "similar_photos"  # 输出目录
 HASH_SIZE = 8  # 哈希大小（8=64位哈希）
 HASH_THRESHOLD = 5  # 汉明距离阈值（≤5视为相似）
+HASH_WORKERS = 0  # 分块比较哈希的线程数（0=使用全部CPU核心）
+CLUSTER_MODE = 'greedy'  # 分组方式：greedy=按种子逐张归组，components=连通分量（组号与遍历顺序无关）
 SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')  # 支持的图片格式
+STREAM_ZIP = True  # 直接从zip读取图片到内存，不解压到临时目录
+CHECK_IMAGE_MAGIC = False  # 是否读取文件头校验图片格式（扩展名不可信时开启）
+DEDUPE_EXACT = True  # 按zip中的大小和CRC32找出完全相同的图片，每组只解码处理一张
+INGEST_WORKERS = 1  # 并行读取zip和计算哈希的进程数（1=串行，0=全部CPU核心）
+FAST_HASH_DECODE = True  # 计算哈希时JPEG按DCT缩放解码成灰度小图，比完整解码快数倍，哈希差异不超过2位
+FEATURE_CACHE_PATH = "feature_cache.db"  # 特征缓存文件（YOLO概率与哈希，按图片内容寻址），为空则不使用缓存
+CACHE_MAX_MB = 512  # 特征缓存大小上限，超出后淘汰最久未用的记录
+OUTPUT_LINK_MODE = 'auto'  # 输出分组照片的方式：auto（依次尝试reflink、硬链接）/ reflink / hardlink / symlink / copy，不支持时自动退回复制
 
-def extract_zip_files(zip_dir):
+def extract_zip_files(zip_dir, stats=None):
     """从指定目录提取所有zip文件中的图片"""
     image_paths = []
     temp_dirs = []
+    if stats is None:
+        stats = new_scan_stats()
     
     # 遍历目录中的所有zip文件
     for root, _, files in os.walk(zip_dir):
@@ -38,23 +53,9 @@ def extract_zip_files(zip_dir):
                     
                     # 解压zip文件，处理中文编码
                     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        # 获取zip文件中的文件列表
-                        for zip_info in zip_ref.infolist():
+                        # 按中央目录只挑出图片条目解压，其余条目不解压
+                        for zip_info, filename in plan_zip_entries(zip_ref, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC):
                             try:
-                                # 尝试不同的编码方式处理文件名
-                                filename = None
-                                for encoding in ['utf-8', 'gbk', 'gb2312', 'cp437']:
-                                    try:
-                                        filename = zip_info.filename.encode('cp437').decode(encoding)
-                                        break
-                                    except (UnicodeDecodeError, UnicodeEncodeError):
-                                        continue
-                                
-                                if filename is None:
-                                    # 如果所有编码都失败，使用原始文件名
-                                    filename = zip_info.filename
-                                
-                                # 解压单个文件
                                 zip_ref.extract(zip_info, temp_dir)
                                 
                                 # 如果文件名包含中文且需要重命名
@@ -104,71 +105,71 @@ def extract_zip_files(zip_dir):
                     logger.error(f"处理zip文件 {zip_path} 时出错: {str(e)}")
                     continue
     
+    log_scan_stats(stats)
     logger.info(f"共提取了 {len(image_paths)} 张图片")
     return image_paths, temp_dirs
 
+def collect_images(zip_dir, stats=None):
+    """收集zip中的图片，STREAM_ZIP=False时退回解压到临时目录"""
+    if STREAM_ZIP:
+        if INGEST_WORKERS != 1:
+            return scan_zip_images_parallel(zip_dir, SUPPORTED_FORMATS, INGEST_WORKERS, stats, CHECK_IMAGE_MAGIC), []
+        return scan_zip_images(zip_dir, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC), []
+    return extract_zip_files(zip_dir, stats)
+
 def calculate_image_hash(image_info):
     """计算单张图片的哈希值"""
     try:
-        with Image.open(image_info['path']) as img:
-            # 转换为RGB模式（避免RGBA模式问题）
-            img = img.convert('RGB')
-            # 计算感知哈希
-            h = imagehash.phash(img, hash_size=HASH_SIZE)
-            return h
+        # 计算感知哈希（JPEG按DCT缩放快速解码）
+        return compute_phash(open_image_source(image_info), HASH_SIZE, FAST_HASH_DECODE)
     except Exception as e:
         logger.error(f"计算图片哈希值时出错 {image_info['path']}: {str(e)}")
         return None
 
+def compute_hashes(image_infos):
+    """逐张计算哈希，INGEST_WORKERS不为1时交给进程池并行计算，按输入顺序产出(图片信息, 哈希值)"""
+    if INGEST_WORKERS == 1:
+        return ((image_info, calculate_image_hash(image_info)) for image_info in image_infos)
+    return iter_image_hashes(image_infos, HASH_SIZE, INGEST_WORKERS, fast_decode=FAST_HASH_DECODE)
+
+def iter_hashes(image_infos):
+    """按输入顺序产出(图片信息, 哈希值)：分类时已算好或特征缓存命中的直接使用，其余交给compute_hashes"""
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    return iter_cached_hashes(image_infos, compute_hashes, cache, HASH_SIZE, FAST_HASH_DECODE)
+
 def find_similar_photos():
     """查找相似图片并分组"""
     # 创建输出目录
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
     # 提取zip文件中的图片
-    image_infos, temp_dirs = extract_zip_files(INPUT_DIR)
+    image_infos, temp_dirs = collect_images(INPUT_DIR)
     
     if not image_infos:
         logger.warning("没有找到任何图片文件")
         return
     
+    # 完全相同的图片只处理一张，结果分发给所有副本
+    if DEDUPE_EXACT:
+        image_infos = dedupe_exact_images(image_infos)
+    
     # 计算所有图片的哈希值
     logger.info("正在计算图片哈希值...")
     hashes = {}
-    for image_info in image_infos:
-        hash_value = calculate_image_hash(image_info)
+    for image_info, hash_value in iter_hashes(image_infos):
         if hash_value is not None:
-            hashes[image_info['path']] = {
-                'hash': hash_value,
-                'info': image_info
-            }
+            # 完全相同的副本直接沿用代表图片的哈希
+            for record in with_duplicates(image_info):
+                hashes[record['path']] = {
+                    'hash': hash_value,
+                    'info': record
+                }
     
     logger.info(f"成功计算了 {len(hashes)} 张图片的哈希值")
     
-    # 按相似度分组
+    # 按相似度分组（多索引哈希查找近邻，结果与逐张比较一致）
     logger.info("正在按相似度分组...")
-    groups = defaultdict(list)
-    processed = set()
-    
-    for path1, hash_data1 in hashes.items():
-        if path1 in processed:
-            continue
-        
-        # 创建新组
-        group_id = len(groups) + 1
-        groups[group_id].append(hash_data1['info'])
-        processed.add(path1)
-        
-        # 查找相似图片
-        for path2, hash_data2 in hashes.items():
-            if path2 in processed:
-                continue
-            
-            # 计算汉明距离
-            distance = hash_data1['hash'] - hash_data2['hash']
-            if distance <= HASH_THRESHOLD:
-                groups[group_id].append(hash_data2['info'])
-                processed.add(path2)
+    groups = group_hash_records(hashes, HASH_THRESHOLD, workers=HASH_WORKERS, clustering=CLUSTER_MODE)
     
     # 保存结果和生成CSV记录
     logger.info("正在保存分组结果...")
@@ -176,6 +177,8 @@ def find_similar_photos():
     
     # 准备CSV数据
     csv_data = []
+    # 按内容寻址输出：能链接时不复制，完全相同的副本只写出一次
+    store = OutputStore(OUTPUT_LINK_MODE)
     csv_headers = ['组别', '序号', '原始文件名', '新文件名', '原始ZIP路径', '来源ZIP文件', 'ZIP内相对路径', '目标路径']
     
     for group_id, image_infos in groups.items():
@@ -230,7 +233,7 @@ def find_similar_photos():
                 
                 # 复制文件
                 dest_path = os.path.join(group_dir, new_name)
-                shutil.copy2(image_info['path'], dest_path)
+                store.place_image(image_info, dest_path)
                 
                 # 添加到CSV数据
                 csv_data.append([
@@ -247,6 +250,8 @@ def find_similar_photos():
             except Exception as e:
                 logger.error(f"复制文件时出错 {image_info['path']}: {str(e)}")
     
+    store.log_summary()
+    
     # 生成CSV文件
     csv_path = os.path.join(OUTPUT_DIR, "图片分组记录.csv")
     try:
@@ -260,6 +265,7 @@ def find_similar_photos():
     
     # 清理临时目录
     logger.info("正在清理临时文件...")
+    close_archives(INPUT_DIR)
     for temp_dir in temp_dirs:
         try:
             shutil.rmtree(temp_dir)
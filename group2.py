@@ -3,11 +3,18 @@ import shutil
 import zipfile
 import tempfile
 import csv
-from PIL import Image
-import imagehash
-from collections import defaultdict
 import logging
-from ultralytics import YOLO
+from hash_index import group_hash_records, hash_to_int
+from parallel_ingest import scan_zip_images_parallel, iter_image_hashes
+from feature_cache import open_feature_cache, iter_cached_hashes
+from image_hash import compute_phash
+from classifier import classify_batches
+from hash_first import select_class2_hash_first
+from progress_events import NULL_PROGRESS
+from inference_backend import load_classifier, model_cache_key
+from zip_reader import scan_zip_images, plan_zip_entries, new_scan_stats, log_scan_stats, dedupe_exact_images, with_duplicates, open_image_source, close_archives, find_zip_files, list_archive_images
+from output_store import OutputStore
+from incremental_groups import IncrementalGroups, STATE_DIRNAME as INCREMENTAL_STATE_DIRNAME
 import glob
 
 # 配置日志
@@ -19,22 +26,44 @@ INPUT_DIR = r"F:\75笔案件\75笔案件\果洛"  # 包含zip文件的目录
 OUTPUT_DIR = "similar_photos_class2"  # 输出目录
 HASH_SIZE = 8  # 哈希大小（8=64位哈希）
 HASH_THRESHOLD = 5  # 汉明距离阈值（≤5视为相似）
+HASH_WORKERS = 0  # 分块比较哈希的线程数（0=使用全部CPU核心）
+CLUSTER_MODE = 'greedy'  # 分组方式：greedy=按种子逐张归组，components=连通分量（组号与遍历顺序无关）
 SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')  # 支持的图片格式
+STREAM_ZIP = True  # 直接从zip读取图片到内存，不解压到临时目录
+CHECK_IMAGE_MAGIC = False  # 是否读取文件头校验图片格式（扩展名不可信时开启）
+DEDUPE_EXACT = True  # 按zip中的大小和CRC32找出完全相同的图片，每组只解码处理一张
+INGEST_WORKERS = 1  # 并行读取zip和计算哈希的进程数（1=串行，0=全部CPU核心）
+FAST_HASH_DECODE = True  # 计算哈希时JPEG按DCT缩放解码成灰度小图，比完整解码快数倍，哈希差异不超过2位
+FEATURE_CACHE_PATH = "feature_cache.db"  # 特征缓存文件（YOLO概率与哈希，按图片内容寻址），为空则不使用缓存
+CACHE_MAX_MB = 512  # 特征缓存大小上限，超出后淘汰最久未用的记录
+SHARED_DECODE = True  # YOLO分类时顺便用同一次读取计算哈希，class2图片不再重复读取和解码
+YOLO_BATCH_SIZE = 16  # YOLO每批推理的图片数
+PREFETCH_WORKERS = 2  # 后台预取、解码下一批图片的线程数
+INFERENCE_BACKEND = 'torch'  # 分类推理后端：torch / onnx / onnx-int8 / openvino（非torch后端首次使用时导出best.onnx并缓存在模型旁边）
+INFERENCE_THREADS = 0  # onnx/openvino推理线程数（0=全部CPU核心）
+QUANT_DATASET_DIR = "dataset"  # onnx-int8的校准/验证数据集（split_dataset.py划分出的train/val目录）
+QUANT_AGREEMENT_FLOOR = 0.99  # INT8与FP32模型class2判定一致率低于此值时不启用INT8
+PIPELINE_ORDER = 'classify_first'  # classify_first=先YOLO分类再算哈希；hash_first=先算哈希按小半径分簇，每簇只对代表图片分类
+HASH_FIRST_RADIUS = 2  # hash_first的分簇半径（汉明距离），与代表距离达到该值的成员仍单独分类
+OUTPUT_LINK_MODE = 'auto'  # 输出分组照片的方式：auto（依次尝试reflink、硬链接）/ reflink / hardlink / symlink / copy，不支持时自动退回复制
 YOLO_MODEL_PATH = r"models\best.pt"  # YOLO模型路径
+INCREMENTAL = False  # 增量模式：只处理INPUT_DIR中新增的zip，并入OUTPUT_DIR已有的分组（状态保存在OUTPUT_DIR/.incremental）
 CLASS2_CONFIDENCE_THRESHOLD = 0.5  # class2置信度阈值
 
 def load_yolo_model():
     """加载YOLO分类模型"""
     try:
-        model = YOLO(YOLO_MODEL_PATH)
-        logger.info(f"YOLO模型加载成功: {YOLO_MODEL_PATH}")
+        model = load_classifier(YOLO_MODEL_PATH, INFERENCE_BACKEND, INFERENCE_THREADS,
+                                    QUANT_DATASET_DIR, QUANT_AGREEMENT_FLOOR, CLASS2_CONFIDENCE_THRESHOLD)
+        logger.info(f"YOLO模型加载成功: {YOLO_MODEL_PATH}（{getattr(model, 'backend', 'torch')}）")
         return model
     except Exception as e:
         logger.error(f"加载YOLO模型失败: {str(e)}")
         return None
 
-def classify_images_with_yolo(model, image_paths):
-    """使用YOLO模型对图片进行分类，筛选出class2图片"""
+def classify_images_with_yolo(model, image_paths, progress=None):
+    """使用YOLO模型对图片进行分类，筛选出class2图片；progress为任务进度通道（可为None）"""
+    progress = progress or NULL_PROGRESS
     if model is None:
         logger.error("YOLO模型未加载，跳过分类步骤")
         return image_paths
@@ -42,38 +71,92 @@ def classify_images_with_yolo(model, image_paths):
     logger.info("开始使用YOLO模型进行图片分类...")
     class2_images = []
     total_images = len(image_paths)
+    progress.stage('classify', total_images)
     
-    for i, image_info in enumerate(image_paths):
-        try:
-            # 预测单张图片
-            results = model(image_info['path'])
-            result = results[0]  # 获取第一个结果
+    # 先查特征缓存，未命中的按批推理，后台线程同时预取并预处理下一批
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    model_digest = model_cache_key(model, YOLO_MODEL_PATH) if cache is not None else None
+    batches = classify_batches(model, image_paths, YOLO_BATCH_SIZE, SHARED_DECODE, PREFETCH_WORKERS,
+                               cache=cache, model_digest=model_digest, hash_size=HASH_SIZE)
+    for i, (image_info, phash, probs, error) in enumerate(batches):
+        if error is not None:
+            logger.error(f"预测图片时出错 {image_info['path']}: {str(error)}")
+        elif probs is None:
+            logger.warning(f"图片 {i+1}/{total_images}: {os.path.basename(image_info['path'])} - 无法获取预测结果")
+        else:
+            # 获取class1和class2的概率
+            class1_prob, class2_prob = probs[0], probs[1]
             
-            if result.probs is not None:
-                # 获取class1和class2的概率
-                class1_prob = result.probs.data[0].item()
-                class2_prob = result.probs.data[1].item()
-                
-                # 如果class2概率大于阈值，则保留该图片
-                if class2_prob >= CLASS2_CONFIDENCE_THRESHOLD:
-                    class2_images.append(image_info)
-                    logger.info(f"图片 {i+1}/{total_images}: {os.path.basename(image_info['path'])} - class2概率: {class2_prob:.3f} ✓")
-                else:
-                    logger.info(f"图片 {i+1}/{total_images}: {os.path.basename(image_info['path'])} - class2概率: {class2_prob:.3f} ✗ (低于阈值)")
+            # 如果class2概率大于阈值，则保留该图片
+            if class2_prob >= CLASS2_CONFIDENCE_THRESHOLD:
+                if phash is not None:
+                    # 读取图片时已算好哈希，计算哈希阶段直接沿用
+                    image_info['phash'] = phash
+                class2_images.append(image_info)
+                logger.debug(f"图片 {i+1}/{total_images}: {os.path.basename(image_info['path'])} - class2概率: {class2_prob:.3f} ✓")
             else:
-                logger.warning(f"图片 {i+1}/{total_images}: {os.path.basename(image_info['path'])} - 无法获取预测结果")
-                
-        except Exception as e:
-            logger.error(f"预测图片时出错 {image_info['path']}: {str(e)}")
-            continue
+                logger.debug(f"图片 {i+1}/{total_images}: {os.path.basename(image_info['path'])} - class2概率: {class2_prob:.3f} ✗ (低于阈值)")
+        
+        progress.advance(images_classified=1)
+        if (i + 1) % YOLO_BATCH_SIZE == 0 or i + 1 == total_images:
+            logger.info(f"已分类 {i+1}/{total_images} 张图片，其中class2 {len(class2_images)} 张")
     
     logger.info(f"YOLO分类完成！从 {total_images} 张图片中筛选出 {len(class2_images)} 张class2图片")
     return class2_images
 
-def extract_zip_files(zip_dir):
+def classify_hash_first(model, image_infos, progress=None):
+    """先算哈希并按小半径分簇，每簇只对代表图片运行YOLO，结论分发给簇内成员"""
+    if model is None:
+        logger.error("YOLO模型未加载，跳过分类步骤")
+        return image_infos
+    
+    progress = progress or NULL_PROGRESS
+    logger.info("正在计算图片哈希值（先哈希后分类）...")
+    progress.stage('hash', len(image_infos))
+    hashed_infos = []
+    hash_values = []
+    for image_info, hash_value in iter_hashes(image_infos):
+        progress.advance(images_hashed=1)
+        if hash_value is not None:
+            # 分组时直接沿用，不再重新计算
+            image_info['phash'] = hash_value
+            hashed_infos.append(image_info)
+            hash_values.append(hash_value)
+    
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    model_digest = model_cache_key(model, YOLO_MODEL_PATH) if cache is not None else None
+    
+    def predict(infos):
+        class2_probs = []
+        for image_info, _, probs, error in classify_batches(model, infos, YOLO_BATCH_SIZE, False, PREFETCH_WORKERS,
+                                                             cache=cache, model_digest=model_digest):
+            if error is not None:
+                logger.error(f"预测图片时出错 {image_info['path']}: {str(error)}")
+            class2_probs.append(probs[1] if probs is not None else None)
+            progress.advance(images_classified=1)
+        return class2_probs
+    
+    # 沿用代表结论的图片不再分类，阶段结束时直接计为完成
+    progress.stage('classify', len(hashed_infos))
+    class2_images = select_class2_hash_first(hashed_infos, hash_values, predict, CLASS2_CONFIDENCE_THRESHOLD,
+                                             radius=HASH_FIRST_RADIUS, recheck_distance=HASH_FIRST_RADIUS,
+                                             workers=HASH_WORKERS)
+    progress.finish_stage()
+    logger.info(f"YOLO分类完成！从 {len(image_infos)} 张图片中筛选出 {len(class2_images)} 张class2图片")
+    return class2_images
+
+def select_class2_images(model, image_infos, progress=None):
+    """按PIPELINE_ORDER选择先分类还是先哈希"""
+    if PIPELINE_ORDER == 'hash_first':
+        return classify_hash_first(model, image_infos, progress)
+    return classify_images_with_yolo(model, image_infos, progress)
+
+def extract_zip_files(zip_dir, stats=None):
     """从指定目录提取所有zip文件中的图片"""
     image_paths = []
     temp_dirs = []
+    if stats is None:
+        stats = new_scan_stats()
     
     # 遍历目录中的所有zip文件
     for root, _, files in os.walk(zip_dir):
@@ -89,23 +172,9 @@ def extract_zip_files(zip_dir):
                     
                     # 解压zip文件，处理中文编码
                     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        # 获取zip文件中的文件列表
-                        for zip_info in zip_ref.infolist():
+                        # 按中央目录只挑出图片条目解压，其余条目不解压
+                        for zip_info, filename in plan_zip_entries(zip_ref, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC):
                             try:
-                                # 尝试不同的编码方式处理文件名
-                                filename = None
-                                for encoding in ['utf-8', 'gbk', 'gb2312', 'cp437']:
-                                    try:
-                                        filename = zip_info.filename.encode('cp437').decode(encoding)
-                                        break
-                                    except (UnicodeDecodeError, UnicodeEncodeError):
-                                        continue
-                                
-                                if filename is None:
-                                    # 如果所有编码都失败，使用原始文件名
-                                    filename = zip_info.filename
-                                
-                                # 解压单个文件
                                 zip_ref.extract(zip_info, temp_dir)
                                 
                                 # 如果文件名包含中文且需要重命名
@@ -155,22 +224,103 @@ def extract_zip_files(zip_dir):
                     logger.error(f"处理zip文件 {zip_path} 时出错: {str(e)}")
                     continue
     
+    log_scan_stats(stats)
     logger.info(f"共提取了 {len(image_paths)} 张图片")
     return image_paths, temp_dirs
 
+def collect_images(zip_dir, stats=None):
+    """收集zip中的图片，STREAM_ZIP=False时退回解压到临时目录"""
+    if STREAM_ZIP:
+        if INGEST_WORKERS != 1:
+            return scan_zip_images_parallel(zip_dir, SUPPORTED_FORMATS, INGEST_WORKERS, stats, CHECK_IMAGE_MAGIC), []
+        return scan_zip_images(zip_dir, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC), []
+    return extract_zip_files(zip_dir, stats)
+
 def calculate_image_hash(image_info):
     """计算单张图片的哈希值"""
     try:
-        with Image.open(image_info['path']) as img:
-            # 转换为RGB模式（避免RGBA模式问题）
-            img = img.convert('RGB')
-            # 计算感知哈希
-            h = imagehash.phash(img, hash_size=HASH_SIZE)
-            return h
+        # 计算感知哈希（JPEG按DCT缩放快速解码）
+        return compute_phash(open_image_source(image_info), HASH_SIZE, FAST_HASH_DECODE)
     except Exception as e:
         logger.error(f"计算图片哈希值时出错 {image_info['path']}: {str(e)}")
         return None
 
+def compute_hashes(image_infos):
+    """逐张计算哈希，INGEST_WORKERS不为1时交给进程池并行计算，按输入顺序产出(图片信息, 哈希值)"""
+    if INGEST_WORKERS == 1:
+        return ((image_info, calculate_image_hash(image_info)) for image_info in image_infos)
+    return iter_image_hashes(image_infos, HASH_SIZE, INGEST_WORKERS, fast_decode=FAST_HASH_DECODE)
+
+def iter_hashes(image_infos):
+    """按输入顺序产出(图片信息, 哈希值)：分类时已算好或特征缓存命中的直接使用，其余交给compute_hashes"""
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    return iter_cached_hashes(image_infos, compute_hashes, cache, HASH_SIZE, FAST_HASH_DECODE)
+
+CSV_FILENAME = "class2图片分组记录.csv"
+CSV_HEADERS = ['组别', '序号', '原始文件名', '新文件名', '原始ZIP路径', '来源ZIP文件', 'ZIP内相对路径', '目标路径', 'YOLO分类结果']
+
+def write_group_image(store, group_dir, group_id, seq, image_info):
+    """把组内第seq张图片重命名后写到组目录，返回CSV记录，出错时返回None"""
+    try:
+        # 获取原始文件名
+        filename = os.path.basename(image_info['path'])
+        name, ext = os.path.splitext(filename)
+    
+        # 获取zip文件名（不含扩展名）
+        zip_name = os.path.splitext(image_info['source_zip'])[0]
+    
+        # 获取相对路径中的关键信息（处理中文乱码）
+        relative_path = image_info['relative_path']
+        path_parts = relative_path.split('\\')
+    
+        # 提取关键路径信息（最多取3层目录）
+        key_path_info = []
+        for part in path_parts[:-1]:  # 排除文件名
+            if part and len(key_path_info) < 3:
+                # 尝试处理中文编码
+                try:
+                    # 如果包含乱码字符，尝试修复
+                    if '╨' in part or '╧' in part or '╥' in part:
+                        # 这是典型的GBK编码问题，尝试修复
+                        fixed_part = part.encode('latin1').decode('gbk', errors='ignore')
+                    else:
+                        fixed_part = part
+                    key_path_info.append(fixed_part)
+                except:
+                    key_path_info.append(part)
+    
+        # 构建新文件名：组ID_序号_来源zip_路径信息_原文件名
+        path_suffix = '_'.join(key_path_info) if key_path_info else 'root'
+        # 限制文件名长度，避免过长
+        if len(path_suffix) > 50:
+            path_suffix = path_suffix[:50] + '...'
+    
+        new_name = f"{group_id:03d}_{seq:03d}_{zip_name}_{path_suffix}_{name}{ext}"
+    
+        # 清理文件名中的非法字符
+        new_name = "".join(c for c in new_name if c.isalnum() or c in ('_', '-', '.', '(', ')', '['))
+    
+        # 复制文件
+        dest_path = os.path.join(group_dir, new_name)
+        store.place_image(image_info, dest_path)
+    
+        # CSV记录
+        return [
+            f"group_{group_id}",  # 组别
+            seq,  # 序号
+            filename,  # 原始文件名
+            new_name,  # 新文件名
+            image_info['original_zip_path'],  # 原始ZIP路径
+            image_info['source_zip'],  # 来源ZIP文件
+            image_info['relative_path'],  # ZIP内相对路径
+            dest_path,  # 目标路径
+            "class2"  # YOLO分类结果
+        ]
+    
+    except Exception as e:
+        logger.error(f"复制文件时出错 {image_info['path']}: {str(e)}")
+        return None
+
 def find_similar_photos_with_yolo():
     """使用YOLO预筛选后查找相似图片并分组"""
     # 创建输出目录
@@ -180,56 +330,41 @@ def find_similar_photos_with_yolo():
     yolo_model = load_yolo_model()
     
     # 提取zip文件中的图片
-    image_infos, temp_dirs = extract_zip_files(INPUT_DIR)
+    image_infos, temp_dirs = collect_images(INPUT_DIR)
     
     if not image_infos:
         logger.warning("没有找到任何图片文件")
         return
     
+    # 完全相同的图片只处理一张，结果分发给所有副本
+    if DEDUPE_EXACT:
+        image_infos = dedupe_exact_images(image_infos)
+    
     # 使用YOLO模型筛选class2图片
-    class2_images = classify_images_with_yolo(yolo_model, image_infos)
+    class2_images = select_class2_images(yolo_model, image_infos)
     
     if not class2_images:
         logger.warning("没有找到任何class2图片")
+        close_archives(INPUT_DIR)
         return
     
     # 计算所有class2图片的哈希值
     logger.info("正在计算class2图片哈希值...")
     hashes = {}
-    for image_info in class2_images:
-        hash_value = calculate_image_hash(image_info)
+    for image_info, hash_value in iter_hashes(class2_images):
         if hash_value is not None:
-            hashes[image_info['path']] = {
-                'hash': hash_value,
-                'info': image_info
-            }
+            # 完全相同的副本直接沿用代表图片的哈希
+            for record in with_duplicates(image_info):
+                hashes[record['path']] = {
+                    'hash': hash_value,
+                    'info': record
+                }
     
     logger.info(f"成功计算了 {len(hashes)} 张class2图片的哈希值")
     
-    # 按相似度分组
+    # 按相似度分组（多索引哈希查找近邻，结果与逐张比较一致）
     logger.info("正在按相似度分组...")
-    groups = defaultdict(list)
-    processed = set()
-    
-    for path1, hash_data1 in hashes.items():
-        if path1 in processed:
-            continue
-        
-        # 创建新组
-        group_id = len(groups) + 1
-        groups[group_id].append(hash_data1['info'])
-        processed.add(path1)
-        
-        # 查找相似图片
-        for path2, hash_data2 in hashes.items():
-            if path2 in processed:
-                continue
-            
-            # 计算汉明距离
-            distance = hash_data1['hash'] - hash_data2['hash']
-            if distance <= HASH_THRESHOLD:
-                groups[group_id].append(hash_data2['info'])
-                processed.add(path2)
+    groups = group_hash_records(hashes, HASH_THRESHOLD, workers=HASH_WORKERS, clustering=CLUSTER_MODE)
     
     # 保存结果和生成CSV记录
     logger.info("正在保存分组结果...")
@@ -237,7 +372,8 @@ def find_similar_photos_with_yolo():
     
     # 准备CSV数据
     csv_data = []
-    csv_headers = ['组别', '序号', '原始文件名', '新文件名', '原始ZIP路径', '来源ZIP文件', 'ZIP内相对路径', '目标路径', 'YOLO分类结果']
+    # 按内容寻址输出：能链接时不复制，完全相同的副本只写出一次
+    store = OutputStore(OUTPUT_LINK_MODE)
     
     for group_id, image_infos in groups.items():
         if len(image_infos) < 2:  # 跳过单张图片的组
@@ -250,71 +386,18 @@ def find_similar_photos_with_yolo():
         
         # 复制图片并重命名（避免覆盖）
         for i, image_info in enumerate(image_infos):
-            try:
-                # 获取原始文件名
-                filename = os.path.basename(image_info['path'])
-                name, ext = os.path.splitext(filename)
-                
-                # 获取zip文件名（不含扩展名）
-                zip_name = os.path.splitext(image_info['source_zip'])[0]
-                
-                # 获取相对路径中的关键信息（处理中文乱码）
-                relative_path = image_info['relative_path']
-                path_parts = relative_path.split('\\')
-                
-                # 提取关键路径信息（最多取3层目录）
-                key_path_info = []
-                for part in path_parts[:-1]:  # 排除文件名
-                    if part and len(key_path_info) < 3:
-                        # 尝试处理中文编码
-                        try:
-                            # 如果包含乱码字符，尝试修复
-                            if '╨' in part or '╧' in part or '╥' in part:
-                                # 这是典型的GBK编码问题，尝试修复
-                                fixed_part = part.encode('latin1').decode('gbk', errors='ignore')
-                            else:
-                                fixed_part = part
-                            key_path_info.append(fixed_part)
-                        except:
-                            key_path_info.append(part)
-                
-                # 构建新文件名：组ID_序号_来源zip_路径信息_原文件名
-                path_suffix = '_'.join(key_path_info) if key_path_info else 'root'
-                # 限制文件名长度，避免过长
-                if len(path_suffix) > 50:
-                    path_suffix = path_suffix[:50] + '...'
-                
-                new_name = f"{group_id:03d}_{i+1:03d}_{zip_name}_{path_suffix}_{name}{ext}"
-                
-                # 清理文件名中的非法字符
-                new_name = "".join(c for c in new_name if c.isalnum() or c in ('_', '-', '.', '(', ')', '['))
-                
-                # 复制文件
-                dest_path = os.path.join(group_dir, new_name)
-                shutil.copy2(image_info['path'], dest_path)
-                
-                # 添加到CSV数据
-                csv_data.append([
-                    f"group_{group_id}",  # 组别
-                    i + 1,  # 序号
-                    filename,  # 原始文件名
-                    new_name,  # 新文件名
-                    image_info['original_zip_path'],  # 原始ZIP路径
-                    image_info['source_zip'],  # 来源ZIP文件
-                    image_info['relative_path'],  # ZIP内相对路径
-                    dest_path,  # 目标路径
-                    "class2"  # YOLO分类结果
-                ])
-                
-            except Exception as e:
-                logger.error(f"复制文件时出错 {image_info['path']}: {str(e)}")
+            row = write_group_image(store, group_dir, group_id, i + 1, image_info)
+            if row:
+                csv_data.append(row)
+    
+    store.log_summary()
     
     # 生成CSV文件
-    csv_path = os.path.join(OUTPUT_DIR, "class2图片分组记录.csv")
+    csv_path = os.path.join(OUTPUT_DIR, CSV_FILENAME)
     try:
         with open(csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(csv_headers)
+            writer.writerow(CSV_HEADERS)
             writer.writerows(csv_data)
         logger.info(f"CSV记录文件已生成: {csv_path}")
     except Exception as e:
@@ -322,6 +405,7 @@ def find_similar_photos_with_yolo():
     
     # 清理临时目录
     logger.info("正在清理临时文件...")
+    close_archives(INPUT_DIR)
     for temp_dir in temp_dirs:
         try:
             shutil.rmtree(temp_dir)
@@ -334,5 +418,96 @@ def find_similar_photos_with_yolo():
     total_images = sum(len(g) for g in groups.values() if len(g) > 1)
     logger.info(f"总共处理了 {total_images} 张相似图片（仅class2）")
 
+def write_incremental_output(state):
+    """按增量状态整组重写有变化的组，删除被合并的组，返回写出的记录数
+
+    增量模式的CSV记录写在各组文件夹内（group_N/class2图片分组记录.csv），只重写有变化的组，
+    不读取、不改写其他组的记录。全部写完后才清除状态中的待写出记录，中途中断时下次运行重新写这些组，结果与一次写完相同。
+    """
+    pending = state.pending_output()
+    members = state.group_members(pending['groups'])
+    for group_id in pending['removed'] + pending['groups']:
+        shutil.rmtree(os.path.join(OUTPUT_DIR, f"group_{group_id}"), ignore_errors=True)
+    
+    store = OutputStore(OUTPUT_LINK_MODE)
+    written = 0
+    for group_id in pending['groups']:
+        group_dir = os.path.join(OUTPUT_DIR, f"group_{group_id}")
+        os.makedirs(group_dir, exist_ok=True)
+        csv_data = []
+        for i, image_info in enumerate(members[group_id]):
+            row = write_group_image(store, group_dir, group_id, i + 1, image_info)
+            if row:
+                csv_data.append(row)
+        with open(os.path.join(group_dir, CSV_FILENAME), 'w', newline='', encoding='utf-8-sig') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(CSV_HEADERS)
+            writer.writerows(csv_data)
+        written += len(csv_data)
+    store.log_summary()
+    
+    # 旧版本在输出目录顶层保存全部记录，已不再更新
+    legacy_csv = os.path.join(OUTPUT_DIR, CSV_FILENAME)
+    if os.path.exists(legacy_csv):
+        logger.warning(f"删除旧版本的汇总CSV {legacy_csv}，各组的记录在组文件夹内")
+        os.remove(legacy_csv)
+    
+    state.finish_output()
+    close_archives()
+    return written
+
+def find_similar_photos_incremental():
+    """增量模式：只分类、哈希新增zip中的图片，与已有分组合并后只重写有变化的组（含组内的CSV记录）"""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    list_archive = lambda zip_path: list_archive_images(zip_path, SUPPORTED_FORMATS, None, CHECK_IMAGE_MAGIC)
+    state = IncrementalGroups(os.path.join(OUTPUT_DIR, INCREMENTAL_STATE_DIRNAME), HASH_THRESHOLD, list_archive, INPUT_DIR)
+    
+    if state.pending_output():
+        logger.warning("上次写出分组结果时中断，先补写有变化的组")
+        write_incremental_output(state)
+    
+    zip_paths = state.pending_archives(find_zip_files(INPUT_DIR))
+    if not zip_paths:
+        logger.info("没有新增的zip文件")
+        return
+    logger.info(f"发现 {len(zip_paths)} 个新增的zip文件")
+    
+    # 只读取新增zip中的图片（增量模式始终直接从zip读取）
+    stats = new_scan_stats()
+    image_infos = []
+    for zip_path in zip_paths:
+        logger.info(f"正在处理zip文件: {zip_path}")
+        try:
+            image_infos.extend(list_archive_images(zip_path, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC))
+        except Exception as e:
+            logger.error(f"处理zip文件 {zip_path} 时出错: {str(e)}")
+    log_scan_stats(stats)
+    
+    if DEDUPE_EXACT:
+        image_infos = dedupe_exact_images(image_infos)
+    
+    class2_images = select_class2_images(load_yolo_model(), image_infos) if image_infos else []
+    
+    logger.info("正在计算新增class2图片哈希值...")
+    new_images, values = [], []
+    for image_info, hash_value in iter_hashes(class2_images):
+        if hash_value is not None:
+            for record in with_duplicates(image_info):
+                new_images.append(record)
+                values.append(hash_to_int(hash_value))
+    logger.info(f"新增 {len(new_images)} 张class2图片")
+    close_archives(INPUT_DIR)
+    
+    # 先与已有分组合并并写入状态，再重写有变化的组
+    changes = state.merge(new_images, values)
+    state.commit(new_images, values, zip_paths)
+    written = write_incremental_output(state) if state.pending_output() else 0
+    
+    merged = sum(len(change['removed_groups']) for change in changes)
+    logger.info(f"增量处理完成！{len(changes)} 组有变化（合并了 {merged} 个旧组），重写了 {written} 条CSV记录")
+
 if __name__ == "__main__":
-    find_similar_photos_with_yolo() 
\ No newline at end of file
+    if INCREMENTAL:
+        find_similar_photos_incremental()
+    else:
+        find_similar_photos_with_yolo() 
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""先哈希、后分类的流水线
+
+近似重复的照片内容几乎相同，逐张跑YOLO大多是重复劳动。这里先给所有图片算哈希，
+按很小的半径分簇（种子+扫描，簇内每张与种子的距离都不超过半径），
+只对每簇的种子（代表图片）做分类，结论分发给簇内其他图片。
+
+以下成员不沿用代表的结论，单独再分类一次：
+- 代表的class2概率离阈值太近（在PROB_MARGIN以内），结论本身不可靠；
+- 成员与代表的汉明距离达到RECHECK_DISTANCE，已在簇的边缘；
+- 代表分类失败。
+"""
+import logging
+import numpy as np
+from hash_index import pack_hashes, group_similar, popcount64
+
+logger = logging.getLogger(__name__)
+
+HASH_FIRST_RADIUS = 2  # 分簇半径（汉明距离）
+RECHECK_DISTANCE = 2  # 与代表的距离达到该值的成员单独分类
+PROB_MARGIN = 0.1  # 代表的class2概率与阈值相差不超过该值时，整簇成员单独分类
+
+
+def hash_first_probs(packed, predict, threshold, radius=HASH_FIRST_RADIUS, recheck_distance=RECHECK_DISTANCE,
+                     margin=PROB_MARGIN, workers=None):
+    """对uint64哈希数组分簇并分类，返回(各图片的class2概率, 是否得出结论)，未得出结论的概率为NaN
+
+    predict(下标数组)按顺序返回这些图片的class2概率，分类失败的为None。
+    """
+    n = len(packed)
+    if n == 0:
+        return np.zeros(0), np.zeros(0, dtype=bool)
+    clusters = list(group_similar(packed, radius, workers=workers).values())
+    representatives = [members[0] for members in clusters]
+    logger.info(f"{n} 张图片按半径 {radius} 分成 {len(clusters)} 簇，先对每簇代表图片分类")
+
+    probs = np.full(n, np.nan)
+    for index, prob in zip(representatives, predict(np.array(representatives, dtype=np.intp))):
+        if prob is not None:
+            probs[index] = prob
+
+    decided = np.zeros(n, dtype=bool)
+    decided[representatives] = ~np.isnan(probs[representatives])
+    inherited = 0
+    recheck = []
+    for members in clusters:
+        seed, others = members[0], np.array(members[1:], dtype=np.intp)
+        if not others.size:
+            continue
+        seed_prob = probs[seed]
+        if np.isnan(seed_prob) or abs(seed_prob - threshold) <= margin:
+            recheck.extend(others.tolist())
+            continue
+        distances = popcount64(packed[others] ^ packed[seed])
+        near = others[distances < recheck_distance]
+        probs[near] = seed_prob
+        decided[near] = True
+        inherited += len(near)
+        recheck.extend(others[distances >= recheck_distance].tolist())
+
+    if recheck:
+        recheck.sort()
+        logger.info(f"{len(recheck)} 张图片靠近阈值或簇边缘，单独分类")
+        for index, prob in zip(recheck, predict(np.array(recheck, dtype=np.intp))):
+            if prob is not None:
+                probs[index] = prob
+                decided[index] = True
+
+    classified = len(representatives) + len(recheck)
+    logger.info(f"实际分类 {classified} 张，{inherited} 张沿用代表图片的结论"
+                f"（节省 {inherited / n * 100:.1f}% 的推理）")
+    return probs, decided
+
+
+def select_class2_hash_first(image_infos, hash_values, predict, threshold,
+                             radius=HASH_FIRST_RADIUS, recheck_distance=RECHECK_DISTANCE,
+                             margin=PROB_MARGIN, workers=None):
+    """返回判定为class2的图片（保持输入顺序）
+
+    hash_values与image_infos一一对应；predict(图片列表)按顺序返回每张的class2概率，
+    分类失败的为None。得出结论的图片在'class2_prob'中记下（自己或沿用代表的）class2概率。
+    """
+    if not image_infos:
+        return []
+    probs, decided = hash_first_probs(pack_hashes(hash_values), lambda indices: predict([image_infos[i] for i in indices]),
+                                      threshold, radius, recheck_distance, margin, workers)
+    for index in np.flatnonzero(decided):
+        image_infos[index]['class2_prob'] = float(probs[index])
+    return [image_infos[index] for index in np.flatnonzero(decided & (probs >= threshold))]
@@ -0,0 +1,516 @@
+"""感知哈希相似度索引
+
+把64位pHash打包成uint64数组，用多索引哈希(MIH)找出汉明距离不超过阈值的所有图片对，
+替代原先逐张比较ImageHash的O(n²)双重循环。图片较少或阈值较大时改用分块的
+异或+popcount暴力比较，可以多线程并行。
+"""
+import os
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+HASH_BITS = 64
+# 逐块展开候选对时每块处理的行数，限制临时数组的大小
+BLOCK_ROWS = 1 << 16
+# 段宽不超过这么多位时用稠密的桶起点表代替二分查找
+DENSE_BUCKET_BITS = 24
+# 暴力比较按块进行，一块异或结果约1MB，能留在L2缓存里
+KERNEL_BLOCK_ROWS = 128
+KERNEL_BLOCK_COLS = 1024
+# 索引核对一个候选的开销约为分块暴力比较一对的多少倍，用于在两者之间选择
+INDEX_CANDIDATE_COST = 20
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_HAS_NATIVE_POPCOUNT = hasattr(np, 'bitwise_count')
+
+
+def hash_to_int(image_hash):
+    """把imagehash.ImageHash转换成64位整数"""
+    bits = np.asarray(image_hash.hash, dtype=bool).flatten()
+    if bits.size != HASH_BITS:
+        raise ValueError(f"只支持64位哈希(HASH_SIZE=8)，当前为 {bits.size} 位")
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def pack_hashes(image_hashes):
+    """把一组ImageHash打包成uint64数组"""
+    return np.fromiter((hash_to_int(h) for h in image_hashes), dtype=np.uint64, count=len(image_hashes))
+
+
+def _table_popcount64(values):
+    """查表法：按字节查256项的表再求和"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    counts = _POPCOUNT_TABLE[values.view(np.uint8)]
+    return counts.reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def popcount64(values):
+    """逐元素统计uint64中1的个数，numpy>=2.0用原生popcount，旧版本回退到查表"""
+    if _HAS_NATIVE_POPCOUNT:
+        return np.bitwise_count(values)
+    return _table_popcount64(values)
+
+
+def _chunk_widths(n_chunks):
+    """把64位尽量均分成n_chunks段，返回每段的位数"""
+    return [HASH_BITS // n_chunks + (1 if c < HASH_BITS % n_chunks else 0) for c in range(n_chunks)]
+
+
+def _probe_masks(width, radius):
+    """段内所有权重不超过radius的翻转掩码"""
+    masks = [0]
+    for k in range(1, radius + 1):
+        for bits in combinations(range(width), k):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.uint64)
+
+
+def plan_chunks(n, threshold, method='auto'):
+    """按估算的每张图片候选数选择分段数，返回None表示改用分块暴力比较
+
+    鸽巢原理：切成m段后，距离≤threshold的两个哈希至少有一段距离≤threshold//m，
+    所以每段只需在段内半径threshold//m的邻域里查找。段越多桶越大，段越少探测越多。
+    method为'index'/'kernel'时强制使用索引/暴力比较，'auto'按估算自动选择。
+    """
+    if method not in ('auto', 'index', 'kernel'):
+        raise ValueError(f"未知的近邻查找方式: {method}")
+    if method == 'kernel':
+        return None
+    best_cost, best_chunks = None, None
+    for n_chunks in range(1, min(threshold + 1, HASH_BITS) + 1):
+        radius = threshold // n_chunks
+        cost = 0
+        for width in _chunk_widths(n_chunks):
+            probes = sum(comb(width, k) for k in range(radius + 1))
+            cost += probes * (1 + n / 2 ** width)
+        if best_cost is None or cost < best_cost:
+            best_cost, best_chunks = cost, n_chunks
+    if method == 'auto' and best_cost * INDEX_CANDIDATE_COST >= n / 2:
+        return None
+    return best_chunks
+
+
+def _expand_ranges(lo, hi):
+    """把每行的[lo, hi)区间展开成(行号, 位置)两个平铺数组"""
+    counts = hi - lo
+    rows = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    return rows, offsets + np.arange(counts.sum())
+
+
+def _bucket_ranges(chunk, probe_keys):
+    """返回每个探测键在排序表中的[lo, hi)区间"""
+    if chunk['starts'] is not None:
+        probe_keys = probe_keys.astype(np.intp)
+        return chunk['starts'][probe_keys], chunk['starts'][probe_keys + 1]
+    # 与排序表同类型比较，避免searchsorted把整张表转换成公共类型
+    probe_keys = probe_keys.astype(chunk['sorted_key'].dtype)
+    lo = np.searchsorted(chunk['sorted_key'], probe_keys, side='left')
+    hi = np.searchsorted(chunk['sorted_key'], probe_keys, side='right')
+    return lo, hi
+
+
+class HashIndex:
+    """多索引哈希(MIH)：分段建排序表，段内按小半径探测召回候选，再用完整哈希核对距离"""
+
+    def __init__(self, hashes, threshold, method='auto', workers=None):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.threshold = int(threshold)
+        self.workers = workers
+        n_chunks = plan_chunks(len(self.hashes), self.threshold, method)
+        self.use_index = n_chunks is not None
+        self.chunk_radius = self.threshold // n_chunks if self.use_index else None
+        self._chunks = []
+        shift = 0
+        for width in (_chunk_widths(n_chunks) if self.use_index else []):
+            mask = (1 << width) - 1
+            key = (self.hashes >> np.uint64(shift)) & np.uint64(mask)
+            order = np.argsort(key, kind='stable')
+            starts = None
+            if width <= DENSE_BUCKET_BITS and mask < 64 * len(key):
+                starts = np.zeros(mask + 2, dtype=np.int32 if len(key) < 2 ** 31 else np.int64)
+                np.cumsum(np.bincount(key.astype(np.intp), minlength=mask + 1), out=starts[1:])
+            self._chunks.append({
+                'shift': shift,
+                'width': width,
+                'mask': mask,
+                'key': key,
+                'order': order,
+                'sorted_key': key[order],
+                'starts': starts,
+                'probes': _probe_masks(width, self.chunk_radius),
+            })
+            shift += width
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def save(self, prefix):
+        """把排序表保存为prefix.*.npy，最后写prefix.json；load()时按内存映射读回，不必重新排序"""
+        chunks = []
+        for c, chunk in enumerate(self._chunks):
+            # 不到2^32条时下标、不超过32位的段取值都按uint32保存；有稠密桶起点表时不需要排序后的段取值
+            np.save(f'{prefix}.order{c}.npy', chunk['order'].astype(np.uint32 if len(self.hashes) < 2 ** 32 else np.int64))
+            if chunk['starts'] is not None:
+                np.save(f'{prefix}.starts{c}.npy', chunk['starts'])
+            else:
+                np.save(f'{prefix}.key{c}.npy', chunk['sorted_key'].astype(np.uint32 if chunk['width'] <= 32 else np.uint64))
+            chunks.append({'shift': chunk['shift'], 'width': chunk['width'], 'dense': chunk['starts'] is not None})
+        header = {'count': len(self.hashes), 'threshold': self.threshold, 'use_index': self.use_index,
+                  'chunk_radius': self.chunk_radius, 'chunks': chunks}
+        temp_path = f'{prefix}.json.{uuid.uuid4().hex[:8]}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+        os.replace(temp_path, f'{prefix}.json')
+
+    @classmethod
+    def load(cls, prefix, hashes, workers=None):
+        """读回save()保存的索引，hashes为建索引时的哈希（可以是内存映射）"""
+        with open(f'{prefix}.json', 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if header['count'] != len(hashes):
+            raise ValueError(f"索引 {prefix} 有 {header['count']} 条，与哈希数 {len(hashes)} 不一致")
+        index = cls.__new__(cls)
+        index.hashes = hashes
+        index.threshold = header['threshold']
+        index.workers = workers
+        index.use_index = header['use_index']
+        index.chunk_radius = header['chunk_radius']
+        index._chunks = []
+        for c, chunk in enumerate(header['chunks']):
+            index._chunks.append({
+                'shift': chunk['shift'],
+                'width': chunk['width'],
+                'mask': (1 << chunk['width']) - 1,
+                'key': None,
+                'order': np.load(f'{prefix}.order{c}.npy', mmap_mode='r'),
+                'sorted_key': None if chunk['dense'] else np.load(f'{prefix}.key{c}.npy', mmap_mode='r'),
+                'starts': np.load(f'{prefix}.starts{c}.npy', mmap_mode='r') if chunk['dense'] else None,
+                'probes': _probe_masks(chunk['width'], index.chunk_radius),
+            })
+        return index
+
+    def _chunk_keys(self, chunk):
+        """各哈希在该段的取值；读回的索引没有保存，用到时再计算"""
+        if chunk['key'] is None:
+            chunk['key'] = (self.hashes >> np.uint64(chunk['shift'])) & np.uint64(chunk['mask'])
+        return chunk['key']
+
+    def query_many(self, values, threshold=None):
+        """批量查找，返回按(values下标, 索引下标)升序的(values下标, 索引下标, 距离)"""
+        if threshold is None:
+            threshold = self.threshold
+        elif self.use_index and threshold > self.threshold:
+            raise ValueError(f"查询阈值 {threshold} 超过了索引阈值 {self.threshold}")
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        if not self.use_index:
+            found_i, found_j, found_d = hamming_pairs(values, threshold, right=self.hashes, workers=self.workers)
+        else:
+            found_i, found_j, found_d = [], [], []
+            for c, chunk in enumerate(self._chunks):
+                for start in range(0, len(values), BLOCK_ROWS):
+                    rows = np.arange(start, min(start + BLOCK_ROWS, len(values)))
+                    keys = (values[rows] >> np.uint64(chunk['shift'])) & np.uint64(chunk['mask'])
+                    for probe in chunk['probes']:
+                        lo, hi = _bucket_ranges(chunk, keys ^ probe)
+                        row_pos, positions = _expand_ranges(lo, hi)
+                        a = rows[row_pos]
+                        b = np.asarray(chunk['order'][positions], dtype=np.intp)
+                        xor = values[a] ^ self.hashes[b]
+                        # 一对只在第一个满足段内半径的段里计入，避免重复
+                        keep = np.ones(a.size, dtype=bool)
+                        for earlier in self._chunks[:c]:
+                            keep &= popcount64((xor >> np.uint64(earlier['shift'])) & np.uint64(earlier['mask'])) > self.chunk_radius
+                        distances = popcount64(xor)
+                        keep &= distances <= threshold
+                        found_i.append(a[keep])
+                        found_j.append(b[keep])
+                        found_d.append(distances[keep])
+            found_i, found_j, found_d = _concat_pairs(found_i, found_j, found_d)
+        order = np.lexsort((found_j, found_i))
+        return found_i[order], found_j[order], found_d[order]
+
+    def query(self, value, threshold=None):
+        """查找与value距离不超过阈值的所有下标，返回按下标升序的(下标, 距离)"""
+        if threshold is None:
+            threshold = self.threshold
+        elif self.use_index and threshold > self.threshold:
+            raise ValueError(f"查询阈值 {threshold} 超过了索引阈值 {self.threshold}")
+        value = int(value)
+        if self.use_index:
+            parts = []
+            for chunk in self._chunks:
+                probe_keys = np.uint64((value >> chunk['shift']) & chunk['mask']) ^ chunk['probes']
+                lo, hi = _bucket_ranges(chunk, probe_keys)
+                _, positions = _expand_ranges(lo, hi)
+                parts.append(chunk['order'][positions])
+            candidates = np.unique(np.concatenate(parts))
+        else:
+            candidates = np.arange(len(self.hashes))
+        distances = popcount64(self.hashes[candidates] ^ np.uint64(value))
+        keep = distances <= threshold
+        return candidates[keep], distances[keep]
+
+    def pairs(self):
+        """返回所有距离不超过阈值的下标对(i<j)及距离，顺序不保证"""
+        if not self.use_index:
+            return self._brute_force_pairs()
+
+        found_i, found_j, found_d = [], [], []
+        for c, chunk in enumerate(self._chunks):
+            for start in range(0, len(self.hashes), BLOCK_ROWS):
+                rows = np.arange(start, min(start + BLOCK_ROWS, len(self.hashes)))
+                for probe in chunk['probes']:
+                    lo, hi = _bucket_ranges(chunk, self._chunk_keys(chunk)[rows] ^ probe)
+                    row_pos, positions = _expand_ranges(lo, hi)
+                    a = rows[row_pos]
+                    b = np.asarray(chunk['order'][positions], dtype=np.intp)
+                    # 同一对会从两端各探测到一次，只保留a<b
+                    keep = a < b
+                    a, b = a[keep], b[keep]
+                    # 一对图片只在第一个满足段内半径的段里计入，避免重复
+                    keep = np.ones(a.size, dtype=bool)
+                    for earlier in self._chunks[:c]:
+                        keep &= popcount64(self._chunk_keys(earlier)[a] ^ self._chunk_keys(earlier)[b]) > self.chunk_radius
+                    a, b = a[keep], b[keep]
+                    distances = popcount64(self.hashes[a] ^ self.hashes[b])
+                    keep = distances <= self.threshold
+                    found_i.append(a[keep])
+                    found_j.append(b[keep])
+                    found_d.append(distances[keep])
+        return _concat_pairs(found_i, found_j, found_d)
+
+    def _brute_force_pairs(self):
+        """阈值过大或图片很少时索引没有意义，直接分块暴力比较"""
+        return hamming_pairs(self.hashes, self.threshold, workers=self.workers)
+
+
+def _concat_pairs(found_i, found_j, found_d):
+    if not found_i:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint8)
+    return (np.concatenate(found_i).astype(np.intp),
+            np.concatenate(found_j).astype(np.intp),
+            np.concatenate(found_d).astype(np.uint8))
+
+
+def _kernel_block(left, right, threshold, row_offset, col_offset, upper):
+    """计算一块的距离矩阵并取出不超过阈值的位置"""
+    distances = popcount64(left[:, None] ^ right[None, :])
+    mask = distances <= threshold
+    if upper and col_offset < row_offset + len(left):
+        # 自连接的对角块只保留全局下标i<j的部分
+        mask &= np.arange(row_offset, row_offset + len(left))[:, None] < np.arange(col_offset, col_offset + len(right))[None, :]
+    if not mask.any():
+        return None
+    flat = np.flatnonzero(mask)
+    ii, jj = np.divmod(flat, len(right))
+    return ii + row_offset, jj + col_offset, distances.ravel()[flat]
+
+
+def _kernel_row_block(left, right, threshold, row_start, row_stop, upper):
+    block = left[row_start:row_stop]
+    # 自连接时从对角块开始，跳过整块都在下三角的部分
+    col_start = (row_start // KERNEL_BLOCK_COLS) * KERNEL_BLOCK_COLS if upper else 0
+    found_i, found_j, found_d = [], [], []
+    for col in range(col_start, len(right), KERNEL_BLOCK_COLS):
+        found = _kernel_block(block, right[col:col + KERNEL_BLOCK_COLS], threshold, row_start, col, upper)
+        if found is not None:
+            found_i.append(found[0])
+            found_j.append(found[1])
+            found_d.append(found[2])
+    return found_i, found_j, found_d
+
+
+def hamming_pairs(left, threshold, right=None, workers=None):
+    """分块异或+popcount暴力比较，返回距离不超过阈值的(i, j, 距离)
+
+    right为None时在left内部自连接，只返回i<j的对；否则返回left×right的所有对。
+    workers>1时按行块分给线程池，numpy运算期间会释放GIL。
+    """
+    left = np.ascontiguousarray(left, dtype=np.uint64)
+    upper = right is None
+    right = left if upper else np.ascontiguousarray(right, dtype=np.uint64)
+    starts = range(0, len(left), KERNEL_BLOCK_ROWS)
+    tasks = [(left, right, threshold, start, min(start + KERNEL_BLOCK_ROWS, len(left)), upper) for start in starts]
+
+    if workers is None:
+        workers = 1
+    elif workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda task: _kernel_row_block(*task), tasks))
+    else:
+        results = [_kernel_row_block(*task) for task in tasks]
+
+    found_i, found_j, found_d = [], [], []
+    for block_i, block_j, block_d in results:
+        found_i.extend(block_i)
+        found_j.extend(block_j)
+        found_d.extend(block_d)
+    return _concat_pairs(found_i, found_j, found_d)
+
+
+def build_adjacency(n, pairs_i, pairs_j):
+    """由下标对构造对称的CSR邻接表，每行邻居按下标升序"""
+    src = np.concatenate([pairs_i, pairs_j])
+    dst = np.concatenate([pairs_j, pairs_i])
+    order = np.lexsort((dst, src))
+    indices = dst[order]
+    indptr = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, indices
+
+
+def radius_neighbors(hashes, threshold, method='auto', workers=None):
+    """返回每张图片距离不超过阈值的邻居列表，CSR格式(indptr, indices)"""
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    pairs_i, pairs_j, _ = HashIndex(hashes, threshold, method, workers).pairs()
+    return build_adjacency(len(hashes), pairs_i, pairs_j)
+
+
+def group_similar(hashes, threshold, method='auto', workers=None):
+    """按原先"种子+扫描"的规则分组，返回 {组号: [下标...]}（含单张组）
+
+    与双重循环逐张比较的结果完全一致：按下标顺序取未分组的图片作种子，
+    把与种子距离不超过阈值、且尚未分组的图片按下标顺序并入该组。
+    """
+    n = len(hashes)
+    indptr, indices = radius_neighbors(hashes, threshold, method, workers)
+
+    groups = {}
+    processed = np.zeros(n, dtype=bool)
+    for seed in range(n):
+        if processed[seed]:
+            continue
+        processed[seed] = True
+        neighbors = indices[indptr[seed]:indptr[seed + 1]]
+        neighbors = neighbors[~processed[neighbors]]
+        processed[neighbors] = True
+        groups[len(groups) + 1] = [seed] + neighbors.tolist()
+    return groups
+
+
+class UnionFind:
+    """并查集：父指针数组，合并时总把较大的根挂到较小的根下，所以根就是分量内最小的下标"""
+
+    def __init__(self, n=0):
+        self.parent = np.arange(n, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def grow(self, n):
+        """扩充到n个元素，新元素各自成为一个分量"""
+        if n > len(self.parent):
+            self.parent = np.concatenate([self.parent, np.arange(len(self.parent), n, dtype=np.intp)])
+
+    def _compress(self):
+        # 指针跳跃：每轮把父指针替换成祖父指针，树深度减半
+        while True:
+            grand = self.parent[self.parent]
+            if np.array_equal(grand, self.parent):
+                return
+            self.parent = grand
+
+    def find(self, items):
+        """批量查找根"""
+        self._compress()
+        return self.parent[np.asarray(items, dtype=np.intp)]
+
+    def union(self, a, b):
+        """批量合并(a[k], b[k])"""
+        a = np.asarray(a, dtype=np.intp)
+        b = np.asarray(b, dtype=np.intp)
+        while a.size:
+            root_a, root_b = self.find(a), self.find(b)
+            differ = root_a != root_b
+            if not differ.any():
+                return
+            a, b, root_a, root_b = a[differ], b[differ], root_a[differ], root_b[differ]
+            # 每轮至少有一个根被挂到别的根下面，根的数量严格减少
+            np.minimum.at(self.parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+
+    def roots(self):
+        """返回每个元素所在分量的根"""
+        self._compress()
+        return self.parent.copy()
+
+
+def cluster_components(hashes, threshold, sort_keys=None, method='auto', workers=None):
+    """连通分量聚类，返回 {组号: [下标...]}（含单张组）
+
+    距离不超过阈值的图片对用并查集合并，传递相连的图片归入同一组（与贪心分组不同，
+    不受种子先后影响）。组内按(哈希值, 排序键)排序，组号按组内最小的(哈希值, 排序键)
+    依次编号，所以只要图片集合相同，输入顺序怎么变组号都不变。
+    sort_keys用于哈希值相同时的稳定排序，缺省按下标。
+    """
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    if n == 0:
+        return {}
+    pairs_i, pairs_j, _ = HashIndex(hashes, threshold, method, workers).pairs()
+    union_find = UnionFind(n)
+    union_find.union(pairs_i, pairs_j)
+    return number_components(union_find.roots(), hashes, sort_keys)
+
+
+def component_order(hashes, sort_keys=None):
+    """cluster_components给分量编号时的遍历顺序：按哈希值，相同时按sort_keys（默认按下标）"""
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    if sort_keys is None:
+        tie_break = np.arange(n)
+    else:
+        tie_break = np.empty(n, dtype=np.intp)
+        tie_break[sorted(range(n), key=sort_keys.__getitem__)] = np.arange(n)
+    return np.lexsort((tie_break, hashes))
+
+
+def number_components(roots, hashes, sort_keys=None, order=None):
+    """按cluster_components的规则给分量编号，roots为每个元素所在分量的根，返回 {组号: [下标...]}
+
+    order为component_order的结果，同一批元素多次编号时可以预先算好传入。
+    """
+    n = len(hashes)
+    if n == 0:
+        return {}
+    if order is None:
+        order = component_order(hashes, sort_keys)
+
+    # 分量按其最小成员在order中首次出现的位置编号
+    roots_in_order = roots[order]
+    unique_roots, first_seen = np.unique(roots_in_order, return_index=True)
+    group_rank = np.empty(n, dtype=np.intp)
+    group_rank[unique_roots[np.argsort(first_seen)]] = np.arange(len(unique_roots))
+    ranks_in_order = group_rank[roots_in_order]
+    members = order[np.argsort(ranks_in_order, kind='stable')]
+    bounds = np.cumsum(np.bincount(ranks_in_order, minlength=len(unique_roots)))[:-1]
+    return {group_id: chunk.tolist() for group_id, chunk in enumerate(np.split(members, bounds), start=1)}
+
+
+def record_sort_key(info):
+    """图片信息的稳定排序键：来源ZIP + ZIP内路径，不含随机的临时目录"""
+    return (info.get('source_zip', ''), info.get('relative_path', ''), os.path.basename(info['path']))
+
+
+def group_hash_records(hashes, threshold, method='auto', workers=None, clustering='greedy'):
+    """对 {路径: {'hash': ImageHash, 'info': 图片信息}} 分组，返回 {组号: [图片信息...]}（含单张组）
+
+    clustering为'greedy'时与原先逐张比较的结果一致，为'components'时按连通分量分组，
+    组号与图片的遍历顺序无关。
+    """
+    records = list(hashes.values())
+    packed = pack_hashes([record['hash'] for record in records])
+    if clustering == 'greedy':
+        groups = group_similar(packed, threshold, method, workers)
+    elif clustering == 'components':
+        sort_keys = [record_sort_key(record['info']) for record in records]
+        groups = cluster_components(packed, threshold, sort_keys, method, workers)
+    else:
+        raise ValueError(f"未知的分组方式: {clustering}")
+    return {group_id: [records[i]['info'] for i in members] for group_id, members in groups.items()}
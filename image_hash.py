@@ -0,0 +1,40 @@
+"""感知哈希的快速解码
+
+pHash最终只用到 (HASH_SIZE*4)² 的灰度小图，完整解码一张1200万~5000万像素的照片
+几乎全部白费。JPEG可以让libjpeg在DCT阶段直接按1/2、1/4、1/8缩放并只输出亮度通道
+（PIL的draft模式），解码量降到原来的几十分之一。
+
+缩小后的图片仍远大于pHash的采样尺寸（至少DRAFT_MIN_SIDE像素），再由imagehash
+用同样的LANCZOS缩放到32×32，哈希值与完整解码基本一致，个别图片在中值附近的
+系数可能翻转，差异不超过HASH_DRAFT_TOLERANCE位（见benchmark_hash.py）。
+非JPEG图片draft无效，仍按原来的方式完整解码。
+"""
+import imagehash
+from PIL import Image
+
+# 快速解码时缩小后的短边不小于该值（pHash采样32×32，留足余量减少混叠）
+DRAFT_MIN_SIDE = 256
+# 快速解码与完整解码得到的哈希值之间允许的最大汉明距离（位）
+HASH_DRAFT_TOLERANCE = 2
+
+
+def open_hash_image(img, fast_decode=True):
+    """为计算哈希准备图片：JPEG按DCT缩放解码成灰度小图，其他格式转换为RGB"""
+    if fast_decode and img.format == 'JPEG':
+        # draft只能在读取像素之前调用，请求的尺寸是缩放后允许的最小尺寸
+        img.draft('L', (DRAFT_MIN_SIDE, DRAFT_MIN_SIDE))
+        return img.convert('L')
+    # 转换为RGB模式（避免RGBA模式问题）
+    return img.convert('RGB')
+
+
+def compute_phash(source, hash_size, fast_decode=True):
+    """打开图片（路径或文件对象）并计算感知哈希"""
+    with Image.open(source) as img:
+        return imagehash.phash(open_hash_image(img, fast_decode), hash_size=hash_size)
+
+
+
+def phash_image(img, hash_size):
+    """对已完整解码的图片计算感知哈希，结果与fast_decode=False时相同"""
+    return imagehash.phash(open_hash_image(img, fast_decode=False), hash_size=hash_size)
@@ -0,0 +1,362 @@
+"""列式图片清单：代替逐张的图片信息字典
+
+原来每张图片是一个字典（路径、来源ZIP、压缩包路径、ZIP内路径、条目名、CRC32……），
+哈希结果和分组列表里又各引用一遍，百万张图片时这些字典和字符串就要占用数GB内存，
+很容易超出docker-compose.yml中4G的内存上限。ImageManifest把同样的信息按列存放：
+
+- 压缩包表：每个zip（或解压目录）一行，来源ZIP文件名和路径只存一次，图片按uint32编号引用；
+- 目录表：ZIP内的目录去重后只存一次，图片按uint32编号引用；文件名拼接成一整块UTF-8文本；
+- zip条目名与ZIP内路径不同（文件名按GBK解码过）时才另存一份条目名；
+- CRC32、大小、内容摘要、精确去重的代表图片、class2概率（float32）、是否入选、pHash（uint64）、组号（uint32）各占一列。
+
+YOLO分类、计算哈希、特征缓存、输出等阶段仍然按图片信息字典工作：views()临时生成字典，
+每次只生成MANIFEST_CHUNK_SIZE张，阶段结果用absorb()写回各列后字典即可释放。
+清单可以用save()保存为npz文件，load()读回后可以查看各组的图片。
+
+用法：
+    python image_manifest.py <清单.npz> [组号]
+"""
+import os
+import sys
+import logging
+from array import array
+from collections.abc import Mapping
+import numpy as np
+import imagehash
+from hash_index import hash_to_int, group_similar, cluster_components, record_sort_key
+from zip_reader import content_digest
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+MANIFEST_FILENAME = 'image_manifest.npz'
+MANIFEST_CHUNK_SIZE = 10000  # 各阶段每次临时生成的图片信息字典数
+NO_MEMBER = 0xFFFFFFFF  # 条目名与ZIP内路径相同，不另存
+
+_COLUMNS = ('archive', 'directory', 'member', 'zip_crc', 'zip_size', 'digest', 'has_digest',
+            'representative', 'prob', 'selected', 'hash', 'has_hash', 'group')
+
+
+def to_image_hash(value):
+    """把64位整数还原成imagehash.ImageHash（hash_to_int的逆运算）"""
+    bits = np.unpackbits(np.array([value], dtype='>u8').view(np.uint8))
+    return imagehash.ImageHash(bits.reshape(8, 8).astype(bool))
+
+
+class StringTable:
+    """只追加的字符串表：UTF-8文本拼接成一块，另存每条的结束偏移"""
+
+    def __init__(self, text=b'', ends=None):
+        self.text = bytearray(text)
+        self.ends = array('Q')
+        if ends is not None:
+            self.ends.frombytes(np.ascontiguousarray(ends, dtype=np.uint64).tobytes())
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        start = self.ends[i - 1] if i else 0
+        return self.text[start:self.ends[i]].decode('utf-8')
+
+    def append(self, value):
+        self.text += value.encode('utf-8')
+        self.ends.append(len(self.text))
+        return len(self.ends) - 1
+
+    def arrays(self):
+        return np.frombuffer(bytes(self.text), dtype=np.uint8), np.array(self.ends, dtype=np.uint64)
+
+    def nbytes(self):
+        return len(self.text) + self.ends.itemsize * len(self.ends)
+
+
+class ImageManifest:
+    """图片清单，第i行对应一张图片
+
+    archives为[(来源ZIP文件名, 压缩包路径或解压目录, 是否在zip内)]，directories为ZIP内目录表，
+    names为每行的文件名，members为另存的zip条目名，columns为各列的numpy数组。
+    """
+
+    def __init__(self, archives, directories, names, members, columns):
+        self.archives = archives
+        self.directories = directories
+        self.names = names
+        self.members = members
+        for name in _COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_image_infos(cls, image_infos):
+        """由图片信息字典（可以是逐个产出的迭代器）建立清单，每张图片只转换一次，不保留字典"""
+        archive_ids, directory_ids = {}, {}
+        names, members = StringTable(), StringTable()
+        archive, directory, member = array('I'), array('I'), array('I')
+        zip_crc, zip_size = array('I'), array('Q')
+        for info in image_infos:
+            relative_path = info['relative_path']
+            in_zip = 'zip_member' in info
+            root = info['original_zip_path'] if in_zip else info['path'][:-len(relative_path)].rstrip(os.sep)
+            if os.path.join(root, relative_path) != info['path']:
+                raise ValueError(f"图片路径与ZIP内路径不一致，无法写入清单: {info['path']}")
+            key = (info.get('source_zip', ''), root, in_zip)
+            if key not in archive_ids:
+                archive_ids[key] = len(archive_ids)
+            folder, name = os.path.split(relative_path)
+            if os.path.join(folder, name) != relative_path:
+                folder, name = '', relative_path
+            if folder not in directory_ids:
+                directory_ids[folder] = len(directory_ids)
+            archive.append(archive_ids[key])
+            directory.append(directory_ids[folder])
+            names.append(name)
+            if in_zip and info['zip_member'] != relative_path:
+                member.append(members.append(info['zip_member']))
+            else:
+                member.append(NO_MEMBER)
+            zip_crc.append(info.get('zip_crc', 0))
+            zip_size.append(info.get('zip_size', 0))
+
+        n = len(names)
+        columns = {
+            'archive': np.array(archive, dtype=np.uint32),
+            'directory': np.array(directory, dtype=np.uint32),
+            'member': np.array(member, dtype=np.uint32),
+            'zip_crc': np.array(zip_crc, dtype=np.uint32),
+            'zip_size': np.array(zip_size, dtype=np.uint64),
+            'digest': np.zeros((n, 16), dtype=np.uint8),
+            'has_digest': np.zeros(n, dtype=bool),
+            'representative': np.arange(n, dtype=np.uint32),
+            'prob': np.full(n, np.nan, dtype=np.float32),
+            'selected': np.zeros(n, dtype=bool),
+            'hash': np.zeros(n, dtype=np.uint64),
+            'has_hash': np.zeros(n, dtype=bool),
+            'group': np.zeros(n, dtype=np.uint32),
+        }
+        return cls(list(archive_ids), list(directory_ids), names, members, columns)
+
+    def nbytes(self):
+        """清单占用的内存（字节）"""
+        columns = sum(getattr(self, name).nbytes for name in _COLUMNS)
+        return columns + self.names.nbytes() + self.members.nbytes()
+
+    def in_zip(self):
+        """每行是否为zip内的图片"""
+        flags = np.array([in_zip for _, _, in_zip in self.archives], dtype=bool)
+        return flags[self.archive] if len(self) else np.zeros(0, dtype=bool)
+
+    def relative_path(self, i):
+        folder = self.directories[self.directory[i]]
+        name = self.names[i]
+        return os.path.join(folder, name) if folder else name
+
+    def view(self, i):
+        """第i行的图片信息字典（与zip_reader.list_archive_images的记录相同），'manifest_row'为行号"""
+        source_zip, root, in_zip = self.archives[self.archive[i]]
+        relative_path = self.relative_path(i)
+        info = {
+            'path': os.path.join(root, relative_path),
+            'source_zip': source_zip,
+            'relative_path': relative_path,
+            'manifest_row': int(i),
+        }
+        if in_zip:
+            member = self.member[i]
+            info['original_zip_path'] = root
+            info['zip_member'] = relative_path if member == NO_MEMBER else self.members[member]
+            info['zip_crc'] = int(self.zip_crc[i])
+            info['zip_size'] = int(self.zip_size[i])
+        if self.has_digest[i]:
+            info['content_digest'] = self.digest[i].tobytes().hex()
+        if self.has_hash[i]:
+            info['phash'] = to_image_hash(self.hash[i])
+        return info
+
+    def views(self, rows):
+        return [self.view(i) for i in rows]
+
+    def chunks(self, rows, size=MANIFEST_CHUNK_SIZE):
+        """把行号分成每块最多size行"""
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+
+    def set_digest(self, i, digest):
+        self.digest[i] = np.frombuffer(bytes.fromhex(digest), dtype=np.uint8)
+        self.has_digest[i] = True
+
+    def set_hash(self, i, image_hash):
+        self.hash[i] = hash_to_int(image_hash)
+        self.has_hash[i] = True
+
+    def absorb(self, views):
+        """把各阶段补充在字典上的结果（内容摘要、pHash、class2概率）写回各列"""
+        for info in views:
+            i = info['manifest_row']
+            if info.get('content_digest') and not self.has_digest[i]:
+                self.set_digest(i, info['content_digest'])
+            if info.get('phash') is not None and not self.has_hash[i]:
+                self.set_hash(i, info['phash'])
+            if info.get('class2_prob') is not None:
+                self.prob[i] = info['class2_prob']
+
+    def dedupe_exact(self):
+        """与zip_reader.dedupe_exact_images相同的规则找出完全相同的图片，副本的representative指向代表
+
+        先按(大小, CRC32)排序分桶，只有桶内多于一张时才读取内容计算摘要确认，代表为首次出现的那张。
+        返回副本数。
+        """
+        rows = np.flatnonzero(self.in_zip())
+        order = rows[np.lexsort((rows, self.zip_crc[rows], self.zip_size[rows]))]
+        sizes, crcs = self.zip_size[order], self.zip_crc[order]
+        bounds = np.flatnonzero((sizes[1:] != sizes[:-1]) | (crcs[1:] != crcs[:-1])) + 1
+        duplicates = 0
+        for candidates in np.split(order, bounds):
+            if len(candidates) < 2:
+                continue
+            by_digest = {}
+            for i in candidates:
+                info = self.view(i)
+                try:
+                    digest = content_digest(info)
+                except Exception as e:
+                    logger.warning(f"计算图片摘要时出错 {info['path']}: {str(e)}")
+                    continue
+                self.set_digest(i, digest)
+                by_digest.setdefault(digest, []).append(i)
+            for representative, *copies in by_digest.values():
+                self.representative[copies] = representative
+                duplicates += len(copies)
+        if duplicates:
+            logger.info(f"发现 {duplicates} 张与其他图片完全相同的副本，只处理 {len(self) - duplicates} 张代表图片")
+        return duplicates
+
+    def representatives(self):
+        """代表图片（没有副本的图片也是自己的代表）的行号"""
+        return np.flatnonzero(self.representative == np.arange(len(self), dtype=np.uint32))
+
+    def propagate(self):
+        """把代表图片的摘要、class2概率、入选标记和哈希分发给所有副本"""
+        representative = self.representative
+        for name in ('digest', 'has_digest', 'prob', 'selected', 'hash', 'has_hash'):
+            column = getattr(self, name)
+            column[:] = column[representative]
+
+    def ordered_rows(self, mask):
+        """mask选中的行，按代表图片的顺序排列、副本紧跟在代表后面（与expand_duplicates相同）"""
+        rows = np.flatnonzero(mask)
+        return rows[np.lexsort((rows, self.representative[rows]))]
+
+    def group_rows(self, rows, threshold, method='auto', workers=None, clustering='greedy'):
+        """按pHash列分组（规则与hash_index.group_hash_records相同），写入组号列
+
+        返回两张及以上的组 {组号: 行号数组}，组号与含单张组时的编号相同。
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        values = self.hash[rows]
+        if clustering == 'greedy':
+            groups = group_similar(values, threshold, method, workers)
+        elif clustering == 'components':
+            sort_keys = [record_sort_key(self.view(i)) for i in rows]
+            groups = cluster_components(values, threshold, sort_keys, method, workers)
+        else:
+            raise ValueError(f"未知的分组方式: {clustering}")
+        self.group[:] = 0
+        result = {}
+        for group_id, members in groups.items():
+            if len(members) > 1:
+                result[group_id] = rows[members]
+                self.group[result[group_id]] = group_id
+        return result
+
+    def group_views(self, groups):
+        """{组号: 行号数组} 的只读映射，取出某组时才生成该组的图片信息字典"""
+        return ManifestGroups(self, groups)
+
+    def source_zips(self, rows):
+        names = [source_zip for source_zip, _, _ in self.archives]
+        return [names[archive] for archive in self.archive[rows].tolist()]
+
+    def relative_paths(self, rows):
+        return [self.relative_path(i) for i in rows]
+
+    def case_records(self, rows, case_of):
+        """跨案件比对用的记录（case_index.screen_case_records），case_of(来源ZIP文件名)返回案件号"""
+        cases = [case_of(source_zip) or 'unknown' for source_zip, _, _ in self.archives]
+        for i in rows:
+            archive = self.archive[i]
+            yield {
+                'hash': int(self.hash[i]),
+                'case': cases[archive],
+                'source_zip': self.archives[archive][0],
+                'relative_path': self.relative_path(i),
+            }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        names_text, names_ends = self.names.arrays()
+        members_text, members_ends = self.members.arrays()
+        arrays = {name: getattr(self, name) for name in _COLUMNS}
+        # 写到打开的文件对象上，np.savez不会给文件名补.npz后缀
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f, format=np.array(MANIFEST_FORMAT),
+                archive_zips=np.array([a[0] for a in self.archives], dtype=str),
+                archive_roots=np.array([a[1] for a in self.archives], dtype=str),
+                archive_in_zip=np.array([a[2] for a in self.archives], dtype=bool),
+                directories=np.array(self.directories, dtype=str),
+                names_text=names_text, names_ends=names_ends,
+                members_text=members_text, members_ends=members_ends, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format']) != MANIFEST_FORMAT:
+                raise ValueError(f"不支持的清单格式 {int(data['format'])}: {path}")
+            archives = list(zip(data['archive_zips'].tolist(), data['archive_roots'].tolist(),
+                                data['archive_in_zip'].tolist()))
+            names = StringTable(data['names_text'].tobytes(), data['names_ends'])
+            members = StringTable(data['members_text'].tobytes(), data['members_ends'])
+            columns = {name: data[name] for name in _COLUMNS}
+            return cls(archives, data['directories'].tolist(), names, members, columns)
+
+
+class ManifestGroups(Mapping):
+    """{组号: [图片信息...]}，每次取出时临时生成字典，可以直接传给save_results"""
+
+    def __init__(self, manifest, groups):
+        self.manifest = manifest
+        self.groups = groups
+
+    def __getitem__(self, group_id):
+        return self.manifest.views(self.groups[group_id])
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    manifest = ImageManifest.load(sys.argv[1])
+    groups = {}
+    for i in np.flatnonzero(manifest.group):
+        groups.setdefault(int(manifest.group[i]), []).append(i)
+    print(f"图片 {len(manifest)} 张，来自 {len(manifest.archives)} 个压缩包，"
+          f"精确重复的副本 {len(manifest) - len(manifest.representatives())} 张")
+    print(f"class2 {int(manifest.selected.sum())} 张，已计算哈希 {int(manifest.has_hash.sum())} 张，"
+          f"相似照片 {len(groups)} 组")
+    print(f"清单占用内存 {manifest.nbytes() / 1024 / 1024:.1f} MB")
+    selected = [int(sys.argv[2])] if len(sys.argv) > 2 else sorted(groups)
+    for group_id in selected:
+        print(f"\ngroup_{group_id}（{len(groups.get(group_id, []))} 张）")
+        for i in groups.get(group_id, []):
+            prob = manifest.prob[i]
+            prob_text = f"{prob:.3f}" if not np.isnan(prob) else '-'
+            print(f"    {manifest.source_zips([i])[0]}  {manifest.relative_path(i)}  class2概率 {prob_text}")
@@ -0,0 +1,322 @@
+"""增量分组：新增案件zip时只处理新照片，并入已有的分组
+
+全量运行时每加一个案件zip都要把整个输入目录重新分类、哈希、分组、输出。增量模式在输出目录下保存状态：
+
+- 已处理过的zip（相对输入目录的路径、绝对路径、大小、修改时间）
+- 每张已分组照片的pHash、来源ZIP、ZIP内路径（与跨案件索引相同的内存映射格式，见case_index.py，
+  多索引的排序表也一并保存，新进程不必对全部照片重新建索引）
+- 每张照片所属的组号（groups.u32，0表示单张、未输出，0xFFFFFFFF表示中断后作废）和同组下一张照片（links.u32，组内成员串成链表）
+- 每个组的(第一张, 最后一张, 张数)（group_table.u32，按组号寻址）
+
+新zip中的照片分类、哈希之后，只在已存照片中查找汉明距离不超过阈值的近邻，
+用并查集把新照片、近邻所在的组和近邻单张照片合并成连通分量：
+只涉及一个已有组时新照片并入该组；涉及多个已有组时并入组号最小的组，其余组的文件夹删除；
+只有新照片（及原来的单张照片）时编成新组。组大小从组表读取，被合并的组沿链表找到成员，
+状态文件都按内存映射原地改写。状态先写入，并记下有变化的组，之后整组重写这些组的文件夹
+（每组的CSV记录写在组文件夹内），全部写完才清除记录，中途中断时下次运行先补写。
+每次的代价与新照片及受影响的组的大小成正比，与历史照片总数无关。
+
+增量模式按连通分量分组（与CLUSTER_MODE='components'相同），与全量运行的贪心分组结果可能不同，
+所以状态只能由增量模式从空目录开始建立；更改HASH_THRESHOLD后需要删除状态目录重新建立。
+"""
+import os
+import json
+import uuid
+import logging
+import numpy as np
+from case_index import CaseIndex
+from hash_index import HashIndex, UnionFind, record_sort_key
+
+logger = logging.getLogger(__name__)
+
+STATE_DIRNAME = '.incremental'  # 输出目录下保存增量状态的子目录
+_STATE = 'state.json'
+_LABELS = 'groups.u32'
+_LINKS = 'links.u32'
+_GROUP_TABLE = 'group_table.u32'
+# 链表结尾、空组的第一张；作为组号时表示作废的条目
+NO_ENTRY = 0xFFFFFFFF
+
+
+def _map_column(path, count, columns=None, fill=0):
+    """把状态文件调整为count行（多出的截掉，缺少的按fill补齐）后按读写方式映射"""
+    row_size = 4 * (columns or 1)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size != count * row_size:
+        with open(path, 'ab') as f:
+            f.truncate(min(size - size % row_size, count * row_size))
+            missing = count - f.tell() // row_size
+            if missing > 0:
+                f.write(np.full(missing * (columns or 1), fill, dtype='<u4').tobytes())
+    shape = (count,) if columns is None else (count, columns)
+    if count == 0:
+        return np.zeros(shape, dtype='<u4')
+    return np.memmap(path, dtype='<u4', mode='r+', shape=shape)
+
+
+class IncrementalGroups:
+    """输出目录的增量分组状态
+
+    list_archive(zip路径)返回该zip中图片的记录（与zip_reader.list_archive_images相同），
+    已有照片需要重新输出（并入新组）时用它找回ZIP内的条目。
+    input_dir为输入目录，已处理过的zip按相对它的路径区分，不同子目录下的同名zip不会混淆。
+    """
+
+    def __init__(self, state_dir, threshold, list_archive, input_dir):
+        self.state_dir = state_dir
+        self.list_archive = list_archive
+        self.input_dir = input_dir
+        self.index = CaseIndex(state_dir)
+        state_path = os.path.join(state_dir, _STATE)
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'threshold': threshold, 'next_group': 1, 'zips': {}}
+        if self.state['threshold'] != threshold:
+            raise ValueError(f"增量状态 {state_dir} 按阈值 {self.state['threshold']} 建立，当前阈值为 {threshold}，"
+                             f"请删除该目录后重新建立")
+        self.threshold = threshold
+        rebuild = not os.path.exists(self._path(_GROUP_TABLE))
+        self._map_state()
+        entries = self.state.setdefault('entries', len(self.index))
+        if entries < len(self.index):
+            # 上次在写state.json之前中断：这些条目对应的zip没有记为已处理，本次会重新加入，
+            # 旧条目标为作废，组号和组表可能只改了一半，按组号重建
+            logger.warning(f"增量状态上次未写完，作废 {len(self.index) - entries} 条未提交的记录")
+            self.labels[entries:] = NO_ENTRY
+            rebuild = True
+        if rebuild and len(self.index):
+            self._rebuild_groups()
+            self.state['entries'] = len(self.index)
+            self._save_state()
+        self._pending = None
+
+    def _path(self, name):
+        return os.path.join(self.state_dir, name)
+
+    def _map_state(self):
+        # 上次在写组号之前中断时，缺少的条目按单张处理
+        count = len(self.index)
+        self.labels = _map_column(self._path(_LABELS), count)
+        self.links = _map_column(self._path(_LINKS), count, fill=NO_ENTRY)
+        self.groups = _map_column(self._path(_GROUP_TABLE), self.state['next_group'], 3)
+
+    def _rebuild_groups(self):
+        """由组号重建链表和组表（只在旧版本的状态目录第一次使用时执行一次）"""
+        labels = np.asarray(self.labels)
+        # 未提交的组号（不小于next_group）按单张处理
+        labels[(labels >= len(self.groups)) & (labels != NO_ENTRY)] = 0
+        members = np.flatnonzero((labels != 0) & (labels != NO_ENTRY))
+        members = members[np.argsort(labels[members], kind='stable')]
+        member_labels = labels[members]
+        self.links[:] = NO_ENTRY
+        same = member_labels[:-1] == member_labels[1:]
+        self.links[members[:-1][same]] = members[1:][same]
+        self.groups[:] = 0
+        self.groups[:, 0] = NO_ENTRY
+        first = np.ones(len(members), dtype=bool)
+        first[1:] = ~same
+        last = np.ones(len(members), dtype=bool)
+        last[:-1] = ~same
+        self.groups[member_labels[first], 0] = members[first]
+        self.groups[member_labels[last], 1] = members[last]
+        self.groups[:, 2] = np.bincount(member_labels, minlength=len(self.groups))[:len(self.groups)]
+        self._flush()
+
+    def _flush(self):
+        for column in (self.labels, self.links, self.groups):
+            if isinstance(column, np.memmap):
+                column.flush()
+
+    def zip_key(self, zip_path):
+        """已处理zip的键：相对输入目录的路径（统一用/分隔）"""
+        return os.path.relpath(os.path.abspath(zip_path), os.path.abspath(self.input_dir)).replace(os.sep, '/')
+
+    def _known_archive(self, zip_path):
+        known = self.state['zips'].get(self.zip_key(zip_path))
+        if known is None:
+            # 旧版本按文件名记录，路径相同时视为同一个zip
+            legacy = self.state['zips'].get(os.path.basename(zip_path))
+            if legacy is not None and legacy['path'] == os.path.abspath(zip_path):
+                known = legacy
+        return known
+
+    def pending_archives(self, zip_paths):
+        """还没处理过的zip；同一个zip的大小或修改时间变了时只警告，不重复处理"""
+        pending = []
+        for zip_path in zip_paths:
+            known = self._known_archive(zip_path)
+            if known is None:
+                pending.append(zip_path)
+                continue
+            stat = os.stat(zip_path)
+            if (known['size'], known['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+                logger.warning(f"已处理过的zip内容有变化，增量模式不会重新处理: {zip_path}")
+        return pending
+
+    def _old_image_infos(self, entry_ids):
+        """按条目号找回已有照片的图片记录（重新列出所在zip的中央目录）"""
+        by_zip = {}
+        for entry_id in entry_ids:
+            entry = self.index.entry(entry_id)
+            by_zip.setdefault(entry['source_zip'], []).append((entry_id, entry['relative_path']))
+        infos = {}
+        for source_zip, wanted in by_zip.items():
+            known = self.state['zips'].get(source_zip)
+            listed = {}
+            if known is not None and os.path.exists(known['path']):
+                listed = {info['relative_path']: info for info in self.list_archive(known['path'])}
+            for entry_id, relative_path in wanted:
+                if relative_path in listed:
+                    infos[entry_id] = listed[relative_path]
+                else:
+                    logger.warning(f"找不到已处理过的图片 {source_zip}/{relative_path}，跳过")
+        return infos
+
+    def _walk(self, group_id):
+        """沿链表列出组内的全部条目号"""
+        entries = []
+        entry_id = int(self.groups[group_id, 0]) if self.groups[group_id, 2] else NO_ENTRY
+        while entry_id != NO_ENTRY:
+            entries.append(entry_id)
+            entry_id = int(self.links[entry_id])
+        return entries
+
+    def merge(self, image_infos, values):
+        """把新照片（图片记录及对应的uint64哈希）并入已有分组
+
+        返回有变化的组 [{'group_id', 'removed_groups', 'size'}]：removed_groups为并入该组、文件夹需要删除的组，
+        size为合并后的组大小。调用commit()后才写入状态。
+        """
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        n_new = len(values)
+        new_i, old_j, _ = self.index.search(values, self.threshold)
+        # 作废的条目不参与合并
+        old_labels = np.asarray(self.labels[old_j])
+        live = old_labels != NO_ENTRY
+        new_i, old_j, old_labels = new_i[live], old_j[live], old_labels[live]
+        pairs_i, pairs_j, _ = HashIndex(values, self.threshold).pairs()
+
+        # 并查集的节点：新照片 0..n_new-1，之后是涉及到的已有组或已有单张照片
+        nodes = {}
+        neighbor_nodes = []
+        for j, group_id in zip(old_j.tolist(), old_labels.tolist()):
+            key = ('group', group_id) if group_id else ('entry', j)
+            if key not in nodes:
+                nodes[key] = n_new + len(nodes)
+            neighbor_nodes.append(nodes[key])
+        union_find = UnionFind(n_new + len(nodes))
+        union_find.union(pairs_i, pairs_j)
+        union_find.union(new_i, neighbor_nodes)
+        roots = union_find.roots()
+
+        components = {}
+        for i in range(n_new):
+            components.setdefault(roots[i], {'new': [], 'groups': [], 'entries': []})['new'].append(i)
+        for (kind, value), node in nodes.items():
+            components[roots[node]]['groups' if kind == 'group' else 'entries'].append(value)
+
+        next_group = self.state['next_group']
+        new_labels = np.zeros(n_new, dtype='<u4')
+        changes = []
+        for component in components.values():
+            size = (len(component['new']) + len(component['entries'])
+                    + sum(int(self.groups[g, 2]) for g in component['groups']))
+            if size < 2:
+                continue
+            groups = sorted(component['groups'])
+            if groups:
+                group_id, removed = groups[0], groups[1:]
+            else:
+                group_id, removed = next_group, []
+                next_group += 1
+            # 并入该组的已有照片：原来的单张照片和被合并的组的成员
+            joined = list(component['entries'])
+            for group in removed:
+                joined.extend(self._walk(group))
+            new_labels[component['new']] = group_id
+            changes.append({'group_id': group_id, 'removed_groups': removed, 'size': size,
+                            'joined': joined, 'new': component['new']})
+
+        changes.sort(key=lambda change: change['group_id'])
+        output = {
+            'groups': [change['group_id'] for change in changes],
+            'removed': sorted(group for change in changes for group in change['removed_groups']),
+        }
+        self._pending = {'labels': new_labels, 'changes': changes, 'next_group': next_group, 'output': output}
+        return [{key: change[key] for key in ('group_id', 'removed_groups', 'size')} for change in changes]
+
+    def commit(self, image_infos, values, zip_paths):
+        """把新照片、组号变化、已处理的zip和待写出的组写入状态（最后写state.json）
+
+        状态先于分组结果写入：写出结果时中断，下次运行按pending_output()补写，不会重复处理zip。
+        """
+        pending = self._pending
+        records = [{
+            'hash': int(value),
+            'case': os.path.splitext(info.get('source_zip', ''))[0],
+            'source_zip': self.zip_key(info['original_zip_path']) if info.get('original_zip_path') else info.get('source_zip', ''),
+            'relative_path': info.get('relative_path', ''),
+        } for info, value in zip(image_infos, values)]
+        base = len(self.index)
+        self.index.add(records)
+
+        # 新照片追加到各列末尾，组表增加新组号的行，再原地改写变化的组
+        self.state['next_group'] = pending['next_group']
+        self._map_state()
+        self.labels[base:] = pending['labels']
+        for change in pending['changes']:
+            group_id = change['group_id']
+            joined = change['joined'] + [base + i for i in change['new']]
+            for group in change['removed_groups']:
+                self.groups[group] = (NO_ENTRY, NO_ENTRY, 0)
+            # 接在该组原来的最后一张之后
+            if self.groups[group_id, 2]:
+                head, chain = int(self.groups[group_id, 0]), [int(self.groups[group_id, 1])] + joined
+            else:
+                head, chain = joined[0], joined
+            self.links[chain[:-1]] = chain[1:]
+            self.links[chain[-1]] = NO_ENTRY
+            self.labels[joined] = group_id
+            self.groups[group_id] = (head, chain[-1], change['size'])
+        self._flush()
+
+        for zip_path in zip_paths:
+            stat = os.stat(zip_path)
+            self.state['zips'][self.zip_key(zip_path)] = {
+                'path': os.path.abspath(zip_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.state['entries'] = len(self.index)
+        if pending['output']['groups'] or pending['output']['removed']:
+            # 上次未写完的组一并保留，写出结果后由finish_output()清除
+            previous = self.state.get('pending_output') or {'groups': [], 'removed': []}
+            removed = set(previous['removed']) | set(pending['output']['removed'])
+            self.state['pending_output'] = {
+                'groups': sorted((set(previous['groups']) | set(pending['output']['groups'])) - removed),
+                'removed': sorted(removed),
+            }
+        self._save_state()
+        self._pending = None
+
+    def _save_state(self):
+        path = self._path(_STATE)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def pending_output(self):
+        """已写入状态、但分组结果还没写完的变化 {'groups': [需要整组重写的组], 'removed': [需要删除的组]}，没有时为None"""
+        return self.state.get('pending_output')
+
+    def finish_output(self):
+        """分组结果写完后清除待写出的记录"""
+        self.state.pop('pending_output', None)
+        self._save_state()
+
+    def group_members(self, group_ids):
+        """按状态找回各组的全部图片记录 {组号: [图片信息...]}，组内按来源ZIP和ZIP内路径排序"""
+        entries = {group_id: self._walk(group_id) for group_id in group_ids}
+        infos = self._old_image_infos([entry_id for members in entries.values() for entry_id in members])
+        return {group_id: sorted((infos[entry_id] for entry_id in members if entry_id in infos), key=record_sort_key)
+                for group_id, members in entries.items()}
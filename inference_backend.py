@@ -0,0 +1,225 @@
+"""分类模型的推理后端
+
+torch：直接用Ultralytics加载best.pt（默认，与以前一致）。
+onnx-int8：ONNX Runtime运行INT8量化模型（见quantize_model.py），与FP32判定一致率不达标时退回onnx。
+onnx / openvino：第一次使用时把best.pt导出为ONNX（best.onnx），存放在export_dir
+（模型目录只读挂载时指定一个可写的缓存目录；为空时存放在模型旁边），
+并写一个记录来源模型摘要和输入尺寸的说明文件；模型旁边已有预先导出的文件时优先使用。
+之后只要best.pt没变就直接复用，
+推理时只需要onnxruntime或openvino，不再加载PyTorch，线程数可调，更适合纯CPU的机器。
+
+非torch后端的对象提供predict_probs(图片列表)，返回每张图片的各类别概率，
+预处理与Ultralytics分类预测相同：短边缩放到imgsz（双线性）、中心裁剪、归一化到0~1。
+
+单独运行时导出模型：python inference_backend.py models/best.pt
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import numpy as np
+from PIL import Image
+from feature_cache import file_digest
+from zip_reader import to_model_input, resize_model_input
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8', 'openvino')
+# 导出的ONNX旁边的说明文件后缀
+EXPORT_META_SUFFIX = '.json'
+
+
+def resolve_threads(threads):
+    """0或负数表示使用全部CPU核心"""
+    if threads is None or threads <= 0:
+        return os.cpu_count() or 1
+    return threads
+
+
+def artifact_path(model_path, suffix, export_dir=None):
+    """导出文件的路径：export_dir为空时在模型旁边，否则在该缓存目录中"""
+    path = os.path.splitext(model_path)[0] + suffix
+    return os.path.join(export_dir, os.path.basename(path)) if export_dir else path
+
+
+def artifact_candidates(model_path, suffix, export_dir=None):
+    """依次查找导出文件的位置：模型旁边预先导出的文件优先，其次是缓存目录"""
+    paths = [artifact_path(model_path, suffix)]
+    if export_dir:
+        paths.append(artifact_path(model_path, suffix, export_dir))
+    return paths
+
+
+def exported_path(model_path, export_dir=None):
+    return artifact_path(model_path, '.onnx', export_dir)
+
+
+def find_exported(model_path, export_dir=None):
+    """已存在的导出ONNX路径，都不存在时返回None"""
+    for path in artifact_candidates(model_path, '.onnx', export_dir):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _read_export_meta(onnx_path):
+    try:
+        with open(onnx_path + EXPORT_META_SUFFIX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_onnx(model_path, export_dir=None):
+    """返回(导出的ONNX路径, 说明)，best.pt有变化或还没导出时重新导出到export_dir"""
+    source_digest = file_digest(model_path) if os.path.exists(model_path) else None
+    for onnx_path in artifact_candidates(model_path, '.onnx', export_dir):
+        meta = _read_export_meta(onnx_path)
+        if meta is not None and os.path.exists(onnx_path):
+            # 只有ONNX而没有best.pt（例如生产机器只拷贝了导出结果）时也直接使用
+            if source_digest is None or meta.get('source_digest') == source_digest:
+                return onnx_path, meta
+
+    from ultralytics import YOLO
+    onnx_path = exported_path(model_path, export_dir)
+    source_path = model_path
+    if export_dir:
+        # Ultralytics把导出结果写在.pt旁边，先把模型复制到可写的缓存目录再导出
+        os.makedirs(export_dir, exist_ok=True)
+        source_path = os.path.splitext(onnx_path)[0] + '.export.pt'
+        shutil.copy2(model_path, source_path)
+    try:
+        logger.info(f"正在把 {model_path} 导出为ONNX（只需一次）...")
+        model = YOLO(source_path)
+        exported = model.export(format='onnx', dynamic=True, simplify=True)
+        if os.path.abspath(exported) != os.path.abspath(onnx_path):
+            os.replace(exported, onnx_path)
+    finally:
+        if source_path != model_path and os.path.exists(source_path):
+            os.remove(source_path)
+    imgsz = model.model.args.get('imgsz', 224)
+    meta = {
+        'source_digest': source_digest,
+        'imgsz': imgsz if isinstance(imgsz, int) else max(imgsz),
+        'names': {str(k): v for k, v in model.names.items()},
+    }
+    with open(onnx_path + EXPORT_META_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    logger.info(f"ONNX模型已导出: {onnx_path}")
+    return onnx_path, meta
+
+
+def preprocess(images, imgsz):
+    """PIL RGB图片列表 -> NCHW float32数组，与Ultralytics分类预处理一致"""
+    batch = np.empty((len(images), 3, imgsz, imgsz), dtype=np.float32)
+    for index, img in enumerate(images):
+        if isinstance(img, str):
+            # 磁盘图片传入的是路径，与cv2.imread一样按EXIF方向摆正
+            with Image.open(img) as opened:
+                img = to_model_input(opened)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        # 与torchvision.transforms.Resize(int)相同：短边缩放到imgsz，长边按比例截断取整
+        img = resize_model_input(img, imgsz)
+        size = img.size
+        left = int(round((size[0] - imgsz) / 2.0))
+        top = int(round((size[1] - imgsz) / 2.0))
+        img = img.crop((left, top, left + imgsz, top + imgsz))
+        batch[index] = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    return batch
+
+
+class OnnxClassifier:
+    """ONNX Runtime CPU推理，InferenceSession.run可多线程同时调用"""
+    thread_safe = True
+
+    def __init__(self, onnx_path, meta, threads=0, backend='onnx'):
+        self.backend = backend
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = resolve_threads(threads)
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = meta['imgsz']
+        self.names = meta.get('names', {})
+        self.path = onnx_path
+
+    def predict_probs(self, images):
+        outputs = self.session.run(None, {self.input_name: preprocess(images, self.imgsz)})
+        return outputs[0].tolist()
+
+
+class OpenVinoClassifier:
+    """OpenVINO CPU推理，直接读取导出的ONNX"""
+    backend = 'openvino'
+
+    def __init__(self, onnx_path, meta, threads=0):
+        import openvino as ov
+        core = ov.Core()
+        config = {'INFERENCE_NUM_THREADS': resolve_threads(threads), 'PERFORMANCE_HINT': 'THROUGHPUT'}
+        self.compiled = core.compile_model(core.read_model(onnx_path), 'CPU', config)
+        self.imgsz = meta['imgsz']
+        self.names = meta.get('names', {})
+        self.path = onnx_path
+
+    def predict_probs(self, images):
+        result = self.compiled(preprocess(images, self.imgsz))
+        return result[self.compiled.output(0)].tolist()
+
+
+def _load_int8(model_path, threads, quant_dataset, quant_floor, threshold, export_dir):
+    """加载INT8模型，未通过一致性检查时返回None"""
+    from quantize_model import ensure_int8, QUANT_AGREEMENT_FLOOR
+    quantized = ensure_int8(model_path, quant_dataset, threshold,
+                            QUANT_AGREEMENT_FLOOR if quant_floor is None else quant_floor, export_dir)
+    if quantized is None:
+        return None
+    int8_path, meta = quantized
+    return OnnxClassifier(int8_path, meta, threads, backend='onnx-int8')
+
+
+def load_classifier(model_path, backend='torch', threads=0, quant_dataset=None, quant_floor=None, threshold=0.5,
+                    export_dir=None):
+    """按后端加载分类模型；onnx-int8未通过检查时退回onnx，非torch后端失败时退回torch
+
+    quant_dataset为split_dataset.py划分出的数据集目录，用于INT8校准和一致性检查，
+    threshold为判定class2的概率阈值，export_dir为导出的ONNX和INT8模型的存放目录（为空时在模型旁边）。
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {backend}，可选 {BACKENDS}")
+    if backend != 'torch':
+        try:
+            classifier = None
+            if backend == 'onnx-int8':
+                classifier = _load_int8(model_path, threads, quant_dataset, quant_floor, threshold, export_dir)
+                if classifier is None:
+                    logger.warning("INT8模型不可用，改用FP32的ONNX模型")
+                    backend = 'onnx'
+            if classifier is None:
+                onnx_path, meta = ensure_onnx(model_path, export_dir)
+                classifier_class = OnnxClassifier if backend == 'onnx' else OpenVinoClassifier
+                classifier = classifier_class(onnx_path, meta, threads)
+            logger.info(f"{classifier.backend}推理后端已加载: {classifier.path}（{resolve_threads(threads)} 线程）")
+            return classifier
+        except Exception as e:
+            logger.error(f"加载{backend}推理后端失败，改用PyTorch: {str(e)}")
+    from ultralytics import YOLO
+    return YOLO(model_path)
+
+
+def model_cache_key(model, model_path):
+    """特征缓存中分类结果的模型标识：模型文件摘要加推理后端，不同后端的概率分开缓存"""
+    digest = file_digest(model_path)
+    if digest is None:
+        return None
+    return f"{digest}:{getattr(model, 'backend', 'torch')}"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    path, _ = ensure_onnx(sys.argv[1] if len(sys.argv) > 1 else os.path.join('models', 'best.pt'))
+    print(path)
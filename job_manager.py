@@ -0,0 +1,138 @@
+"""Web服务的多任务管理
+
+每次上传生成一个任务ID，任务有自己的上传目录和结果目录，处理状态也各自独立，
+互不覆盖。任务交给固定大小的线程池执行，超出的任务排队等待，
+已完成的任务只保留最近MAX_FINISHED_JOBS个，更早的连同目录一起清理。
+结果ZIP的下载缓存放在结果根目录下的ARCHIVE_DIRNAME中，每个任务一个子目录。
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from zip_reader import new_scan_stats
+from progress_events import ProgressChannel, progress_fields
+
+logger = logging.getLogger(__name__)
+
+MAX_PARALLEL_JOBS = 2
+MAX_FINISHED_JOBS = 20
+ARCHIVE_DIRNAME = '_archives'
+
+
+def new_job_status(job_id):
+    """任务的初始状态，字段与原来全局的processing_status一致，另加任务ID和时间"""
+    status = {
+        'job_id': job_id,
+        'is_processing': True,
+        'current_step': '排队中',
+        'progress': 0,
+        'total_images': 0,
+        'class2_images': 0,
+        'groups_found': 0,
+        'cross_case_hits': 0,
+        'error': None,
+        'created_at': time.time(),
+        'finished_at': None,
+    }
+    # zip扫描统计：跳过的非图片条目数及字节数
+    status.update(new_scan_stats())
+    # 各阶段的逐张计数和剩余时间
+    status.update(progress_fields())
+    return status
+
+
+class Job:
+    def __init__(self, job_id, upload_dir, results_dir, archive_dir):
+        self.id = job_id
+        self.upload_dir = upload_dir
+        self.results_dir = results_dir
+        self.archive_dir = archive_dir
+        self.status = new_job_status(job_id)
+        # 流水线通过它更新状态，/events据此推送进度
+        self.progress = ProgressChannel(self.status)
+
+    def directories(self):
+        return self.upload_dir, self.results_dir, self.archive_dir
+
+
+class JobManager:
+    """创建任务、在线程池中执行、查询状态，线程安全"""
+
+    def __init__(self, upload_root, results_root, max_workers=MAX_PARALLEL_JOBS, max_finished=MAX_FINISHED_JOBS):
+        self.upload_root = upload_root
+        self.results_root = results_root
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    def create(self):
+        """生成任务ID并建好该任务的上传和结果目录"""
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(job_id, os.path.join(self.upload_root, job_id), os.path.join(self.results_root, job_id),
+                  os.path.join(self.results_root, ARCHIVE_DIRNAME, job_id))
+        os.makedirs(job.upload_dir, exist_ok=True)
+        os.makedirs(job.results_dir, exist_ok=True)
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def submit(self, job, target):
+        """在线程池中执行target(job)，异常写入任务状态的error"""
+        self._executor.submit(self._run, job, target)
+
+    def _run(self, job, target):
+        job.progress.update(current_step='开始处理')
+        error = None
+        try:
+            target(job)
+        except Exception as e:
+            logger.error(f"任务 {job.id} 处理出错: {str(e)}")
+            error = str(e)
+        finally:
+            fields = {'is_processing': False, 'finished_at': time.time(), 'eta_seconds': None}
+            if error is not None:
+                fields['error'] = error
+            job.progress.close(**fields)
+            self._prune()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job):
+        """删除任务及其目录（例如上传内容无效时）"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        for directory in job.directories():
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def status(self, job_id):
+        """任务状态的副本，任务不存在时返回None"""
+        job = self.get(job_id)
+        return dict(job.status) if job is not None else None
+
+    def summary(self):
+        """所有任务的状态，按创建时间从新到旧"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        statuses = sorted((dict(job.status) for job in jobs), key=lambda s: s['created_at'], reverse=True)
+        return {
+            'jobs': statuses,
+            'active': sum(1 for s in statuses if s['is_processing']),
+        }
+
+    def _prune(self):
+        """只保留最近max_finished个已完成的任务"""
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if not job.status['is_processing']),
+                              key=lambda job: job.status['finished_at'])
+            stale = finished[:max(len(finished) - self.max_finished, 0)]
+            for job in stale:
+                del self._jobs[job.id]
+        for job in stale:
+            for directory in job.directories():
+                shutil.rmtree(directory, ignore_errors=True)
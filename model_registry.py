@@ -0,0 +1,132 @@
+"""进程内共享的分类模型
+
+Web服务每个任务都重新加载模型时，每次上传都要先付出加载torch/ultralytics模型和首次推理预热的时间。
+这里每个进程只加载、预热一次，所有任务线程共用；每次取用时检查模型文件的修改时间和大小，
+有变化再比较文件摘要，内容确实变了才重新加载（热更新），正在使用旧模型的任务不受影响。
+加载和预热耗时记录在info()中，供/health等接口展示。
+"""
+import os
+import time
+import logging
+import threading
+from PIL import Image
+from classifier import predict_probs
+from feature_cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+WARMUP_IMAGE_SIZE = 224  # 预热用空白图片的边长（模型没有声明输入尺寸时）
+
+
+def _file_signature(path):
+    """(修改时间, 大小)，文件不存在时为None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def warm_up(model):
+    """用一张空白图片推理一次，让首个任务不必承担懒初始化的开销，返回耗时（秒）"""
+    size = getattr(model, 'imgsz', None) or WARMUP_IMAGE_SIZE
+    started = time.perf_counter()
+    predict_probs(model, [Image.new('RGB', (size, size))])
+    return time.perf_counter() - started
+
+
+class ModelRegistry:
+    """按需加载并缓存模型，线程安全
+
+    load()返回模型，失败时返回None；path为需要监视的模型文件路径，
+    也可以是返回路径的函数（路径在导入后才确定时）。
+    """
+
+    def __init__(self, load, path, warmup=True):
+        self._load = load
+        self._path = path
+        self._warmup = warmup
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._model = None
+        self._signature = None
+        self._digest = None
+        self._info = {'loaded': False, 'path': None, 'backend': None, 'digest': None, 'loaded_at': None,
+                      'load_seconds': None, 'warmup_seconds': None, 'reloads': 0, 'error': None}
+
+    def model_path(self):
+        return self._path() if callable(self._path) else self._path
+
+    def get(self):
+        """当前模型；第一次调用或模型文件内容变化时（重新）加载"""
+        path = self.model_path()
+        signature = _file_signature(path)
+        if self._loaded and signature == self._signature:
+            return self._model
+        with self._lock:
+            if not self._loaded or signature != self._signature:
+                self._refresh(path, signature)
+            return self._model
+
+    def _refresh(self, path, signature):
+        """在锁内调用：文件内容没变（只是被touch或原样复制）时只更新签名
+
+        已有可用模型时，模型文件被删除（例如替换模型的过程中）或新文件加载失败（例如还没复制完），
+        继续使用旧模型，等文件再次变化时重试。
+        """
+        digest = file_digest(path) if signature is not None else None
+        if self._loaded and (digest == self._digest or (digest is None and self._model is not None)):
+            if digest is None:
+                logger.warning(f"模型文件不存在: {path}，继续使用已加载的模型")
+            self._signature = signature
+            return
+        if self._loaded:
+            logger.info(f"模型文件已变化，重新加载: {path}")
+
+        started = time.perf_counter()
+        model = self._load()
+        load_seconds = time.perf_counter() - started
+        warmup_seconds = None
+        error = None if model is not None else '模型加载失败'
+        if model is not None and self._warmup:
+            try:
+                warmup_seconds = warm_up(model)
+            except Exception as e:
+                logger.warning(f"模型预热失败: {str(e)}")
+                error = f"预热失败: {str(e)}"
+
+        if model is None and self._model is not None:
+            logger.error(f"新模型加载失败，继续使用已加载的模型: {path}")
+            self._signature = signature
+            self._info = dict(self._info, error=f"重新加载失败: {path}")
+            return
+
+        reloads = self._info['reloads'] + (1 if self._loaded else 0)
+        self._model = model
+        self._signature = signature
+        self._digest = digest
+        self._loaded = True
+        self._info = {
+            'loaded': model is not None,
+            'path': path,
+            'backend': getattr(model, 'backend', 'torch') if model is not None else None,
+            'digest': digest,
+            'loaded_at': time.time(),
+            'load_seconds': round(load_seconds, 3),
+            'warmup_seconds': round(warmup_seconds, 3) if warmup_seconds is not None else None,
+            'reloads': reloads,
+            'error': error,
+        }
+        if model is not None:
+            warmup_text = f"{warmup_seconds:.2f}s" if warmup_seconds is not None else '-'
+            logger.info(f"模型已就绪: 加载 {load_seconds:.2f}s，预热 {warmup_text}")
+
+    def preload(self):
+        """在后台线程中加载，服务启动时不必等待模型"""
+        thread = threading.Thread(target=self.get, name='model-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def info(self):
+        """加载状态和耗时，不会等待正在进行的加载"""
+        return dict(self._info)
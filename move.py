@@ -1,7 +1,10 @@
 import os
-import shutil
 import glob
 from pathlib import Path
+from output_store import OutputStore
+
+# 复制图片的方式：reflink（写时复制克隆，与源文件互不影响）/ hardlink / symlink / auto / copy，不支持时自动退回复制
+OUTPUT_LINK_MODE = 'reflink'
 
 def move_images_from_groups():
     """
@@ -19,6 +22,7 @@ def move_images_from_groups():
     
     # 计数器
     moved_count = 0
+    store = OutputStore(OUTPUT_LINK_MODE, persistent_sources=True)
     
     # 遍历源目录中的所有文件夹
     for folder_name in os.listdir(source_dir):
@@ -47,7 +51,7 @@ def move_images_from_groups():
                 
                 try:
                     # 移动文件
-                    shutil.copy2(source_image, target_path)
+                    store.place_file(source_image, target_path)
                     print(f"  已复制: {os.path.basename(source_image)} -> {new_filename}")
                     moved_count += 1
                 except Exception as e:
@@ -55,6 +59,7 @@ def move_images_from_groups():
             else:
                 print(f"  警告: {folder_name} 中没有找到图片文件")
     
+    print(f"输出方式（{OUTPUT_LINK_MODE}）: {store.describe()}")
     print(f"\n完成！共处理了 {moved_count} 个文件夹的图片")
     print(f"图片已保存到: {target_dir}")
 
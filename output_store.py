@@ -0,0 +1,166 @@
+"""分组结果的零拷贝输出
+
+按组输出照片时原来每张都完整复制一遍（shutil.copy2），大组的磁盘占用和读写量都翻倍。
+这里按OUTPUT_LINK_MODE改用文件系统的链接方式生成结果文件，文件系统不支持时自动退回复制：
+
+- reflink：写时复制克隆（Linux的FICLONE，btrfs/XFS等支持），不支持时用copy_file_range
+  在内核中复制；与原文件互不影响。
+- hardlink：硬链接，不占额外空间；结果文件与源文件是同一份数据。
+- symlink：符号链接；只链接到输出目录内已写出的文件，或调用方声明不会被删除的源文件。
+- auto：依次尝试写时复制克隆、硬链接，最后复制。
+- copy：与以前相同，完整复制。
+
+输出按图片内容寻址：同一内容（content_digest相同，如精确去重得到的副本）只写出一次，
+之后的副本链接到第一次写出的文件。ZIP内的图片没有可链接的源文件，第一次仍从压缩包流式写出。
+目标文件已存在时先删除再生成，不会通过旧的硬链接改写源文件。CSV等记录内容不受输出方式影响。
+"""
+import os
+import errno
+import shutil
+import logging
+from collections import Counter
+from zip_reader import copy_image
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_LINK_MODES = ('copy', 'auto', 'reflink', 'hardlink', 'symlink')
+# 各模式依次尝试的链接方式，全部失败后复制
+_MODE_METHODS = {
+    'copy': (),
+    'auto': ('reflink', 'hardlink'),
+    'reflink': ('reflink', 'copy_file_range'),
+    'hardlink': ('hardlink',),
+    'symlink': ('symlink',),
+}
+FICLONE = 0x40049409  # linux/fs.h
+# 这些错误说明该链接方式在当前文件系统（或跨文件系统）上不可用，本次运行不再尝试
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS,
+                       errno.EINVAL, errno.ENOTTY, errno.EMLINK}
+
+
+def _remove_existing(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def _reflink(src, dst):
+    """写时复制克隆（FICLONE），失败时删除半成品并抛出OSError"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, '当前平台不支持FICLONE')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(src, dst):
+    """在内核中复制，NFS、XFS等文件系统上可能由服务端完成或共享数据块"""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, '当前平台不支持copy_file_range')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            remaining = os.fstat(s.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link_file(src, dst, method, relative=True):
+    """用指定方式生成dst，返回实际使用的方式；不支持时抛出OSError
+
+    symlink默认使用相对路径（输出目录整体移动后仍有效），relative=False时链接到src的绝对路径。
+    """
+    if method == 'reflink':
+        _reflink(src, dst)
+    elif method == 'copy_file_range':
+        _copy_file_range(src, dst)
+    elif method == 'hardlink':
+        os.link(src, dst)
+    elif method == 'symlink':
+        target = os.path.relpath(src, os.path.dirname(dst)) if relative else os.path.abspath(src)
+        os.symlink(target, dst)
+    else:
+        raise ValueError(f"未知的链接方式: {method}")
+    return method
+
+
+class OutputStore:
+    """按内容寻址地生成结果文件，记录每种方式生成的文件数
+
+    persistent_sources=True表示磁盘上的源文件在输出之后仍然保留（如原始数据集目录），
+    symlink模式才会直接链接到源文件；否则（如解压到临时目录的图片）只链接到输出目录内的文件。
+    """
+
+    def __init__(self, mode='copy', persistent_sources=False):
+        if mode not in OUTPUT_LINK_MODES:
+            raise ValueError(f"未知的输出方式: {mode}，可选 {OUTPUT_LINK_MODES}")
+        self.mode = mode
+        self.persistent_sources = persistent_sources
+        self.counts = Counter()
+        self._written = {}
+        self._unsupported = set()
+
+    def _try_link(self, src, dst, relative=True):
+        for method in _MODE_METHODS[self.mode]:
+            if method in self._unsupported:
+                continue
+            try:
+                return link_file(src, dst, method, relative)
+            except OSError as e:
+                if e.errno in _UNSUPPORTED_ERRNOS:
+                    logger.info(f"{method}不可用（{e.strerror}），改用其他方式输出")
+                    self._unsupported.add(method)
+                else:
+                    logger.warning(f"{method}输出失败 {dst}: {str(e)}")
+        return None
+
+    def place_file(self, src, dst):
+        """把磁盘文件src输出到dst（替代shutil.copy2）"""
+        _remove_existing(dst)
+        method = None
+        if self.mode != 'symlink' or self.persistent_sources:
+            method = self._try_link(src, dst, relative=False)
+        if method is None:
+            shutil.copy2(src, dst)
+            method = 'copy'
+        self.counts[method] += 1
+        return method
+
+    def place_image(self, image_info, dest_path):
+        """把图片（ZIP内或磁盘上）输出到dest_path（替代copy_image），同一内容只写出一次"""
+        _remove_existing(dest_path)
+        key = image_info.get('content_digest')
+        method = None
+        written = self._written.get(key) if key else None
+        if written is not None and os.path.exists(written):
+            method = self._try_link(written, dest_path)
+        elif 'zip_member' not in image_info and (self.mode != 'symlink' or self.persistent_sources):
+            method = self._try_link(image_info['path'], dest_path, relative=False)
+        if method is None:
+            copy_image(image_info, dest_path)
+            method = 'copy'
+        if key and written is None:
+            self._written[key] = dest_path
+        self.counts[method] += 1
+        return method
+
+    def describe(self):
+        """各方式生成的文件数，如：hardlink 120，copy 3"""
+        return '，'.join(f"{method} {count}" for method, count in sorted(self.counts.items()))
+
+    def log_summary(self):
+        if self.mode != 'copy' and self.counts:
+            logger.info(f"结果文件输出方式（{self.mode}）: {self.describe()}")
@@ -0,0 +1,148 @@
+"""多进程并行读取与哈希
+
+把压缩包（大压缩包再按条目区间切分）分给进程池，各进程独立打开压缩包、解码图片、
+计算pHash，结果按提交顺序收回，得到与串行处理顺序一致的清单。
+单个任务出错只影响该任务内的图片，与原先逐张try/except的效果相同。
+工作进程崩溃时不知道它正在执行哪个任务：开头几个未完成的任务各用一个单独的进程重跑，
+只有真正导致崩溃的任务记为失败，其余任务换一个新进程池继续处理。
+"""
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import imagehash
+from zip_reader import find_zip_files, list_archive_images, new_scan_stats, log_scan_stats, open_image_source
+from image_hash import compute_phash
+
+logger = logging.getLogger(__name__)
+
+# 每个哈希任务最多包含的图片数，大压缩包按此切成多个任务
+INGEST_CHUNK_SIZE = 64
+
+
+def resolve_workers(workers):
+    """0或负数表示使用全部CPU核心"""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _run_ordered(fn, payloads, workers):
+    """在进程池中执行任务，按提交顺序逐个产出(结果, 异常)"""
+    index = 0
+    while index < len(payloads):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fn, *payload) for payload in payloads[index:]]
+            for future in futures:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    break
+                except Exception as e:
+                    yield None, e
+                else:
+                    yield result, None
+                index += 1
+        if index < len(payloads):
+            # 进程池已不可用。已分发给工作进程的任务都排在未完成任务的最前面，
+            # 逐个单独重跑这些任务；导致崩溃的任务若不在其中，下一轮会再次定位
+            suspects = payloads[index:index + 2 * workers + 1]
+            yield from _run_isolated(fn, suspects, workers)
+            index += len(suspects)
+
+
+def _run_isolated(fn, payloads, workers):
+    """每个任务用一个单独的进程执行（最多workers个同时运行），进程崩溃只让该任务失败"""
+    for start in range(0, len(payloads), workers):
+        executors = [ProcessPoolExecutor(max_workers=1) for _ in payloads[start:start + workers]]
+        try:
+            futures = [executor.submit(fn, *payload) for executor, payload in zip(executors, payloads[start:])]
+            for future in futures:
+                try:
+                    yield future.result(), None
+                except Exception as e:
+                    yield None, e
+        finally:
+            for executor in executors:
+                executor.shutdown()
+
+
+def _list_task(zip_path, formats, check_magic):
+    stats = new_scan_stats()
+    return list_archive_images(zip_path, formats, stats, check_magic), stats
+
+
+def iter_zip_images_parallel(zip_dir, formats, workers=0, stats=None, check_magic=False):
+    """并行读取各压缩包的中央目录（及文件头），按zip顺序逐个产出图片记录"""
+    zip_paths = find_zip_files(zip_dir)
+    payloads = [(zip_path, formats, check_magic) for zip_path in zip_paths]
+    for zip_path, (result, error) in zip(zip_paths, _run_ordered(_list_task, payloads, resolve_workers(workers))):
+        if error is not None:
+            logger.error(f"处理zip文件 {zip_path} 时出错: {str(error)}")
+            continue
+        archive_infos, archive_stats = result
+        if stats is not None:
+            for key, value in archive_stats.items():
+                stats[key] += value
+        yield from archive_infos
+
+
+def scan_zip_images_parallel(zip_dir, formats, workers=0, stats=None, check_magic=False):
+    """并行读取各压缩包的中央目录（及文件头），按zip顺序合并成一份图片清单"""
+    if stats is None:
+        stats = new_scan_stats()
+    image_infos = list(iter_zip_images_parallel(zip_dir, formats, workers, stats, check_magic))
+    log_scan_stats(stats)
+    logger.info(f"共找到 {len(image_infos)} 张图片（{stats['zip_files']} 个zip并行读取）")
+    return image_infos
+
+
+def _hash_task(image_infos, hash_size, fast_decode):
+    results = []
+    for image_info in image_infos:
+        try:
+            results.append((str(compute_phash(open_image_source(image_info), hash_size, fast_decode)), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def _split_tasks(image_infos, chunk_size):
+    """按来源压缩包切分任务，同一压缩包内再按chunk_size切成区间"""
+    tasks = []
+    current = []
+    current_source = None
+    for image_info in image_infos:
+        source = image_info.get('original_zip_path')
+        if current and (source != current_source or len(current) >= chunk_size):
+            tasks.append(current)
+            current = []
+        current.append(image_info)
+        current_source = source
+    if current:
+        tasks.append(current)
+    return tasks
+
+
+def _task_payload(image_info):
+    # 只把读取图片需要的字段传给子进程
+    keys = ('path', 'original_zip_path', 'zip_member')
+    return {key: image_info[key] for key in keys if key in image_info}
+
+
+def iter_image_hashes(image_infos, hash_size, workers=0, chunk_size=INGEST_CHUNK_SIZE, fast_decode=True):
+    """并行解码并计算pHash，按输入顺序产出(图片信息, 哈希值)，失败的哈希值为None"""
+    tasks = _split_tasks(image_infos, chunk_size)
+    payloads = [([_task_payload(info) for info in task], hash_size, fast_decode) for task in tasks]
+    for task, (results, error) in zip(tasks, _run_ordered(_hash_task, payloads, resolve_workers(workers))):
+        if error is not None:
+            logger.error(f"并行计算哈希的任务出错，{len(task)} 张图片被跳过: {str(error)}")
+            for image_info in task:
+                yield image_info, None
+            continue
+        for image_info, (hex_hash, message) in zip(task, results):
+            if message is not None:
+                logger.error(f"计算图片哈希值时出错 {image_info['path']}: {message}")
+                yield image_info, None
+            else:
+                yield image_info, imagehash.hex_to_hash(hex_hash)
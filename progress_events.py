@@ -0,0 +1,136 @@
+"""任务进度的事件通道（Server-Sent Events）
+
+处理流水线各阶段逐张汇报进度：读取的图片、已分类、已计算哈希、已写出的文件。
+ProgressChannel把这些计数写进任务状态并通知等待者，/events/<任务ID>用SSE把变化推送给浏览器，
+页面不必每秒轮询/status。每个阶段按已完成数量和耗时估算剩余时间（eta_seconds）。
+
+流水线函数接收progress参数，不需要汇报进度时（命令行运行）传None即可。
+"""
+import json
+import time
+import threading
+
+# (阶段, 显示名称, 该阶段在总进度中所占百分比)
+STAGES = (
+    ('extract', '读取图片', 10),
+    ('classify', 'YOLO分类', 50),
+    ('hash', '计算哈希', 20),
+    ('group', '相似度分组', 5),
+    ('save', '写出结果', 15),
+)
+COUNTERS = ('images_extracted', 'images_classified', 'images_hashed', 'files_written')
+SSE_MIN_INTERVAL = 0.2  # 两次推送之间的最短间隔（秒），逐张汇报时合并成一次推送
+SSE_HEARTBEAT = 15  # 没有变化时发送心跳的间隔（秒），防止代理断开空闲连接
+
+_STAGE_START = {}
+_offset = 0
+for _name, _label, _weight in STAGES:
+    _STAGE_START[_name] = (_offset, _weight, _label)
+    _offset += _weight
+
+
+def progress_fields():
+    """任务状态中与阶段进度相关的初始字段"""
+    fields = {'stage': None, 'stage_done': 0, 'stage_total': 0, 'eta_seconds': None}
+    fields.update((counter, 0) for counter in COUNTERS)
+    return fields
+
+
+class ProgressChannel:
+    """线程安全地更新任务状态，每次变化递增版本号并唤醒wait()中的推送线程"""
+
+    def __init__(self, status):
+        self.status = status
+        self.version = 0
+        self.closed = False
+        self._cond = threading.Condition()
+        self._stage_started = None
+
+    def _changed(self):
+        self.version += 1
+        self._cond.notify_all()
+
+    def update(self, **fields):
+        with self._cond:
+            self.status.update(fields)
+            self._changed()
+
+    def stage(self, name, total):
+        """进入新阶段，total为该阶段需要处理的数量"""
+        start, _, label = _STAGE_START[name]
+        with self._cond:
+            self._stage_started = time.monotonic()
+            self.status.update(stage=name, current_step=label, stage_done=0, stage_total=total,
+                               eta_seconds=None, progress=start)
+            self._changed()
+
+    def advance(self, count=1, **counters):
+        """当前阶段完成count个，counters为要累加的计数（如images_classified=1）"""
+        with self._cond:
+            status = self.status
+            for counter, value in counters.items():
+                status[counter] = status.get(counter, 0) + value
+            total = status['stage_total']
+            done = min(status['stage_done'] + count, total) if total else status['stage_done'] + count
+            status['stage_done'] = done
+            start, weight, _ = _STAGE_START[status['stage']]
+            if total:
+                status['progress'] = int(start + weight * done / total)
+                elapsed = time.monotonic() - self._stage_started
+                status['eta_seconds'] = round(elapsed / done * (total - done), 1) if done else None
+            self._changed()
+
+    def finish_stage(self):
+        """当前阶段提前结束（例如先哈希后分类时只分类了部分图片）"""
+        with self._cond:
+            remaining = self.status['stage_total'] - self.status['stage_done']
+        if remaining > 0:
+            self.advance(remaining)
+
+    def close(self, **fields):
+        """任务结束，推送最后一次状态后关闭事件流"""
+        with self._cond:
+            self.status.update(fields)
+            self.closed = True
+            self._changed()
+
+    def wait(self, version, timeout):
+        """等到版本号不同于version（或超时），返回(版本号, 状态副本, 是否已结束)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version or self.closed, timeout)
+            return self.version, dict(self.status), self.closed
+
+
+class NullProgress:
+    """不汇报进度时使用，各方法什么都不做"""
+
+    def update(self, **fields):
+        pass
+
+    def stage(self, name, total):
+        pass
+
+    def advance(self, count=1, **counters):
+        pass
+
+    def finish_stage(self):
+        pass
+
+
+NULL_PROGRESS = NullProgress()
+
+
+def stream_events(channel, min_interval=SSE_MIN_INTERVAL, heartbeat=SSE_HEARTBEAT):
+    """SSE数据流：状态有变化时推送（最多每min_interval秒一次），任务结束时发送done事件"""
+    version = None
+    while True:
+        new_version, snapshot, closed = channel.wait(version, heartbeat)
+        if new_version == version and not closed:
+            yield ': keep-alive\n\n'
+            continue
+        version = new_version
+        yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+        if closed:
+            yield 'event: done\ndata: {}\n\n'
+            return
+        time.sleep(min_interval)
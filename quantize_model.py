@@ -0,0 +1,187 @@
+"""分类模型的INT8量化与一致性检查
+
+二分类只关心class2概率是否超过CLASS2_CONFIDENCE_THRESHOLD，很适合在CPU上做训练后静态量化。
+校准图片取自split_dataset.py划分出的数据集（<数据集>/train/class1、class2），
+量化后在val集上与FP32模型逐张比较class2判定，一致率低于下限时拒绝启用，
+调用方继续使用FP32模型。
+
+量化结果和检查结果与导出的ONNX存放在同一处（best.int8.onnx 及 best.int8.onnx.json，
+指定export_dir时在该缓存目录中，模型旁边已有时优先使用），best.pt或阈值不变时不会重新量化。
+
+单独运行时量化并输出检查结果：
+    python quantize_model.py models/best.pt dataset
+"""
+import os
+import sys
+import json
+import random
+import logging
+import numpy as np
+from PIL import Image
+from zip_reader import to_model_input
+from inference_backend import ensure_onnx, preprocess, OnnxClassifier, EXPORT_META_SUFFIX, artifact_path, artifact_candidates
+
+logger = logging.getLogger(__name__)
+
+CLASS_DIRS = ('class1', 'class2')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
+CALIBRATION_IMAGES = 300  # 参与校准的训练集图片数（两类各取一半）
+EVALUATION_IMAGES = 2000  # 参与一致性检查的验证集图片数上限
+QUANT_AGREEMENT_FLOOR = 0.99  # 与FP32模型的class2判定一致率下限
+EVALUATION_BATCH_SIZE = 16
+RANDOM_SEED = 42
+
+
+def quantized_path(model_path, export_dir=None):
+    return artifact_path(model_path, '.int8.onnx', export_dir)
+
+
+def dataset_images(dataset_dir, split, limit=None):
+    """列出<数据集>/<split>/class1、class2下的图片，返回[(路径, 类别序号)]，按类别均匀抽样"""
+    per_class = None if limit is None else max(limit // len(CLASS_DIRS), 1)
+    rng = random.Random(RANDOM_SEED)
+    samples = []
+    for label, class_dir in enumerate(CLASS_DIRS):
+        directory = os.path.join(dataset_dir, split, class_dir)
+        if not os.path.isdir(directory):
+            continue
+        files = sorted(f for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTENSIONS))
+        if per_class is not None and len(files) > per_class:
+            files = sorted(rng.sample(files, per_class))
+        samples.extend((os.path.join(directory, f), label) for f in files)
+    return samples
+
+
+def load_model_input(path):
+    with Image.open(path) as img:
+        return to_model_input(img)
+
+
+class CalibrationReader:
+    """逐张提供校准输入，接口与onnxruntime.quantization.CalibrationDataReader相同"""
+
+    def __init__(self, samples, input_name, imgsz):
+        self.samples = iter(samples)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path, _ in self.samples:
+            try:
+                return {self.input_name: preprocess([load_model_input(path)], self.imgsz)}
+            except Exception as e:
+                logger.warning(f"校准图片读取失败 {path}: {str(e)}")
+        return None
+
+
+def evaluate_agreement(reference, candidate, samples, threshold):
+    """比较两个模型在同一批图片上的class2判定，返回一致率及各自相对标注的准确率"""
+    reference_probs = []
+    candidate_probs = []
+    labels = []
+    for begin in range(0, len(samples), EVALUATION_BATCH_SIZE):
+        images = []
+        for path, label in samples[begin:begin + EVALUATION_BATCH_SIZE]:
+            try:
+                images.append(load_model_input(path))
+                labels.append(label)
+            except Exception as e:
+                logger.warning(f"验证图片读取失败 {path}: {str(e)}")
+        if images:
+            reference_probs.extend(p[1] for p in reference.predict_probs(images))
+            candidate_probs.extend(p[1] for p in candidate.predict_probs(images))
+    if not labels:
+        return None
+    reference_class2 = np.array(reference_probs) >= threshold
+    candidate_class2 = np.array(candidate_probs) >= threshold
+    labels = np.array(labels) == 1
+    return {
+        'images': len(labels),
+        'threshold': threshold,
+        'agreement': float(np.mean(reference_class2 == candidate_class2)),
+        'fp32_accuracy': float(np.mean(reference_class2 == labels)),
+        'int8_accuracy': float(np.mean(candidate_class2 == labels)),
+        'max_prob_diff': float(np.abs(np.array(reference_probs) - np.array(candidate_probs)).max()),
+    }
+
+
+def quantize(model_path, dataset_dir, threshold, export_dir=None):
+    """量化并检查，返回(INT8模型路径, 说明)，校准或验证图片不足时抛出异常"""
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+
+    onnx_path, meta = ensure_onnx(model_path, export_dir)
+    int8_path = quantized_path(model_path, export_dir)
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+    reference = OnnxClassifier(onnx_path, meta)
+
+    calibration = dataset_images(dataset_dir, 'train', CALIBRATION_IMAGES)
+    evaluation = dataset_images(dataset_dir, 'val', EVALUATION_IMAGES)
+    if not calibration or not evaluation:
+        raise ValueError(f"数据集 {dataset_dir} 中没有找到train/val图片（应为split_dataset.py划分后的目录）")
+
+    logger.info(f"正在用 {len(calibration)} 张训练集图片校准INT8量化...")
+    quantize_static(
+        onnx_path, int8_path,
+        CalibrationReader(calibration, reference.input_name, reference.imgsz),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+
+    candidate = OnnxClassifier(int8_path, meta)
+    report = evaluate_agreement(reference, candidate, evaluation, threshold)
+    if report is None:
+        raise ValueError(f"数据集 {dataset_dir} 的验证集图片都无法读取")
+    int8_meta = dict(meta, evaluation=report)
+    with open(int8_path + EXPORT_META_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(int8_meta, f, ensure_ascii=False, indent=2)
+    logger.info(f"INT8与FP32的class2判定一致率 {report['agreement'] * 100:.2f}%"
+                f"（{report['images']} 张验证集图片，FP32准确率 {report['fp32_accuracy'] * 100:.2f}%，"
+                f"INT8准确率 {report['int8_accuracy'] * 100:.2f}%）")
+    return int8_path, int8_meta
+
+
+def ensure_int8(model_path, dataset_dir, threshold, floor=QUANT_AGREEMENT_FLOOR, export_dir=None):
+    """返回(INT8模型路径, 说明)；一致率低于floor或无法量化时返回None，调用方应使用FP32模型"""
+    onnx_path, meta = ensure_onnx(model_path, export_dir)
+    cached = False
+    for int8_path in artifact_candidates(model_path, '.int8.onnx', export_dir):
+        try:
+            with open(int8_path + EXPORT_META_SUFFIX, 'r', encoding='utf-8') as f:
+                int8_meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        evaluation = int8_meta.get('evaluation') or {}
+        if (os.path.exists(int8_path) and int8_meta.get('source_digest') == meta.get('source_digest')
+                and evaluation.get('threshold') == threshold):
+            cached = True
+            break
+
+    if not cached:
+        if not dataset_dir:
+            logger.warning("没有配置量化数据集，无法生成INT8模型")
+            return None
+        try:
+            int8_path, int8_meta = quantize(model_path, dataset_dir, threshold, export_dir)
+        except Exception as e:
+            # 数据集缺失或为空、没有安装onnxruntime.quantization等
+            logger.error(f"INT8量化失败: {str(e)}")
+            return None
+        evaluation = int8_meta['evaluation']
+
+    if evaluation['agreement'] < floor:
+        logger.error(f"INT8模型与FP32的class2判定一致率 {evaluation['agreement'] * 100:.2f}% "
+                     f"低于下限 {floor * 100:.2f}%，不启用INT8模型")
+        return None
+    return int8_path, int8_meta
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 3:
+        print(__doc__)
+    else:
+        path, result = quantize(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0.5)
+        print(json.dumps(result['evaluation'], ensure_ascii=False, indent=2))
@@ -0,0 +1,133 @@
+"""结果目录的ZIP打包下载
+
+边打包边发送：每写完一块数据就交给HTTP响应，客户端不必等整个ZIP生成完毕，也不再占用共享临时目录。
+JPEG、PNG等本身已压缩的图片按原样存储（ZIP_STORED），重新压缩几乎不能变小，只会消耗CPU；
+CSV等文本仍用DEFLATE压缩。
+
+打包的同时写入缓存文件，文件名带有结果目录的版本（所有文件的相对路径、大小、修改时间的摘要），
+结果没有变化时再次下载直接发送缓存文件（支持HTTP Range断点续传）；结果变化后版本随之改变，旧缓存被清理。
+多个请求同时打包时各写各的临时文件，完成后原子替换，互不干扰。
+"""
+import os
+import io
+import glob
+import uuid
+import hashlib
+import logging
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# 本身已压缩的格式，按原样存储
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip')
+ARCHIVE_CHUNK_SIZE = 1024 * 1024  # 每次读取源文件、发送给客户端的数据块大小
+
+
+def _result_files(results_dir):
+    """结果目录下的所有文件，返回[(绝对路径, ZIP内路径)]，按ZIP内路径排序"""
+    files = []
+    for root, _, names in os.walk(results_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((path, os.path.relpath(path, results_dir).replace(os.sep, '/')))
+    return sorted(files, key=lambda item: item[1])
+
+
+def results_version(results_dir):
+    """结果目录的版本：任何文件增删、大小或修改时间变化都会得到不同的版本"""
+    h = hashlib.blake2b(digest_size=8)
+    for path, arcname in _result_files(results_dir):
+        stat = os.stat(path)
+        h.update(f"{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def archive_path(archive_dir, version):
+    return os.path.join(archive_dir, f'results_{version}.zip')
+
+
+def cached_archive(archive_dir, version):
+    """已生成过的同版本ZIP，没有时返回None"""
+    path = archive_path(archive_dir, version)
+    return path if os.path.exists(path) else None
+
+
+def compress_type(arcname):
+    return zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+
+class _ChunkWriter(io.RawIOBase):
+    """ZipFile的输出目标：写入的数据同时写进缓存文件并暂存，由生成器取走发送；不可seek，
+    ZipFile会改用数据描述符记录CRC和大小"""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.pending = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.cache_file.write(data)
+        self.pending.append(data)
+        return len(data)
+
+    def drain(self):
+        chunk = b''.join(self.pending)
+        self.pending = []
+        return chunk
+
+
+def stream_archive(results_dir, archive_dir, version):
+    """逐块产出results_dir的ZIP数据，同时写入archive_dir下该版本的缓存文件
+
+    客户端中途断开时生成器被关闭，未完成的缓存文件随之删除。
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    final_path = archive_path(archive_dir, version)
+    temp_path = f"{final_path}.{uuid.uuid4().hex[:8]}.tmp"
+    completed = False
+    try:
+        with open(temp_path, 'wb') as cache_file:
+            writer = _ChunkWriter(cache_file)
+            with zipfile.ZipFile(writer, 'w') as zf:
+                for path, arcname in _result_files(results_dir):
+                    try:
+                        info = zipfile.ZipInfo.from_file(path, arcname)
+                    except OSError as e:
+                        logger.warning(f"打包时跳过无法读取的文件 {path}: {str(e)}")
+                        continue
+                    info.compress_type = compress_type(arcname)
+                    with open(path, 'rb') as src, zf.open(info, 'w') as dest:
+                        for block in iter(lambda: src.read(ARCHIVE_CHUNK_SIZE), b''):
+                            dest.write(block)
+                            chunk = writer.drain()
+                            if chunk:
+                                yield chunk
+                    chunk = writer.drain()
+                    if chunk:
+                        yield chunk
+            # ZipFile关闭时写出中央目录
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+        os.replace(temp_path, final_path)
+        completed = True
+        _remove_stale(archive_dir, final_path)
+    finally:
+        if not completed:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+def _remove_stale(archive_dir, keep_path):
+    """删除同一任务其他版本的缓存ZIP"""
+    for path in glob.glob(os.path.join(archive_dir, 'results_*.zip')):
+        if os.path.abspath(path) != os.path.abspath(keep_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
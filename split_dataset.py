@@ -1,7 +1,10 @@
 import os
-import shutil
 import random
 from pathlib import Path
+from output_store import OutputStore
+
+# 复制图片的方式：reflink（写时复制克隆，与源文件互不影响）/ hardlink / symlink / auto / copy，不支持时自动退回复制
+OUTPUT_LINK_MODE = 'reflink'
 
 def split_dataset():
     """
@@ -28,6 +31,7 @@ def split_dataset():
     
     # 支持的图片格式
     image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp']
+    store = OutputStore(OUTPUT_LINK_MODE, persistent_sources=True)
     
     def get_image_files(directory):
         """获取目录中的所有图片文件"""
@@ -56,13 +60,13 @@ def split_dataset():
         for i, file_path in enumerate(train_files):
             filename = os.path.basename(file_path)
             target_path = os.path.join(train_dir, filename)
-            shutil.copy2(file_path, target_path)
+            store.place_file(file_path, target_path)
         
         # 复制验证集文件
         for i, file_path in enumerate(val_files):
             filename = os.path.basename(file_path)
             target_path = os.path.join(val_dir, filename)
-            shutil.copy2(file_path, target_path)
+            store.place_file(file_path, target_path)
         
         return len(train_files), len(val_files)
     
@@ -89,6 +93,8 @@ def split_dataset():
     )
     print(f"class2 - 训练集: {train_count2} 张, 验证集: {val_count2} 张")
     
+    print(f"输出方式（{OUTPUT_LINK_MODE}）: {store.describe()}")
+    
     # 统计总结
     total_train = train_count1 + train_count2
     total_val = val_count1 + val_count2
@@ -0,0 +1,224 @@
+"""相似度阈值扫描：一次计算，查看0到最大阈值之间每个阈值的分组结果
+
+调整HASH_THRESHOLD原来只能改常量后整个重跑。这里一次找出汉明距离不超过最大阈值的所有图片对，
+按距离从小到大用并查集合并，记录每个距离上哪些分量并入了哪个分量（单链接聚类的合并树）。
+之后任意阈值t的分组就是把距离不超过t的合并依次应用的结果，各阈值的组数、成组图片数和组大小分布在建树时一并算好，
+查看某个阈值的具体分组只需重放合并记录，不必重新计算哈希和图片对。
+
+单链接分组与CLUSTER_MODE='components'（连通分量）的结果和组号完全一致；默认的贪心分组结果可能略有不同。
+
+用法：
+    python threshold_sweep.py <zip目录> [最大阈值] [查看分组的阈值]
+
+按group2.py的配置读取图片、YOLO筛选class2并计算哈希（特征缓存命中时不必重新推理），
+输出每个阈值的组数、成组图片数、最大组和组大小分布；指定查看阈值时列出该阈值下的各组图片。
+"""
+import os
+import sys
+import functools
+import numpy as np
+from hash_index import HashIndex, UnionFind, component_order, number_components, pack_hashes, record_sort_key
+from image_manifest import StringTable
+
+SWEEP_MAX_THRESHOLD = 12  # 扫描的最大阈值
+SWEEP_FILENAME = 'threshold_sweep.npz'
+
+
+def _string_columns(n, source_zips=None, relative_paths=None):
+    """来源ZIP名称表、每张图片的ZIP下标、ZIP内路径表，以及编组号用的排序键"""
+    zip_names, zip_ids, paths = StringTable(), np.zeros(n, dtype=np.uint32), StringTable()
+    known_zips = {}
+    sort_keys = []
+    source_zips = [''] * n if source_zips is None else source_zips
+    relative_paths = [''] * n if relative_paths is None else relative_paths
+    for i, (zip_name, path) in enumerate(zip(source_zips, relative_paths)):
+        if zip_name not in known_zips:
+            known_zips[zip_name] = zip_names.append(zip_name)
+        zip_ids[i] = known_zips[zip_name]
+        paths.append(path)
+        sort_keys.append(record_sort_key({'source_zip': zip_name, 'relative_path': path, 'path': path}))
+    return zip_names, zip_ids, paths, sort_keys
+
+
+class ThresholdSweep:
+    """单链接合并树：absorbed[k]在阈值达到其所在层时并入into[k]，第t层的记录为level_bounds[t]:level_bounds[t+1]
+
+    来源ZIP存为去重后的名称表（zip_names）加每张图片的下标（zip_ids），ZIP内路径存为拼接的文本表（paths），
+    与image_manifest相同的布局；order为编组号时的遍历顺序（按哈希、来源ZIP和ZIP内路径），建树时算好，查看分组时直接使用。
+    """
+
+    def __init__(self, hashes, absorbed, into, level_bounds, zip_names, zip_ids, paths, order):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.absorbed = absorbed
+        self.into = into
+        self.level_bounds = level_bounds
+        self.max_threshold = len(level_bounds) - 2
+        self.zip_names = zip_names
+        self.zip_ids = zip_ids
+        self.paths = paths
+        self.order = order
+        self.levels = self._level_stats()
+
+    @classmethod
+    def build(cls, hashes, max_threshold, source_zips=None, relative_paths=None, workers=None):
+        """找出距离不超过max_threshold的所有图片对，逐个距离合并，记录合并树"""
+        hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        n = len(hashes)
+        pairs_i, pairs_j, distances = HashIndex(hashes, max_threshold, workers=workers).pairs()
+        order = np.argsort(distances, kind='stable')
+        pairs_i, pairs_j, distances = pairs_i[order], pairs_j[order], distances[order]
+
+        union_find = UnionFind(n)
+        identity = np.arange(n)
+        roots_before = identity
+        absorbed, into, level_bounds = [], [], [0]
+        for threshold in range(max_threshold + 1):
+            lo, hi = np.searchsorted(distances, [threshold, threshold + 1])
+            union_find.union(pairs_i[lo:hi], pairs_j[lo:hi])
+            roots_after = union_find.roots()
+            # 本层之前是根、本层之后不再是根的分量，并入了本层合并后的根
+            merged = np.flatnonzero((roots_before == identity) & (roots_after != identity))
+            absorbed.append(merged)
+            into.append(roots_after[merged])
+            level_bounds.append(level_bounds[-1] + len(merged))
+            roots_before = roots_after
+
+        zip_names, zip_ids, paths, sort_keys = _string_columns(n, source_zips, relative_paths)
+        return cls(hashes, np.concatenate(absorbed).astype(np.intp), np.concatenate(into).astype(np.intp),
+                   np.array(level_bounds, dtype=np.intp), zip_names, zip_ids, paths,
+                   component_order(hashes, sort_keys))
+
+    def _level_stats(self):
+        """各阈值的组数、成组图片数、最大组和组大小分布（{组大小: 组数}，只计两张及以上的组）"""
+        sizes = np.ones(len(self.hashes), dtype=np.intp)
+        levels = []
+        for threshold in range(self.max_threshold + 1):
+            lo, hi = self.level_bounds[threshold], self.level_bounds[threshold + 1]
+            absorbed, into = self.absorbed[lo:hi], self.into[lo:hi]
+            np.add.at(sizes, into, sizes[absorbed])
+            sizes[absorbed] = 0
+            grouped = sizes[sizes >= 2]
+            histogram = np.bincount(grouped) if len(grouped) else np.zeros(0, dtype=np.intp)
+            levels.append({
+                'threshold': threshold,
+                'groups': int(len(grouped)),
+                'grouped_images': int(grouped.sum()),
+                'largest_group': int(grouped.max()) if len(grouped) else 0,
+                'size_histogram': {int(size): int(count) for size, count in enumerate(histogram) if count},
+            })
+        return levels
+
+    def roots_at(self, threshold):
+        """阈值为threshold时每张图片所在分量的根"""
+        if not 0 <= threshold <= self.max_threshold:
+            raise ValueError(f"阈值 {threshold} 超出扫描范围 0~{self.max_threshold}")
+        union_find = UnionFind(len(self.hashes))
+        stop = self.level_bounds[threshold + 1]
+        # 被并入的根总比目标根大，重放后压缩路径即得各分量的根
+        union_find.parent[self.absorbed[:stop]] = self.into[:stop]
+        return union_find.roots()
+
+    def groups_at(self, threshold, min_size=2):
+        """阈值为threshold时的分组 {组号: [下标...]}，组号与cluster_components相同"""
+        groups = number_components(self.roots_at(threshold), self.hashes, order=self.order)
+        return {group_id: members for group_id, members in groups.items() if len(members) >= min_size}
+
+    def describe_groups(self, threshold):
+        """JSON友好的分组：[{'group_id', 'count', 'images': [{'source_zip', 'relative_path'}]}]"""
+        return [{
+            'group_id': group_id,
+            'count': len(members),
+            'images': [{'source_zip': self.zip_names[self.zip_ids[i]], 'relative_path': self.paths[i]}
+                       for i in members],
+        } for group_id, members in self.groups_at(threshold).items()]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        zip_text, zip_ends = self.zip_names.arrays()
+        path_text, path_ends = self.paths.arrays()
+        # np.savez会给没有.npz后缀的文件名补上后缀，写到打开的文件对象上则不会
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, hashes=self.hashes, absorbed=self.absorbed, into=self.into,
+                                level_bounds=self.level_bounds, zip_text=zip_text, zip_ends=zip_ends,
+                                zip_ids=self.zip_ids, path_text=path_text, path_ends=path_ends, order=self.order)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if 'order' not in data:
+                # 旧格式按定长字符串保存来源ZIP和路径，读入后转成新布局
+                zip_names, zip_ids, paths, sort_keys = _string_columns(
+                    len(data['hashes']), data['source_zips'].tolist(), data['relative_paths'].tolist())
+                return cls(data['hashes'], data['absorbed'], data['into'], data['level_bounds'],
+                           zip_names, zip_ids, paths, component_order(data['hashes'], sort_keys))
+            return cls(data['hashes'], data['absorbed'], data['into'], data['level_bounds'],
+                       StringTable(data['zip_text'], data['zip_ends']), data['zip_ids'],
+                       StringTable(data['path_text'], data['path_ends']), data['order'])
+
+
+def sweep_hash_records(hashes, max_threshold=SWEEP_MAX_THRESHOLD, workers=None):
+    """对 {路径: {'hash': ImageHash, 'info': 图片信息}} 建立阈值扫描"""
+    records = list(hashes.values())
+    return ThresholdSweep.build(
+        pack_hashes([record['hash'] for record in records]), max_threshold,
+        [record['info'].get('source_zip', '') for record in records],
+        [record['info'].get('relative_path', '') for record in records],
+        workers)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_cached(path, mtime_ns):
+    return ThresholdSweep.load(path)
+
+
+def open_sweep(path):
+    """读取保存的阈值扫描（按修改时间缓存），不存在时返回None"""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_cached(path, mtime_ns)
+
+
+def print_sweep(sweep, current=None):
+    print(f"{'阈值':>4} {'组数':>8} {'成组图片':>8} {'最大组':>6}  组大小分布（大小×组数）")
+    for level in sweep.levels:
+        histogram = '，'.join(f"{size}×{count}" for size, count in level['size_histogram'].items())
+        marker = ' ←当前' if level['threshold'] == current else ''
+        print(f"{level['threshold']:>6} {level['groups']:>10} {level['grouped_images']:>10} "
+              f"{level['largest_group']:>9}  {histogram}{marker}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    import shutil
+    import group2
+    from zip_reader import dedupe_exact_images, with_duplicates, close_archives
+
+    input_dir = sys.argv[1]
+    max_threshold = int(sys.argv[2]) if len(sys.argv) > 2 else SWEEP_MAX_THRESHOLD
+    image_infos, temp_dirs = group2.collect_images(input_dir)
+    if group2.DEDUPE_EXACT:
+        image_infos = dedupe_exact_images(image_infos)
+    class2_images = group2.select_class2_images(group2.load_yolo_model(), image_infos)
+    hashes = {}
+    for image_info, hash_value in group2.iter_hashes(class2_images):
+        if hash_value is not None:
+            for record in with_duplicates(image_info):
+                hashes[record['path']] = {'hash': hash_value, 'info': record}
+    close_archives(input_dir)
+    for temp_dir in temp_dirs:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    sweep = sweep_hash_records(hashes, max_threshold, group2.HASH_WORKERS)
+    print(f"\n共 {len(hashes)} 张class2图片")
+    print_sweep(sweep, group2.HASH_THRESHOLD)
+    if len(sys.argv) > 3:
+        threshold = int(sys.argv[3])
+        print(f"\n阈值 {threshold} 的分组：")
+        for group in sweep.describe_groups(threshold):
+            print(f"group_{group['group_id']}（{group['count']} 张）")
+            for image in group['images']:
+                print(f"    {image['source_zip']}  {image['relative_path']}")
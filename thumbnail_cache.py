@@ -0,0 +1,137 @@
+"""结果页面的预览缩略图
+
+结果页每组显示几张预览，原来直接发送原图，一次页面加载就要传输上百张几MB的JPEG。
+这里在第一次请求时生成小尺寸的WebP（Pillow不支持WebP时用JPEG）缩略图，
+按原图内容摘要存放在磁盘缓存目录中：同一张图片出现在不同任务、不同文件名下也只生成一次，
+原图内容变化后摘要随之改变，不会用到旧缩略图。缩略图文件名就是ETag，可以放心让浏览器长期缓存。
+
+缓存总大小超过上限时，按修改时间删除最久未用的缩略图（每生成THUMBNAIL_PRUNE_EVERY张检查一次）。
+命中缓存时更新缩略图的修改时间（距上次更新超过THUMBNAIL_TOUCH_INTERVAL才更新，避免每次请求都写元数据），
+修改时间即最近使用时间，经常被查看的缩略图不会因为生成得早而被删除。
+"""
+import os
+import time
+import uuid
+import functools
+import logging
+import threading
+from PIL import Image, ImageOps, features
+from zip_reader import content_digest
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 256  # 缩略图最长边（像素）
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_CACHE_MAX_MB = 1024  # 缩略图缓存大小上限
+THUMBNAIL_PRUNE_EVERY = 500  # 每生成多少张缩略图检查一次缓存大小
+THUMBNAIL_TOUCH_INTERVAL = 3600  # 命中时距上次更新修改时间超过多少秒才再次更新
+THUMBNAIL_MAX_AGE = 7 * 24 * 3600  # 浏览器缓存时间（秒），内容变化时URL中的ETag也会变化
+DIGEST_MEMO_SIZE = 4096  # 记忆最近多少张原图的内容摘要（超过时丢弃最久未用的）
+
+
+def thumbnail_format():
+    """(Pillow格式名, 扩展名, MIME类型)"""
+    if features.check('webp'):
+        return 'WEBP', '.webp', 'image/webp'
+    return 'JPEG', '.jpg', 'image/jpeg'
+
+
+def source_digest(path):
+    """原图内容摘要（与特征缓存相同），按(路径, 修改时间, 大小)记忆最近DIGEST_MEMO_SIZE张"""
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=DIGEST_MEMO_SIZE)
+def _file_digest(path, mtime_ns, size):
+    return content_digest({'path': path})
+
+
+def render_thumbnail(source_path, dest_path, size=THUMBNAIL_SIZE):
+    """生成缩略图：JPEG按DCT缩放解码，只解出接近目标尺寸的小图"""
+    pil_format = thumbnail_format()[0]
+    with Image.open(source_path) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.thumbnail((size, size), Image.LANCZOS)
+        img.save(dest_path, pil_format, quality=THUMBNAIL_QUALITY)
+
+
+class ThumbnailCache:
+    """按原图内容摘要缓存缩略图，多线程安全（生成时先写临时文件再原子替换）"""
+
+    def __init__(self, cache_dir, size=THUMBNAIL_SIZE, max_mb=THUMBNAIL_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_mb * 1024 * 1024
+        self._created = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, digest):
+        _, ext, _ = thumbnail_format()
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}_{self.size}{ext}')
+
+    def get(self, source_path):
+        """返回(缩略图路径, ETag, MIME类型)，缓存中没有时生成，命中时更新最近使用时间"""
+        digest = source_digest(source_path)
+        path = self.path_for(digest)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and time.time() - mtime > THUMBNAIL_TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # 刚被清理掉，重新生成
+                mtime = None
+        if mtime is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+            try:
+                render_thumbnail(source_path, temp_path, self.size)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self._after_create()
+        return path, f'{digest}-{self.size}', thumbnail_format()[2]
+
+    def _after_create(self):
+        with self._lock:
+            self._created += 1
+            if self._created % THUMBNAIL_PRUNE_EVERY:
+                return
+        self.prune()
+
+    def prune(self):
+        """总大小超过上限时删除最久未用的缩略图，直到降到上限的90%"""
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        logger.info(f"缩略图缓存超过 {self.max_bytes // (1024 * 1024)} MB，删除了 {removed} 个最久未用的缩略图")
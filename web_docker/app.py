@@ -1,41 +1,59 @@
 import os
+import re
 import sys
 import json
-import tempfile
-import shutil
-import threading
-import zipfile
-from flask import Flask, render_template, request, jsonify, send_file
-from werkzeug.utils import secure_filename
-from image_processor import process_images, extract_case_number
+from urllib.parse import quote
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory, abort
+from werkzeug.utils import safe_join
+from image_processor import process_images, extract_case_number, model_registry, HASH_THRESHOLD, CLUSTER_MODE
+from job_manager import JobManager
+from progress_events import stream_events
+from result_archive import results_version, cached_archive, stream_archive
+from thumbnail_cache import ThumbnailCache, THUMBNAIL_MAX_AGE
+from case_index import CROSS_CASE_CSV
+from threshold_sweep import open_sweep, SWEEP_FILENAME
+from image_manifest import MANIFEST_FILENAME
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max
 app.config['UPLOAD_FOLDER'] = '/app/uploads'
 app.config['RESULTS_FOLDER'] = '/app/results'
+app.config['THUMBNAIL_FOLDER'] = '/app/cache/thumbnails'  # 预览缩略图缓存（按图片内容寻址，所有任务共用）
+MAX_PARALLEL_JOBS = 2  # 同时处理的任务数，更多的上传排队等待
+PRELOAD_MODEL = True  # 启动后在后台线程预加载、预热模型（不影响/health响应）；False则在第一个任务分类时才加载推理依赖
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
 
-processing_status = {
-    'is_processing': False,
-    'current_step': '',
-    'progress': 0,
-    'total_images': 0,
-    'class2_images': 0,
-    'groups_found': 0,
-    'error': None
-}
+thumbnails = ThumbnailCache(app.config['THUMBNAIL_FOLDER'])
+
+# 每次上传是一个独立任务，有自己的上传/结果目录和处理状态
+jobs = JobManager(app.config['UPLOAD_FOLDER'], app.config['RESULTS_FOLDER'], max_workers=MAX_PARALLEL_JOBS)
+
+# 启动时在后台加载并预热模型，之后所有任务共用
+if PRELOAD_MODEL:
+    model_registry.preload()
+
+def find_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404, description='任务不存在')
+    return job
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def upload_filename(filename):
+    """保留原始文件名用于案件号提取（secure_filename会去掉中文），只去掉路径部分和控制字符；清理后为空时返回None"""
+    name = os.path.basename((filename or '').replace('\\', '/'))
+    name = re.sub(r'[\x00-\x1f\x7f]', '', name).strip()
+    if name in ('', '.', '..'):
+        return None
+    return name
+
 @app.route('/upload', methods=['POST'])
 def upload_files():
-    if processing_status['is_processing']:
-        return jsonify({'error': '正在处理中，请稍后再试'}), 400
-    
     if 'files' not in request.files:
         return jsonify({'error': '没有上传文件'}), 400
     
@@ -43,79 +61,61 @@ def upload_files():
     if not files or files[0].filename == '':
         return jsonify({'error': '没有选择文件'}), 400
     
-    # 清理旧文件
-    for f in os.listdir(app.config['UPLOAD_FOLDER']):
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], f))
-    
+    job = jobs.create()
     uploaded_files = []
     for file in files:
-        if file and file.filename.endswith('.zip'):
-            filename = secure_filename(file.filename)
-            # 保留原始文件名用于案件号提取
-            original_name = file.filename
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], original_name)
+        original_name = upload_filename(file.filename) if file else None
+        if original_name and original_name.endswith('.zip'):
+            filepath = os.path.join(job.upload_dir, original_name)
             file.save(filepath)
             uploaded_files.append(original_name)
     
     if not uploaded_files:
+        jobs.discard(job)
         return jsonify({'error': '请上传ZIP文件'}), 400
     
-    # 启动后台处理
-    thread = threading.Thread(target=process_in_background)
-    thread.start()
+    # 交给后台线程池处理，任务多时排队
+    jobs.submit(job, process_job)
     
     return jsonify({
         'message': '文件上传成功，开始处理',
+        'job_id': job.id,
         'files': uploaded_files
     })
 
-def process_in_background():
-    global processing_status
-    
-    processing_status = {
-        'is_processing': True,
-        'current_step': '开始处理',
-        'progress': 10,
-        'total_images': 0,
-        'class2_images': 0,
-        'groups_found': 0,
-        'error': None
-    }
+def process_job(job):
+    # 处理图片，各阶段通过job.progress逐张汇报进度
+    group_count, image_count = process_images(
+        job.upload_dir,
+        job.results_dir,
+        use_yolo=True,
+        stats=job.status,
+        progress=job.progress,
+        sweep_path=os.path.join(job.archive_dir, SWEEP_FILENAME),
+        manifest_path=os.path.join(job.archive_dir, MANIFEST_FILENAME)
+    )
     
-    try:
-        # 清理结果目录
-        results_dir = app.config['RESULTS_FOLDER']
-        if os.path.exists(results_dir):
-            shutil.rmtree(results_dir)
-        os.makedirs(results_dir)
-        
-        processing_status['current_step'] = '正在分析图片...'
-        processing_status['progress'] = 50
-        
-        # 处理图片
-        group_count, image_count = process_images(
-            app.config['UPLOAD_FOLDER'],
-            results_dir,
-            use_yolo=True
-        )
-        
-        processing_status['groups_found'] = group_count
-        processing_status['total_images'] = image_count
-        processing_status['progress'] = 100
-        processing_status['current_step'] = '处理完成'
-        
-    except Exception as e:
-        processing_status['error'] = str(e)
-    finally:
-        processing_status['is_processing'] = False
+    job.progress.update(groups_found=group_count, total_images=image_count, progress=100, current_step='处理完成')
 
 @app.route('/status')
-def get_status():
-    return jsonify(processing_status)
+def get_all_status():
+    """所有任务的状态"""
+    return jsonify(jobs.summary())
 
-@app.route('/results')
-def get_results():
-    results_dir = app.config['RESULTS_FOLDER']
+@app.route('/status/<job_id>')
+def get_status(job_id):
+    return jsonify(find_job(job_id).status)
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """用Server-Sent Events推送任务进度，任务结束时发送done事件"""
+    job = find_job(job_id)
+    return Response(stream_events(job.progress), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/results/<job_id>')
+def get_results(job_id):
+    results_dir = find_job(job_id).results_dir
     if not os.path.exists(results_dir):
         return jsonify({'groups': []})
     
@@ -135,40 +135,77 @@ def get_results():
     
     return jsonify({'groups': groups})
 
-@app.route('/image/<path:filename>')
-def serve_image(filename):
+@app.route('/image/<job_id>/<path:filename>')
+def serve_image(job_id, filename):
     """提供图片文件访问"""
-    return send_file(os.path.join(app.config['RESULTS_FOLDER'], filename))
+    return send_from_directory(find_job(job_id).results_dir, filename)
+
+@app.route('/thumbnail/<job_id>/<path:filename>')
+def serve_thumbnail(job_id, filename):
+    """结果页预览用的缩略图（第一次请求时生成并缓存），原图仍通过/image访问"""
+    source_path = safe_join(find_job(job_id).results_dir, filename)
+    if source_path is None or not os.path.isfile(source_path):
+        abort(404)
+    try:
+        thumb_path, etag, mimetype = thumbnails.get(source_path)
+    except Exception as e:
+        app.logger.warning(f"生成缩略图失败 {source_path}: {str(e)}")
+        return send_file(source_path)
+    return send_file(thumb_path, mimetype=mimetype, etag=etag, max_age=THUMBNAIL_MAX_AGE, conditional=True)
 
-@app.route('/download_results')
-def download_results():
-    results_dir = app.config['RESULTS_FOLDER']
-    if not os.path.exists(results_dir) or not os.listdir(results_dir):
+@app.route('/download_results/<job_id>')
+def download_results(job_id):
+    job = find_job(job_id)
+    if not os.path.exists(job.results_dir) or not os.listdir(job.results_dir):
         return jsonify({'error': '没有结果可下载'}), 404
     
-    zip_path = os.path.join(tempfile.gettempdir(), 'results.zip')
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(results_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, results_dir)
-                zipf.write(file_path, arcname)
+    # 结果没有变化时直接发送上次生成的ZIP（支持Range断点续传）
+    version = results_version(job.results_dir)
+    cached = cached_archive(job.archive_dir, version)
+    if cached:
+        return send_file(cached, as_attachment=True, download_name='相似图片分组结果.zip', conditional=True)
     
-    return send_file(zip_path, as_attachment=True, download_name='相似图片分组结果.zip')
+    # 边打包边发送，同时写入缓存
+    response = Response(stream_archive(job.results_dir, job.archive_dir, version), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename=results.zip; filename*=UTF-8''{quote('相似图片分组结果.zip')}"
+    return response
 
-@app.route('/download_csv')
-def download_csv():
+@app.route('/download_csv/<job_id>')
+def download_csv(job_id):
     """单独下载CSV文件"""
-    csv_path = os.path.join(app.config['RESULTS_FOLDER'], '相似图片分组记录.csv')
+    csv_path = os.path.join(find_job(job_id).results_dir, '相似图片分组记录.csv')
     if os.path.exists(csv_path):
         return send_file(csv_path, as_attachment=True, download_name='相似图片分组记录.csv', mimetype='text/csv')
     else:
         return jsonify({'error': 'CSV文件不存在'}), 404
 
+@app.route('/download_cross_case/<job_id>')
+def download_cross_case(job_id):
+    """下载与历史案件重复的照片记录"""
+    csv_path = os.path.join(find_job(job_id).results_dir, CROSS_CASE_CSV)
+    if os.path.exists(csv_path):
+        return send_file(csv_path, as_attachment=True, download_name=CROSS_CASE_CSV, mimetype='text/csv')
+    else:
+        return jsonify({'error': '没有发现跨案件重复照片'}), 404
+
+@app.route('/threshold_sweep/<job_id>')
+def threshold_sweep(job_id):
+    """各相似度阈值下的组数和组大小分布；带?threshold=t时返回该阈值下的分组"""
+    sweep = open_sweep(os.path.join(find_job(job_id).archive_dir, SWEEP_FILENAME))
+    if sweep is None:
+        return jsonify({'error': '该任务没有阈值扫描结果'}), 404
+    threshold = request.args.get('threshold', type=int)
+    if threshold is None:
+        return jsonify({'max_threshold': sweep.max_threshold, 'current_threshold': HASH_THRESHOLD,
+                        'cluster_mode': CLUSTER_MODE, 'levels': sweep.levels})
+    if not 0 <= threshold <= sweep.max_threshold:
+        return jsonify({'error': f'阈值应在0到{sweep.max_threshold}之间'}), 400
+    return jsonify({'threshold': threshold, 'groups': sweep.describe_groups(threshold)})
+
 @app.route('/health')
 def health():
-    """健康检查接口"""
-    return jsonify({'status': 'healthy'})
+    """健康检查接口，附带模型加载状态和加载、预热耗时"""
+    return jsonify({'status': 'healthy', 'model': model_registry.info()})
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
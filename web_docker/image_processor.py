@@ -1,32 +1,69 @@
 import os
+import sys
 import shutil
 import zipfile
 import tempfile
 import csv
 import re
 import logging
-from PIL import Image
-import imagehash
-from collections import defaultdict
-from ultralytics import YOLO
 import glob
 
+# 本地运行时共享模块在上一级目录，Docker镜像内则与本文件同目录
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parallel_ingest import iter_zip_images_parallel, iter_image_hashes
+from feature_cache import open_feature_cache, iter_cached_hashes
+from image_hash import compute_phash
+from classifier import classify_batches
+from hash_first import hash_first_probs
+from progress_events import NULL_PROGRESS
+from inference_backend import load_classifier, exported_path, find_exported, model_cache_key
+from model_registry import ModelRegistry
+from zip_reader import iter_zip_images, plan_zip_entries, new_scan_stats, log_scan_stats, open_image_source, close_archives
+from output_store import OutputStore
+from case_index import screen_case_records
+from threshold_sweep import ThresholdSweep
+from image_manifest import ImageManifest
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # 配置参数
 HASH_SIZE = 8
 HASH_THRESHOLD = 5
+HASH_WORKERS = 0  # 分块比较哈希的线程数（0=使用全部CPU核心）
+CLUSTER_MODE = 'greedy'  # 分组方式：greedy=按种子逐张归组，components=连通分量（组号与遍历顺序无关）
 SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
 YOLO_MODEL_PATH = "/app/models/best.pt"  # Docker内模型路径
 CLASS2_CONFIDENCE_THRESHOLD = 0.5
+STREAM_ZIP = True  # 直接从zip读取图片到内存，不解压到临时目录
+CHECK_IMAGE_MAGIC = False  # 是否读取文件头校验图片格式（扩展名不可信时开启）
+DEDUPE_EXACT = True  # 按zip中的大小和CRC32找出完全相同的图片，每组只解码处理一张
+INGEST_WORKERS = 1  # 并行读取zip和计算哈希的进程数（1=串行，0=全部CPU核心）
+FAST_HASH_DECODE = True  # 计算哈希时JPEG按DCT缩放解码成灰度小图，比完整解码快数倍，哈希差异不超过2位
+FEATURE_CACHE_PATH = "/app/cache/feature_cache.db"  # 特征缓存文件（YOLO概率与哈希，按图片内容寻址），为空则不使用缓存
+CACHE_MAX_MB = 512  # 特征缓存大小上限，超出后淘汰最久未用的记录
+SHARED_DECODE = True  # YOLO分类时顺便用同一次读取计算哈希，class2图片不再重复读取和解码
+YOLO_BATCH_SIZE = 16  # YOLO每批推理的图片数
+PREFETCH_WORKERS = 2  # 后台预取、解码下一批图片的线程数
+INFERENCE_BACKEND = 'torch'  # 分类推理后端：torch / onnx / onnx-int8 / openvino（非torch后端首次使用时导出best.onnx并缓存在EXPORT_DIR）
+EXPORT_DIR = "/app/cache/models"  # 导出的ONNX和INT8模型存放目录（模型目录为只读挂载），模型旁边已有预先导出的文件时直接使用
+INFERENCE_THREADS = 0  # onnx/openvino推理线程数（0=全部CPU核心）
+QUANT_DATASET_DIR = "/app/dataset"  # onnx-int8的校准/验证数据集（split_dataset.py划分出的train/val目录）
+QUANT_AGREEMENT_FLOOR = 0.99  # INT8与FP32模型class2判定一致率低于此值时不启用INT8
+PIPELINE_ORDER = 'classify_first'  # classify_first=先YOLO分类再算哈希；hash_first=先算哈希按小半径分簇，每簇只对代表图片分类
+HASH_FIRST_RADIUS = 2  # hash_first的分簇半径（汉明距离），与代表距离达到该值的成员仍单独分类
+OUTPUT_LINK_MODE = 'auto'  # 输出分组照片的方式：auto（依次尝试reflink、硬链接）/ reflink / hardlink / symlink / copy，不支持时自动退回复制
+CASE_INDEX_DIR = "/app/cache/case_index"  # 跨案件相似照片索引目录（所有任务共用，持续累积），为空则不做跨案件比对
+SWEEP_MAX_THRESHOLD = 12  # 阈值扫描的最大阈值：一次算出0到该值之间每个阈值的分组，供调整HASH_THRESHOLD时参考
 
 def load_yolo_model():
     """加载YOLO分类模型"""
     try:
-        if os.path.exists(YOLO_MODEL_PATH):
-            model = YOLO(YOLO_MODEL_PATH)
-            logger.info(f"YOLO模型加载成功: {YOLO_MODEL_PATH}")
+        # 非torch后端只有导出的ONNX时也能加载
+        if os.path.exists(YOLO_MODEL_PATH) or (INFERENCE_BACKEND != 'torch' and find_exported(YOLO_MODEL_PATH, EXPORT_DIR)):
+            model = load_classifier(YOLO_MODEL_PATH, INFERENCE_BACKEND, INFERENCE_THREADS,
+                                    QUANT_DATASET_DIR, QUANT_AGREEMENT_FLOOR, CLASS2_CONFIDENCE_THRESHOLD, EXPORT_DIR)
+            logger.info(f"YOLO模型加载成功: {YOLO_MODEL_PATH}（{getattr(model, 'backend', 'torch')}）")
             return model
         else:
             logger.warning(f"模型文件不存在: {YOLO_MODEL_PATH}，将跳过YOLO分类")
@@ -35,42 +72,69 @@ def load_yolo_model():
         logger.error(f"加载YOLO模型失败: {str(e)}")
         return None
 
-def classify_images_with_yolo(model, image_paths):
-    """使用YOLO模型对图片进行分类，筛选出class2图片"""
-    if model is None:
-        logger.warning("YOLO模型未加载，返回所有图片")
-        return image_paths
-    
-    logger.info("开始使用YOLO模型进行图片分类...")
+def model_file():
+    """热更新时监视的模型文件：best.pt；非torch后端只有导出的ONNX时监视ONNX"""
+    if INFERENCE_BACKEND != 'torch' and not os.path.exists(YOLO_MODEL_PATH):
+        return find_exported(YOLO_MODEL_PATH, EXPORT_DIR) or exported_path(YOLO_MODEL_PATH)
+    return YOLO_MODEL_PATH
+
+# 每个进程只加载、预热一次模型，所有任务共用，模型文件变化时自动重新加载
+model_registry = ModelRegistry(load_yolo_model, model_file)
+
+def filter_class2(model, image_paths, progress):
+    """分类并返回class2图片，逐张汇报进度（不切换阶段，可以对同一阶段分块调用）"""
     class2_images = []
     total_images = len(image_paths)
     
-    for i, image_info in enumerate(image_paths):
-        try:
-            results = model(image_info['path'])
-            result = results[0]
+    # 先查特征缓存，未命中的按批推理，后台线程同时预取并预处理下一批
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    model_digest = model_cache_key(model, YOLO_MODEL_PATH) if cache is not None else None
+    batches = classify_batches(model, image_paths, YOLO_BATCH_SIZE, SHARED_DECODE, PREFETCH_WORKERS,
+                               cache=cache, model_digest=model_digest, hash_size=HASH_SIZE)
+    for i, (image_info, phash, probs, error) in enumerate(batches):
+        if error is not None:
+            logger.error(f"预测图片时出错 {image_info['path']}: {str(error)}")
+        elif probs is None:
+            logger.warning(f"图片 {i+1}/{total_images}: 无法获取预测结果")
+        else:
+            # 获取class1和class2的概率
+            class1_prob, class2_prob = probs[0], probs[1]
+            image_info['class2_prob'] = float(class2_prob)
             
-            if result.probs is not None:
-                class1_prob = result.probs.data[0].item()
-                class2_prob = result.probs.data[1].item()
-                
-                if class2_prob >= CLASS2_CONFIDENCE_THRESHOLD:
-                    class2_images.append(image_info)
-                    logger.info(f"图片 {i+1}/{total_images}: class2概率: {class2_prob:.3f} ✓")
-                else:
-                    logger.debug(f"图片 {i+1}/{total_images}: class2概率: {class2_prob:.3f} ✗")
-                    
-        except Exception as e:
-            logger.error(f"预测图片时出错 {image_info['path']}: {str(e)}")
-            continue
-    
-    logger.info(f"YOLO分类完成！从 {total_images} 张图片中筛选出 {len(class2_images)} 张class2图片")
+            # 如果class2概率大于阈值，则保留该图片
+            if class2_prob >= CLASS2_CONFIDENCE_THRESHOLD:
+                if phash is not None:
+                    # 读取图片时已算好哈希，计算哈希阶段直接沿用
+                    image_info['phash'] = phash
+                class2_images.append(image_info)
+                logger.debug(f"图片 {i+1}/{total_images}: class2概率: {class2_prob:.3f} ✓")
+            else:
+                logger.debug(f"图片 {i+1}/{total_images}: class2概率: {class2_prob:.3f} ✗")
+        
+        progress.advance(images_classified=1)
+        if (i + 1) % YOLO_BATCH_SIZE == 0 or i + 1 == total_images:
+            logger.info(f"已分类 {i+1}/{total_images} 张图片，其中class2 {len(class2_images)} 张")
     return class2_images
 
-def extract_zip_files(zip_dir):
+def predict_class2_probs(model, image_infos, progress):
+    """按顺序返回每张图片的class2概率（分类失败为None），逐张汇报进度"""
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    model_digest = model_cache_key(model, YOLO_MODEL_PATH) if cache is not None else None
+    class2_probs = []
+    for image_info, _, probs, error in classify_batches(model, image_infos, YOLO_BATCH_SIZE, False, PREFETCH_WORKERS,
+                                                         cache=cache, model_digest=model_digest):
+        if error is not None:
+            logger.error(f"预测图片时出错 {image_info['path']}: {str(error)}")
+        class2_probs.append(probs[1] if probs is not None else None)
+        progress.advance(images_classified=1)
+    return class2_probs
+
+def extract_zip_files(zip_dir, stats=None):
     """从指定目录提取所有zip文件中的图片"""
     image_paths = []
     temp_dirs = []
+    if stats is None:
+        stats = new_scan_stats()
     
     for root, _, files in os.walk(zip_dir):
         for file in files:
@@ -83,19 +147,9 @@ def extract_zip_files(zip_dir):
                     temp_dirs.append(temp_dir)
                     
                     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        for zip_info in zip_ref.infolist():
+                        # 按中央目录只挑出图片条目解压，其余条目不解压
+                        for zip_info, filename in plan_zip_entries(zip_ref, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC):
                             try:
-                                filename = None
-                                for encoding in ['utf-8', 'gbk', 'gb2312', 'cp437']:
-                                    try:
-                                        filename = zip_info.filename.encode('cp437').decode(encoding)
-                                        break
-                                    except (UnicodeDecodeError, UnicodeEncodeError):
-                                        continue
-                                
-                                if filename is None:
-                                    filename = zip_info.filename
-                                
                                 zip_ref.extract(zip_info, temp_dir)
                                 
                                 if filename != zip_info.filename:
@@ -124,20 +178,45 @@ def extract_zip_files(zip_dir):
                     logger.error(f"处理zip文件 {zip_path} 时出错: {str(e)}")
                     continue
     
+    log_scan_stats(stats)
     logger.info(f"共提取了 {len(image_paths)} 张图片")
     return image_paths, temp_dirs
 
+def collect_manifest(zip_dir, stats=None):
+    """收集zip中的图片建立列式清单，逐个zip转换，不保留每张图片的信息字典；STREAM_ZIP=False时解压后再建立"""
+    if not STREAM_ZIP:
+        image_infos, temp_dirs = extract_zip_files(zip_dir, stats)
+        return ImageManifest.from_image_infos(image_infos), temp_dirs
+    if stats is None:
+        stats = new_scan_stats()
+    if INGEST_WORKERS != 1:
+        image_infos = iter_zip_images_parallel(zip_dir, SUPPORTED_FORMATS, INGEST_WORKERS, stats, CHECK_IMAGE_MAGIC)
+    else:
+        image_infos = iter_zip_images(zip_dir, SUPPORTED_FORMATS, stats, CHECK_IMAGE_MAGIC)
+    manifest = ImageManifest.from_image_infos(image_infos)
+    log_scan_stats(stats)
+    logger.info(f"共找到 {len(manifest)} 张图片（直接从zip读取，不解压），清单占用 {manifest.nbytes() / 1024 / 1024:.1f} MB")
+    return manifest, []
+
 def calculate_image_hash(image_info):
     """计算单张图片的哈希值"""
     try:
-        with Image.open(image_info['path']) as img:
-            img = img.convert('RGB')
-            h = imagehash.phash(img, hash_size=HASH_SIZE)
-            return h
+        return compute_phash(open_image_source(image_info), HASH_SIZE, FAST_HASH_DECODE)
     except Exception as e:
         logger.error(f"计算图片哈希值时出错 {image_info['path']}: {str(e)}")
         return None
 
+def compute_hashes(image_infos):
+    """逐张计算哈希，INGEST_WORKERS不为1时交给进程池并行计算，按输入顺序产出(图片信息, 哈希值)"""
+    if INGEST_WORKERS == 1:
+        return ((image_info, calculate_image_hash(image_info)) for image_info in image_infos)
+    return iter_image_hashes(image_infos, HASH_SIZE, INGEST_WORKERS, fast_decode=FAST_HASH_DECODE)
+
+def iter_hashes(image_infos):
+    """按输入顺序产出(图片信息, 哈希值)：分类时已算好或特征缓存命中的直接使用，其余交给compute_hashes"""
+    cache = open_feature_cache(FEATURE_CACHE_PATH, CACHE_MAX_MB)
+    return iter_cached_hashes(image_infos, compute_hashes, cache, HASH_SIZE, FAST_HASH_DECODE)
+
 def extract_case_number(filename):
     """从文件名中提取案件号"""
     # 完整案件号格式：DQIHWXO80125054932__20250805105326
@@ -171,48 +250,14 @@ def extract_case_number(filename):
         return name[:50]
     return name[:20] if name else 'unknown'
 
-def process_similarity(image_infos):
-    """计算相似度并分组"""
-    logger.info("正在计算图片哈希值...")
-    hashes = {}
-    for image_info in image_infos:
-        hash_value = calculate_image_hash(image_info)
-        if hash_value is not None:
-            hashes[image_info['path']] = {
-                'hash': hash_value,
-                'info': image_info
-            }
-    
-    logger.info(f"成功计算了 {len(hashes)} 张图片的哈希值")
-    
-    logger.info("正在按相似度分组...")
-    groups = defaultdict(list)
-    processed = set()
-    
-    for path1, hash_data1 in hashes.items():
-        if path1 in processed:
-            continue
-        
-        group_id = len(groups) + 1
-        groups[group_id].append(hash_data1['info'])
-        processed.add(path1)
-        
-        for path2, hash_data2 in hashes.items():
-            if path2 in processed:
-                continue
-            
-            distance = hash_data1['hash'] - hash_data2['hash']
-            if distance <= HASH_THRESHOLD:
-                groups[group_id].append(hash_data2['info'])
-                processed.add(path2)
-    
-    # 过滤掉单张图片的组
-    return {k: v for k, v in groups.items() if len(v) > 1}
-
-def save_results(groups, output_dir):
+def save_results(groups, output_dir, progress=None):
     """保存分组结果"""
     os.makedirs(output_dir, exist_ok=True)
     csv_data = []
+    # 按内容寻址输出：能链接时不复制，完全相同的副本只写出一次
+    store = OutputStore(OUTPUT_LINK_MODE)
+    progress = progress or NULL_PROGRESS
+    progress.stage('save', sum(len(images) for images in groups.values()))
     csv_headers = ['组别', '序号', '案件号', '原始文件名', '新文件名', '来源ZIP', 'ZIP内路径', '相似度组大小']
     
     for group_id, images in groups.items():
@@ -234,7 +279,8 @@ def save_results(groups, output_dir):
             new_filename = re.sub(r'[<>:"/\\|?*]', '_', new_filename)
             
             dest_path = os.path.join(group_dir, new_filename)
-            shutil.copy2(image_info['path'], dest_path)
+            store.place_image(image_info, dest_path)
+            progress.advance(files_written=1)
             
             csv_data.append([
                 f'group_{group_id}',
@@ -247,6 +293,8 @@ def save_results(groups, output_dir):
                 len(images)
             ])
     
+    store.log_summary()
+    
     csv_path = os.path.join(output_dir, '相似图片分组记录.csv')
     try:
         with open(csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
@@ -259,40 +307,143 @@ def save_results(groups, output_dir):
     
     return len(groups), sum(len(g) for g in groups.values())
 
-def process_images(input_dir, output_dir, use_yolo=True):
-    """主处理函数"""
+def classify_manifest(model, manifest, progress=None):
+    """对代表图片运行YOLO分类，class2图片在清单中标记为入选，概率和顺便算出的哈希写回清单
+
+    每次只为MANIFEST_CHUNK_SIZE张图片生成信息字典；先哈希后分类时在整个哈希列上分簇一次，
+    只有各簇代表（及需要复查的成员）分块分类。
+    """
+    progress = progress or NULL_PROGRESS
+    rows = manifest.representatives()
+    if PIPELINE_ORDER == 'hash_first':
+        logger.info("正在计算图片哈希值（先哈希后分类）...")
+        hash_manifest(manifest, rows, progress)
+        rows = rows[manifest.has_hash[rows]]
+        progress.stage('classify', len(rows))
+        
+        def predict(indices):
+            class2_probs = []
+            for chunk in manifest.chunks(rows[indices]):
+                image_infos = manifest.views(chunk)
+                class2_probs.extend(predict_class2_probs(model, image_infos, progress))
+                manifest.absorb(image_infos)
+            return class2_probs
+        
+        probs, decided = hash_first_probs(manifest.hash[rows], predict, CLASS2_CONFIDENCE_THRESHOLD,
+                                          radius=HASH_FIRST_RADIUS, recheck_distance=HASH_FIRST_RADIUS,
+                                          workers=HASH_WORKERS)
+        manifest.prob[rows[decided]] = probs[decided]
+        manifest.selected[rows[decided & (probs >= CLASS2_CONFIDENCE_THRESHOLD)]] = True
+        progress.finish_stage()
+    else:
+        logger.info("开始使用YOLO模型进行图片分类...")
+        progress.stage('classify', len(rows))
+        for chunk in manifest.chunks(rows):
+            image_infos = manifest.views(chunk)
+            class2_images = filter_class2(model, image_infos, progress)
+            manifest.absorb(image_infos)
+            manifest.selected[[image_info['manifest_row'] for image_info in class2_images]] = True
+    logger.info(f"YOLO分类完成！从 {len(manifest)} 张图片中筛选出 {int(manifest.selected.sum())} 张class2代表图片")
+
+def hash_manifest(manifest, rows, progress=None):
+    """分块计算rows中图片的哈希值（分类时已算好或特征缓存命中的直接使用），写入清单的pHash列"""
+    progress = progress or NULL_PROGRESS
+    progress.stage('hash', len(rows))
+    for chunk in manifest.chunks(rows):
+        image_infos = manifest.views(chunk)
+        for image_info, hash_value in iter_hashes(image_infos):
+            progress.advance(images_hashed=1)
+            if hash_value is not None:
+                manifest.set_hash(image_info['manifest_row'], hash_value)
+        manifest.absorb(image_infos)
+
+def group_manifest(manifest, progress=None):
+    """按相似度分组，返回(参与分组的行号, 两张及以上的组 {组号: 行号数组})"""
+    progress = progress or NULL_PROGRESS
+    logger.info("正在按相似度分组...")
+    progress.stage('group', 1)
+    rows = manifest.ordered_rows(manifest.selected & manifest.has_hash)
+    groups = manifest.group_rows(rows, HASH_THRESHOLD, workers=HASH_WORKERS, clustering=CLUSTER_MODE)
+    progress.advance()
+    return rows, groups
+
+def save_threshold_sweep(manifest, rows, sweep_path):
+    """建立0到SWEEP_MAX_THRESHOLD的阈值扫描并保存，失败时只记录日志"""
+    try:
+        ThresholdSweep.build(manifest.hash[rows], SWEEP_MAX_THRESHOLD, manifest.source_zips(rows),
+                             manifest.relative_paths(rows), HASH_WORKERS).save(sweep_path)
+    except Exception as e:
+        logger.error(f"建立阈值扫描失败: {str(e)}")
+
+def process_images(input_dir, output_dir, use_yolo=True, stats=None, progress=None, sweep_path=None, manifest_path=None):
+    """主处理函数，stats不为None时写入zip扫描统计（跳过的条目数、字节数等），
+    progress为任务进度通道，各阶段逐张汇报进度，sweep_path不为None时在该处保存阈值扫描，
+    manifest_path不为None时在该处保存图片清单（各图片的class2概率、哈希和组号）"""
+    progress = progress or NULL_PROGRESS
     logger.info(f"开始处理: {input_dir}")
     
-    # 加载模型
-    model = load_yolo_model() if use_yolo else None
-    
-    # 提取图片
-    image_infos, temp_dirs = extract_zip_files(input_dir)
-    
-    if not image_infos:
-        logger.warning("没有找到任何图片文件")
-        return 0, 0
-    
-    # YOLO分类
-    if model:
-        image_infos = classify_images_with_yolo(model, image_infos)
-    
-    if not image_infos:
-        logger.warning("没有找到符合条件的图片")
-        return 0, 0
-    
-    # 相似度分组
-    groups = process_similarity(image_infos)
+    # 取进程内共享的模型（只在第一次或模型文件变化时加载）
+    model = model_registry.get() if use_yolo else None
     
-    # 保存结果
-    group_count, image_count = save_results(groups, output_dir)
-    
-    # 清理临时文件
-    for temp_dir in temp_dirs:
-        try:
-            shutil.rmtree(temp_dir)
-        except:
-            pass
+    temp_dirs = []
+    try:
+        # 提取图片，按列存入清单
+        progress.stage('extract', 1)
+        manifest, temp_dirs = collect_manifest(input_dir, stats)
+        progress.advance(images_extracted=len(manifest))
+        
+        if not len(manifest):
+            logger.warning("没有找到任何图片文件")
+            return 0, 0
+        
+        # 完全相同的图片只处理一张，结果分发给所有副本
+        if DEDUPE_EXACT:
+            manifest.dedupe_exact()
+        
+        # YOLO分类
+        if model:
+            classify_manifest(model, manifest, progress)
+            manifest.propagate()
+            progress.update(class2_images=int(manifest.selected.sum()))
+        else:
+            manifest.selected[:] = True
+        
+        if not manifest.selected.any():
+            logger.warning("没有找到符合条件的图片")
+            return 0, 0
+        
+        # 相似度分组：入选的代表图片计算哈希后分发给完全相同的副本
+        logger.info("正在计算图片哈希值...")
+        representatives = manifest.representatives()
+        hash_manifest(manifest, representatives[manifest.selected[representatives]], progress)
+        manifest.propagate()
+        logger.info(f"成功计算了 {int((manifest.selected & manifest.has_hash).sum())} 张图片的哈希值")
+        rows, groups = group_manifest(manifest, progress)
+        
+        # 与历史案件的照片比对，案件号不同的相似照片另写一份CSV
+        cross_case_hits = screen_case_records(CASE_INDEX_DIR, manifest.case_records(rows, extract_case_number),
+                                              HASH_THRESHOLD, output_dir)
+        progress.update(cross_case_hits=cross_case_hits)
+        
+        if sweep_path:
+            save_threshold_sweep(manifest, rows, sweep_path)
+        
+        if manifest_path:
+            try:
+                manifest.save(manifest_path)
+            except Exception as e:
+                logger.error(f"保存图片清单失败: {str(e)}")
+        
+        # 保存结果，每次只为一组生成图片信息字典
+        group_count, image_count = save_results(manifest.group_views(groups), output_dir, progress)
+    finally:
+        # 出错或提前返回时同样清理临时文件
+        close_archives(input_dir)
+        for temp_dir in temp_dirs:
+            try:
+                shutil.rmtree(temp_dir)
+            except:
+                pass
     
     logger.info(f"处理完成！共找到 {group_count} 组相似照片，总计 {image_count} 张图片")
     return group_count, image_count
\ No newline at end of file
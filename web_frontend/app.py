@@ -1,13 +1,11 @@
 import os
 import sys
 import json
-import tempfile
 import shutil
-import threading
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file
-from werkzeug.utils import secure_filename
-import zipfile
+from urllib.parse import quote
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory, abort
+from werkzeug.utils import secure_filename, safe_join
 
 sys.path.append('..')
 
@@ -17,39 +15,56 @@ group2.YOLO_MODEL_PATH = r"..\models\best.pt"
 
 from group2 import (
     load_yolo_model, 
-    classify_images_with_yolo,
-    extract_zip_files,
-    calculate_image_hash,
+    select_class2_images,
+    collect_images,
+    iter_hashes,
     find_similar_photos_with_yolo
 )
+from hash_index import group_hash_records
+from zip_reader import close_archives, dedupe_exact_images, with_duplicates, expand_duplicates
+from job_manager import JobManager
+from output_store import OutputStore
+from progress_events import NULL_PROGRESS, stream_events
+from result_archive import results_version, cached_archive, stream_archive
+from thumbnail_cache import ThumbnailCache, THUMBNAIL_MAX_AGE
+from model_registry import ModelRegistry
+from case_index import screen_hash_records, CROSS_CASE_CSV
+from threshold_sweep import sweep_hash_records, open_sweep, SWEEP_FILENAME
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['RESULTS_FOLDER'] = 'results'
+app.config['THUMBNAIL_FOLDER'] = 'thumbnails'  # 预览缩略图缓存（按图片内容寻址，所有任务共用）
+app.config['CASE_INDEX_FOLDER'] = 'case_index'  # 跨案件相似照片索引（所有任务共用，持续累积），为空则不做跨案件比对
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
 
-# 全局变量存储处理状态
-processing_status = {
-    'is_processing': False,
-    'current_step': '',
-    'progress': 0,
-    'total_images': 0,
-    'class2_images': 0,
-    'groups_found': 0,
-    'error': None
-}
+thumbnails = ThumbnailCache(app.config['THUMBNAIL_FOLDER'])
 
-# 加载YOLO模型（启动时加载一次）
-yolo_model = None
+# 相似度分组参数
+HASH_THRESHOLD = 5
+HASH_WORKERS = 0
+CLUSTER_MODE = 'greedy'
+SWEEP_MAX_THRESHOLD = 12  # 阈值扫描的最大阈值，/threshold_sweep可查看0到该值之间每个阈值的分组
+
+# 每次上传是一个独立任务，有自己的上传/结果目录和处理状态
+MAX_PARALLEL_JOBS = 2  # 同时处理的任务数，更多的上传排队等待
+jobs = JobManager(app.config['UPLOAD_FOLDER'], app.config['RESULTS_FOLDER'], max_workers=MAX_PARALLEL_JOBS)
+
+# YOLO模型每个进程只加载、预热一次，所有任务共用，模型文件变化时自动重新加载
+model_registry = ModelRegistry(load_yolo_model, lambda: group2.YOLO_MODEL_PATH)
 
 def init_model():
-    global yolo_model
-    yolo_model = load_yolo_model()
-    if yolo_model is None:
-        processing_status['error'] = "YOLO模型加载失败"
+    if model_registry.get() is None:
+        print("YOLO模型加载失败")
+
+def find_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404, description='任务不存在')
+    return job
 
 @app.route('/')
 def index():
@@ -57,9 +72,6 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
-    if processing_status['is_processing']:
-        return jsonify({'error': '正在处理中，请稍后再试'}), 400
-    
     if 'files' not in request.files:
         return jsonify({'error': '没有上传文件'}), 400
     
@@ -67,53 +79,36 @@ def upload_files():
     if not files or files[0].filename == '':
         return jsonify({'error': '没有选择文件'}), 400
     
-    # 清理旧文件
-    for f in os.listdir(app.config['UPLOAD_FOLDER']):
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], f))
-    
+    job = jobs.create()
     uploaded_files = []
     for file in files:
         if file and file.filename.endswith('.zip'):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(job.upload_dir, filename)
             file.save(filepath)
             uploaded_files.append(filename)
     
     if not uploaded_files:
+        jobs.discard(job)
         return jsonify({'error': '请上传ZIP文件'}), 400
     
-    # 启动后台处理
-    thread = threading.Thread(target=process_images)
-    thread.start()
+    # 交给后台线程池处理，任务多时排队
+    jobs.submit(job, process_job)
     
     return jsonify({
         'message': '文件上传成功，开始处理',
+        'job_id': job.id,
         'files': uploaded_files
     })
 
-def process_images():
-    global processing_status
-    
-    processing_status = {
-        'is_processing': True,
-        'current_step': '提取图片',
-        'progress': 10,
-        'total_images': 0,
-        'class2_images': 0,
-        'groups_found': 0,
-        'error': None
-    }
+def process_job(job):
+    status = job.status
+    progress = job.progress
     
     try:
-        # 清理结果目录
-        results_dir = app.config['RESULTS_FOLDER']
-        if os.path.exists(results_dir):
-            shutil.rmtree(results_dir)
-        os.makedirs(results_dir)
-        
         # 提取ZIP文件（确保保留source_zip信息）
-        processing_status['current_step'] = '提取ZIP文件中的图片'
-        image_infos, temp_dirs = extract_zip_files(app.config['UPLOAD_FOLDER'])
+        progress.stage('extract', 1)
+        image_infos, temp_dirs = collect_images(job.upload_dir, status)
         
         # 确保每个image_info包含source_zip信息
         for info in image_infos:
@@ -121,29 +116,41 @@ def process_images():
                 # 从路径推断source_zip
                 info['source_zip'] = 'unknown.zip'
         
-        processing_status['total_images'] = len(image_infos)
-        processing_status['progress'] = 30
+        progress.advance(images_extracted=len(image_infos))
+        progress.update(total_images=len(image_infos))
         
         if not image_infos:
             raise Exception("未找到图片文件")
         
-        # YOLO分类
-        processing_status['current_step'] = 'YOLO模型分类中'
-        class2_images = classify_images_with_yolo(yolo_model, image_infos)
-        processing_status['class2_images'] = len(class2_images)
-        processing_status['progress'] = 60
+        # 完全相同的图片只分类一张，结果分发给所有副本
+        if group2.DEDUPE_EXACT:
+            image_infos = dedupe_exact_images(image_infos)
+        
+        # YOLO分类（逐张汇报进度）
+        class2_images = select_class2_images(model_registry.get(), image_infos, progress)
+        progress.update(class2_images=len(expand_duplicates(class2_images)))
         
         if not class2_images:
             raise Exception("未找到class2图片")
         
         # 计算哈希值和分组
-        processing_status['current_step'] = '计算相似度并分组'
-        groups = process_similarity(class2_images)
-        processing_status['groups_found'] = len(groups)
-        processing_status['progress'] = 90
+        hashes = hash_images(class2_images, progress)
+        groups = group_hashes(hashes, progress)
+        progress.update(groups_found=len(groups))
         
         # 保存结果
-        save_results(groups)
+        save_results(groups, job.results_dir, progress)
+        
+        # 与历史案件的照片比对，案件号不同的相似照片另写一份CSV
+        cross_case_hits = screen_hash_records(app.config['CASE_INDEX_FOLDER'], hashes, HASH_THRESHOLD,
+                                              extract_case_number, job.results_dir)
+        progress.update(cross_case_hits=cross_case_hits)
+        
+        # 一次算出各阈值下的分组，供调整阈值时查看
+        try:
+            sweep_hash_records(hashes, SWEEP_MAX_THRESHOLD, HASH_WORKERS).save(os.path.join(job.archive_dir, SWEEP_FILENAME))
+        except Exception as e:
+            app.logger.error(f"建立阈值扫描失败: {str(e)}")
         
         # 清理临时文件
         for temp_dir in temp_dirs:
@@ -152,56 +159,39 @@ def process_images():
             except:
                 pass
         
-        processing_status['progress'] = 100
-        processing_status['current_step'] = '处理完成'
-        
-    except Exception as e:
-        processing_status['error'] = str(e)
+        progress.update(progress=100, current_step='处理完成')
     finally:
-        processing_status['is_processing'] = False
+        close_archives(job.upload_dir)
 
-def process_similarity(image_infos):
-    from collections import defaultdict
-    import imagehash
-    
-    HASH_SIZE = 8
-    HASH_THRESHOLD = 5
-    
+def hash_images(image_infos, progress=NULL_PROGRESS):
+    progress.stage('hash', len(image_infos))
     hashes = {}
-    for info in image_infos:
-        hash_value = calculate_image_hash(info)
+    for info, hash_value in iter_hashes(image_infos):
+        progress.advance(images_hashed=1)
         if hash_value:
-            hashes[info['path']] = {'hash': hash_value, 'info': info}
-    
-    groups = defaultdict(list)
-    processed = set()
-    
-    for path1, data1 in hashes.items():
-        if path1 in processed:
-            continue
-        
-        group_id = len(groups) + 1
-        groups[group_id].append(data1['info'])
-        processed.add(path1)
-        
-        for path2, data2 in hashes.items():
-            if path2 in processed:
-                continue
-            
-            distance = data1['hash'] - data2['hash']
-            if distance <= HASH_THRESHOLD:
-                groups[group_id].append(data2['info'])
-                processed.add(path2)
+            for record in with_duplicates(info):
+                hashes[record['path']] = {'hash': hash_value, 'info': record}
+    return hashes
+
+def group_hashes(hashes, progress=NULL_PROGRESS):
+    progress.stage('group', 1)
+    groups = group_hash_records(hashes, HASH_THRESHOLD, workers=HASH_WORKERS, clustering=CLUSTER_MODE)
+    progress.advance()
     
     # 过滤掉单张图片的组
     return {k: v for k, v in groups.items() if len(v) > 1}
 
-def save_results(groups):
+def process_similarity(image_infos, progress=NULL_PROGRESS):
+    return group_hashes(hash_images(image_infos, progress), progress)
+
+def save_results(groups, results_dir, progress=NULL_PROGRESS):
     import csv
     import re
     
-    results_dir = app.config['RESULTS_FOLDER']
     csv_data = []
+    # 按内容寻址输出：能链接时不复制，完全相同的副本只写出一次
+    store = OutputStore(group2.OUTPUT_LINK_MODE)
+    progress.stage('save', sum(len(images) for images in groups.values()))
     csv_headers = ['组别', '序号', '案件号', '原始文件名', '新文件名', '来源ZIP', 'ZIP内路径', '相似度组大小']
     
     for group_id, images in groups.items():
@@ -226,7 +216,8 @@ def save_results(groups):
             new_filename = re.sub(r'[<>:"/\\|?*]', '_', new_filename)
             
             dest_path = os.path.join(group_dir, new_filename)
-            shutil.copy2(image_info['path'], dest_path)
+            store.place_image(image_info, dest_path)
+            progress.advance(files_written=1)
             
             # 添加到CSV数据
             csv_data.append([
@@ -240,6 +231,8 @@ def save_results(groups):
                 len(images)
             ])
     
+    store.log_summary()
+    
     # 生成CSV文件
     csv_path = os.path.join(results_dir, '相似图片分组记录.csv')
     try:
@@ -292,12 +285,24 @@ def extract_case_number(filename):
     return name[:20] if name else 'unknown'
 
 @app.route('/status')
-def get_status():
-    return jsonify(processing_status)
+def get_all_status():
+    """所有任务的状态"""
+    return jsonify(jobs.summary())
+
+@app.route('/status/<job_id>')
+def get_status(job_id):
+    return jsonify(find_job(job_id).status)
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """用Server-Sent Events推送任务进度，任务结束时发送done事件"""
+    job = find_job(job_id)
+    return Response(stream_events(job.progress), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-@app.route('/results')
-def get_results():
-    results_dir = app.config['RESULTS_FOLDER']
+@app.route('/results/<job_id>')
+def get_results(job_id):
+    results_dir = find_job(job_id).results_dir
     if not os.path.exists(results_dir):
         return jsonify({'groups': []})
     
@@ -318,37 +323,78 @@ def get_results():
     
     return jsonify({'groups': groups})
 
-@app.route('/image/<path:filename>')
-def serve_image(filename):
+@app.route('/image/<job_id>/<path:filename>')
+def serve_image(job_id, filename):
     """提供图片文件访问"""
-    return send_file(os.path.join(app.config['RESULTS_FOLDER'], filename))
+    return send_from_directory(find_job(job_id).results_dir, filename)
 
-@app.route('/download_results')
-def download_results():
-    results_dir = app.config['RESULTS_FOLDER']
-    if not os.path.exists(results_dir) or not os.listdir(results_dir):
+@app.route('/thumbnail/<job_id>/<path:filename>')
+def serve_thumbnail(job_id, filename):
+    """结果页预览用的缩略图（第一次请求时生成并缓存），原图仍通过/image访问"""
+    source_path = safe_join(find_job(job_id).results_dir, filename)
+    if source_path is None or not os.path.isfile(source_path):
+        abort(404)
+    try:
+        thumb_path, etag, mimetype = thumbnails.get(source_path)
+    except Exception as e:
+        app.logger.warning(f"生成缩略图失败 {source_path}: {str(e)}")
+        return send_file(source_path)
+    return send_file(thumb_path, mimetype=mimetype, etag=etag, max_age=THUMBNAIL_MAX_AGE, conditional=True)
+
+@app.route('/download_results/<job_id>')
+def download_results(job_id):
+    job = find_job(job_id)
+    if not os.path.exists(job.results_dir) or not os.listdir(job.results_dir):
         return jsonify({'error': '没有结果可下载'}), 404
     
-    # 创建ZIP文件
-    zip_path = os.path.join(tempfile.gettempdir(), 'results.zip')
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(results_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, results_dir)
-                zipf.write(file_path, arcname)
+    # 结果没有变化时直接发送上次生成的ZIP（支持Range断点续传）
+    version = results_version(job.results_dir)
+    cached = cached_archive(job.archive_dir, version)
+    if cached:
+        return send_file(cached, as_attachment=True, download_name='相似图片分组结果.zip', conditional=True)
     
-    return send_file(zip_path, as_attachment=True, download_name='相似图片分组结果.zip')
+    # 边打包边发送，同时写入缓存
+    response = Response(stream_archive(job.results_dir, job.archive_dir, version), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename=results.zip; filename*=UTF-8''{quote('相似图片分组结果.zip')}"
+    return response
 
-@app.route('/download_csv')
-def download_csv():
+@app.route('/download_csv/<job_id>')
+def download_csv(job_id):
     """单独下载CSV文件"""
-    csv_path = os.path.join(app.config['RESULTS_FOLDER'], '相似图片分组记录.csv')
+    csv_path = os.path.join(find_job(job_id).results_dir, '相似图片分组记录.csv')
     if os.path.exists(csv_path):
         return send_file(csv_path, as_attachment=True, download_name='相似图片分组记录.csv', mimetype='text/csv')
     else:
         return jsonify({'error': 'CSV文件不存在'}), 404
 
+@app.route('/download_cross_case/<job_id>')
+def download_cross_case(job_id):
+    """下载与历史案件重复的照片记录"""
+    csv_path = os.path.join(find_job(job_id).results_dir, CROSS_CASE_CSV)
+    if os.path.exists(csv_path):
+        return send_file(csv_path, as_attachment=True, download_name=CROSS_CASE_CSV, mimetype='text/csv')
+    else:
+        return jsonify({'error': '没有发现跨案件重复照片'}), 404
+
+@app.route('/threshold_sweep/<job_id>')
+def threshold_sweep(job_id):
+    """各相似度阈值下的组数和组大小分布；带?threshold=t时返回该阈值下的分组"""
+    sweep = open_sweep(os.path.join(find_job(job_id).archive_dir, SWEEP_FILENAME))
+    if sweep is None:
+        return jsonify({'error': '该任务没有阈值扫描结果'}), 404
+    threshold = request.args.get('threshold', type=int)
+    if threshold is None:
+        return jsonify({'max_threshold': sweep.max_threshold, 'current_threshold': HASH_THRESHOLD,
+                        'cluster_mode': CLUSTER_MODE, 'levels': sweep.levels})
+    if not 0 <= threshold <= sweep.max_threshold:
+        return jsonify({'error': f'阈值应在0到{sweep.max_threshold}之间'}), 400
+    return jsonify({'threshold': threshold, 'groups': sweep.describe_groups(threshold)})
+
+@app.route('/health')
+def health():
+    """健康检查接口，附带模型加载状态和加载、预热耗时"""
+    return jsonify({'status': 'healthy', 'model': model_registry.info()})
+
 if __name__ == '__main__':
     init_model()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
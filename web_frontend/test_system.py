@@ -130,6 +130,691 @@ def test_zip_handling():
         print(f"[ERROR] 错误: {e}")
         return False
 
+def test_zip_streaming():
+    """测试直接从ZIP读取图片"""
+    print("\n" + "=" * 50)
+    print("测试5: ZIP流式读取")
+    print("-" * 50)
+    
+    try:
+        import io
+        import shutil
+        from PIL import Image
+        from zip_reader import scan_zip_images, open_image_source, close_archives
+        
+        temp_dir = tempfile.mkdtemp()
+        with zipfile.ZipFile(os.path.join(temp_dir, 'test.zip'), 'w') as zf:
+            for i in range(3):
+                buffer = io.BytesIO()
+                Image.new('RGB', (100, 100), color=(i*50, i*50, i*50)).save(buffer, 'JPEG')
+                zf.writestr(f'photos/test_{i}.jpg', buffer.getvalue())
+            zf.writestr('notes.txt', 'not an image')
+        
+        images = scan_zip_images(temp_dir, ('.jpg',))
+        sizes = []
+        for info in images:
+            with Image.open(open_image_source(info)) as img:
+                sizes.append(img.size)
+        close_archives(temp_dir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        if len(images) == 3 and sizes == [(100, 100)] * 3:
+            print(f"[PASS] 从ZIP中直接读取了 {len(images)} 张图片")
+            return True
+        else:
+            print(f"[FAIL] 读取结果不正确: {len(images)} 张图片")
+            return False
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_similarity_grouping():
+    """测试相似度分组与逐张比较结果一致"""
+    print("\n" + "=" * 50)
+    print("测试6: 相似度分组")
+    print("-" * 50)
+    
+    try:
+        import random
+        import numpy as np
+        import imagehash
+        from collections import defaultdict
+        from hash_index import group_hash_records
+        
+        # 构造若干簇相近的哈希
+        random.seed(0)
+        hashes = {}
+        for i in range(300):
+            bits = np.array([int(b) for b in format(random.choice([0x0f0f0f0f0f0f0f0f, 0xffd7918181c9ffff, 0x123456789abcdef0]), '064b')], dtype=bool)
+            for _ in range(random.randint(0, 6)):
+                bits[random.randrange(64)] ^= True
+            hashes[f'img_{i}.jpg'] = {'hash': imagehash.ImageHash(bits.reshape(8, 8)), 'info': {'path': f'img_{i}.jpg'}}
+        
+        # 原始的逐张比较分组
+        expected = defaultdict(list)
+        processed = set()
+        for path1, data1 in hashes.items():
+            if path1 in processed:
+                continue
+            group_id = len(expected) + 1
+            expected[group_id].append(data1['info'])
+            processed.add(path1)
+            for path2, data2 in hashes.items():
+                if path2 not in processed and data1['hash'] - data2['hash'] <= 5:
+                    expected[group_id].append(data2['info'])
+                    processed.add(path2)
+        
+        groups = group_hash_records(hashes, 5)
+        if groups == dict(expected):
+            print(f"[PASS] 分组结果一致，共 {len(groups)} 组")
+            return True
+        else:
+            print("[FAIL] 分组结果与逐张比较不一致")
+            return False
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_component_grouping():
+    """测试连通分量分组与图片顺序无关"""
+    print("\n" + "=" * 50)
+    print("测试7: 连通分量分组")
+    print("-" * 50)
+    
+    try:
+        import random
+        import numpy as np
+        from hash_index import cluster_components
+        
+        random.seed(1)
+        values = []
+        for i in range(200):
+            value = random.choice([0x0f0f0f0f0f0f0f0f, 0xffd7918181c9ffff])
+            for _ in range(random.randint(0, 4)):
+                value ^= 1 << random.randrange(64)
+            values.append(value)
+        names = [f'img_{i:03d}.jpg' for i in range(len(values))]
+        
+        groups = cluster_components(np.array(values, dtype=np.uint64), 5, names)
+        shuffled = list(range(len(values)))
+        random.shuffle(shuffled)
+        groups2 = cluster_components(np.array([values[i] for i in shuffled], dtype=np.uint64), 5,
+                                     [names[i] for i in shuffled])
+        
+        named = {k: [names[i] for i in v] for k, v in groups.items()}
+        named2 = {k: [names[shuffled[i]] for i in v] for k, v in groups2.items()}
+        if named == named2:
+            print(f"[PASS] 打乱顺序后分组一致，共 {len(groups)} 组")
+            return True
+        else:
+            print("[FAIL] 打乱顺序后分组不一致")
+            return False
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_startup_time():
+    """测试冷启动耗时：/health和/在STARTUP_BUDGET秒内可用，且启动时不加载推理依赖"""
+    print("\n" + "=" * 50)
+    print("测试8: 冷启动耗时")
+    print("-" * 50)
+    
+    try:
+        from benchmark_startup import measure, STARTUP_BUDGET
+        
+        report = measure(os.path.dirname(os.path.abspath(__file__)))
+        print(f"导入 {report['import_seconds']:.3f}s，/health和/就绪 {report['ready_seconds']:.3f}s")
+        
+        if report['heavy_modules']:
+            print(f"[FAIL] 启动时加载了推理依赖: {report['heavy_modules']}")
+            return False
+        if report['ready_seconds'] > STARTUP_BUDGET:
+            print(f"[FAIL] 启动耗时超过 {STARTUP_BUDGET}s")
+            return False
+        print("[PASS] 冷启动耗时正常")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_case_index():
+    """测试跨案件索引：重新打开后能查到其他案件的相似照片，同一ZIP重复上传不重复入库"""
+    print("\n" + "=" * 50)
+    print("测试9: 跨案件索引")
+    print("-" * 50)
+    
+    try:
+        from case_index import CaseIndex, screen_records
+        
+        with tempfile.TemporaryDirectory() as index_dir:
+            old = [{'hash': 0x0f0f0f0f0f0f0f0f, 'case': 'CASE0001', 'source_zip': 'CASE0001.zip', 'relative_path': '牦牛/1.jpg'},
+                   {'hash': 0xffd7918181c9ffff, 'case': 'CASE0001', 'source_zip': 'CASE0001.zip', 'relative_path': '牦牛/2.jpg'}]
+            screen_records(CaseIndex(index_dir), old, 5)
+            
+            new = [{'hash': 0x0f0f0f0f0f0f0f0f ^ 0b111, 'case': 'CASE0002', 'source_zip': 'CASE0002.zip', 'relative_path': 'a.jpg'}]
+            index = CaseIndex(index_dir)
+            hits = screen_records(index, new, 5)
+            again = screen_records(index, old, 5)
+            
+            if len(hits) != 1 or hits[0][1]['relative_path'] != '牦牛/1.jpg' or hits[0][2] != 3:
+                print(f"[FAIL] 跨案件命中不正确: {hits}")
+                return False
+            if len(index) != 3 or len(again) != 1:
+                print(f"[FAIL] 重复上传后索引条目数为 {len(index)}，命中 {len(again)} 处")
+                return False
+            print(f"[PASS] 跨案件命中正确，索引共 {len(index)} 张照片")
+            return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_incremental_groups():
+    """测试增量分组：新照片连接两个已有组时合并成一组，组号取较小者；不同子目录下的同名zip分别处理"""
+    print("\n" + "=" * 50)
+    print("测试10: 增量分组")
+    print("-" * 50)
+    
+    try:
+        from incremental_groups import IncrementalGroups
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_paths = [os.path.join(temp_dir, folder, 'CASE0001.zip') for folder in ('a', 'b')]
+            for zip_path in zip_paths:
+                os.makedirs(os.path.dirname(zip_path))
+                Path(zip_path).touch()
+            names = ['a1.jpg', 'a2.jpg', 'b1.jpg', 'b2.jpg']
+            infos = [{'path': name, 'source_zip': 'CASE0001.zip', 'original_zip_path': zip_paths[0], 'relative_path': name}
+                     for name in names]
+            base = 0x0f0f0f0f0f0f0f0f
+            values = [base, base ^ (1 << 40), base ^ 0b111111, base ^ 0b111111 ^ (1 << 40)]
+            
+            state_dir = os.path.join(temp_dir, 'state')
+            list_archive = lambda path: infos if path == zip_paths[0] else bridge
+            state = IncrementalGroups(state_dir, 5, list_archive, temp_dir)
+            first = state.merge(infos, values)
+            state.commit(infos, values, zip_paths[:1])
+            
+            bridge = [{'path': 'c.jpg', 'source_zip': 'CASE0001.zip', 'original_zip_path': zip_paths[1], 'relative_path': 'c.jpg'}]
+            state = IncrementalGroups(state_dir, 5, list_archive, temp_dir)
+            pending = state.pending_archives(zip_paths)
+            second = state.merge(bridge, [base ^ 0b111])
+            state.commit(bridge, [base ^ 0b111], pending)
+            members = IncrementalGroups(state_dir, 5, list_archive, temp_dir).group_members([1, 2])
+            
+            if len(first) != 2:
+                print(f"[FAIL] 第一批应分成2组，实际 {len(first)} 组")
+                return False
+            if pending != zip_paths[1:]:
+                print(f"[FAIL] b/CASE0001.zip 与 a/CASE0001.zip 同名被当成已处理: {pending}")
+                return False
+            if len(second) != 1 or second[0]['group_id'] != 1 or second[0]['removed_groups'] != [2]:
+                print(f"[FAIL] 合并结果不正确: {second}")
+                return False
+            if len(members[1]) != 5 or members[2]:
+                print(f"[FAIL] 合并后的组成员不正确: {[len(images) for images in members.values()]}")
+                return False
+            print(f"[PASS] 新照片把2个旧组合并成group_1，合并后共 {second[0]['size']} 张图片")
+            return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_threshold_sweep():
+    """测试阈值扫描：每个阈值的分组与直接按该阈值做连通分量分组一致"""
+    print("\n" + "=" * 50)
+    print("测试11: 阈值扫描")
+    print("-" * 50)
+    
+    try:
+        import random
+        import numpy as np
+        from hash_index import cluster_components
+        from threshold_sweep import ThresholdSweep
+        
+        random.seed(2)
+        bases = [random.getrandbits(64) for _ in range(20)]
+        values = []
+        for i in range(300):
+            value = random.choice(bases)
+            for _ in range(random.randint(0, 6)):
+                value ^= 1 << random.randrange(64)
+            values.append(value)
+        hashes = np.array(values, dtype=np.uint64)
+        
+        sweep = ThresholdSweep.build(hashes, 8)
+        for threshold in range(9):
+            expected = {k: v for k, v in cluster_components(hashes, threshold).items() if len(v) > 1}
+            if sweep.groups_at(threshold) != expected or sweep.levels[threshold]['groups'] != len(expected):
+                print(f"[FAIL] 阈值 {threshold} 的分组不一致")
+                return False
+        print(f"[PASS] 0~8 各阈值分组一致，阈值5共 {sweep.levels[5]['groups']} 组")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_image_manifest():
+    """测试图片清单：字典与清单互相转换不丢信息，精确去重与dedupe_exact_images一致，保存后可读回"""
+    print("\n" + "=" * 50)
+    print("测试12: 列式图片清单")
+    print("-" * 50)
+    
+    try:
+        import io
+        import numpy as np
+        from PIL import Image
+        from zip_reader import scan_zip_images, dedupe_exact_images, close_archives
+        from image_manifest import ImageManifest
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            buffers = []
+            for color in ('red', 'green'):
+                buf = io.BytesIO()
+                Image.new('RGB', (32, 32), color).save(buf, 'PNG')
+                buffers.append(buf.getvalue())
+            for name in ('A001.zip', 'B002.zip'):
+                with zipfile.ZipFile(os.path.join(temp_dir, name), 'w') as zf:
+                    zf.writestr('photos/red.png', buffers[0])
+                    zf.writestr('photos/sub/green.png', buffers[1])
+                    zf.writestr(zipfile.ZipInfo('中文.png'.encode('gbk').decode('cp437')), buffers[0])
+            
+            image_infos = scan_zip_images(temp_dir, ('.png',))
+            manifest = ImageManifest.from_image_infos(image_infos)
+            keys = ('path', 'source_zip', 'original_zip_path', 'relative_path', 'zip_member', 'zip_crc', 'zip_size')
+            for i, image_info in enumerate(image_infos):
+                view = manifest.view(i)
+                if any(view[key] != image_info[key] for key in keys):
+                    print(f"[FAIL] 第 {i} 行与原记录不一致: {view}")
+                    return False
+            
+            manifest.dedupe_exact()
+            expected = [image_infos.index(info) for info in dedupe_exact_images(image_infos)]
+            if manifest.representatives().tolist() != expected:
+                print("[FAIL] 精确去重的代表图片与dedupe_exact_images不一致")
+                return False
+            
+            path = os.path.join(temp_dir, 'manifest.npz')
+            manifest.save(path)
+            loaded = ImageManifest.load(path)
+            close_archives(temp_dir)
+            if [loaded.view(i) for i in range(len(loaded))] != [manifest.view(i) for i in range(len(manifest))] \
+                    or not np.array_equal(loaded.representative, manifest.representative):
+                print("[FAIL] 保存后读回的清单不一致")
+                return False
+        
+        print(f"[PASS] {len(manifest)} 张图片，{len(manifest.representatives())} 张代表图片，清单 {manifest.nbytes()} 字节")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_prefetch_model_input():
+    """测试预取时缩放好的模型输入：经模型预处理后与完整解码的图片一致，class2概率不变；
+    同一次解码算出的哈希与完整解码的哈希相同"""
+    print("\n" + "=" * 50)
+    print("测试13: 预取的模型输入")
+    print("-" * 50)
+    
+    try:
+        import io
+        import numpy as np
+        from PIL import Image
+        from classifier import _prepare, MODEL_INPUT_TOLERANCE
+        from image_hash import compute_phash
+        from inference_backend import preprocess
+        from zip_reader import decode_image, to_model_input
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rng = np.random.default_rng(0)
+            pixels = (rng.random((60, 90, 3)) * 255).astype('uint8')
+            image = Image.fromarray(pixels).resize((1500, 1000), Image.BICUBIC)
+            exif = Image.Exif()
+            exif[0x0112] = 6  # 需要旋转90度
+            paths = [os.path.join(temp_dir, 'photo.jpg'), os.path.join(temp_dir, 'scan.png')]
+            image.save(paths[0], 'JPEG', quality=90, exif=exif.tobytes())
+            image.convert('RGBA').resize((700, 1300)).save(paths[1], 'PNG')
+            
+            max_diff = 0.0
+            for path in paths:
+                phash, prepared = _prepare({'path': path}, 224, 8)
+                if phash != compute_phash(path, 8, fast_decode=False):
+                    print(f"[FAIL] 共用解码的哈希与完整解码不一致: {path}")
+                    return False
+                full = to_model_input(decode_image({'path': path}))
+                diff = np.abs(preprocess([prepared], 224) - preprocess([full], 224)).max()
+                max_diff = max(max_diff, float(diff))
+            
+            if max_diff > MODEL_INPUT_TOLERANCE:
+                print(f"[FAIL] 模型输入与完整解码相差 {max_diff}，超过 {MODEL_INPUT_TOLERANCE}")
+                return False
+        
+        print(f"[PASS] 模型输入与完整解码的最大差异 {max_diff}，预取的图片尺寸 {prepared.size}")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_int8_fallback():
+    """测试INT8不可用（量化数据集不存在）时退回FP32的ONNX模型，而不是PyTorch"""
+    print("\n" + "=" * 50)
+    print("测试14: INT8退回FP32")
+    print("-" * 50)
+    
+    import inference_backend
+    import quantize_model
+    original = (inference_backend.ensure_onnx, inference_backend.OnnxClassifier, quantize_model.ensure_onnx)
+    try:
+        class RecordingClassifier:
+            # 代替ONNX Runtime会话，只记录加载的模型
+            def __init__(self, onnx_path, meta, threads=0, backend='onnx'):
+                self.backend = backend
+                self.path = onnx_path
+        
+        def fake_export(model_path, export_dir=None):
+            return os.path.splitext(model_path)[0] + '.onnx', {'source_digest': None, 'imgsz': 224}
+        
+        inference_backend.ensure_onnx = quantize_model.ensure_onnx = fake_export
+        inference_backend.OnnxClassifier = RecordingClassifier
+        with tempfile.TemporaryDirectory() as temp_dir:
+            classifier = inference_backend.load_classifier(os.path.join(temp_dir, 'best.pt'), 'onnx-int8',
+                                                           quant_dataset=os.path.join(temp_dir, 'missing'))
+        
+        if not isinstance(classifier, RecordingClassifier) or classifier.backend != 'onnx':
+            print(f"[FAIL] 应退回FP32的ONNX模型，实际加载了 {type(classifier).__name__}")
+            return False
+        print(f"[PASS] INT8不可用时使用 {classifier.path}")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+    finally:
+        inference_backend.ensure_onnx, inference_backend.OnnxClassifier, quantize_model.ensure_onnx = original
+
+def test_feature_cache_eviction():
+    """测试特征缓存：总大小记录与实际一致，超出上限时淘汰最久未用的条目，读取过的条目保留"""
+    print("\n" + "=" * 50)
+    print("测试15: 特征缓存淘汰")
+    print("-" * 50)
+    
+    try:
+        import time
+        from feature_cache import FeatureCache
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = FeatureCache(os.path.join(temp_dir, 'cache.db'), max_mb=0.01)
+            for i in range(8):
+                cache.put_many({f"key{i}": 'x' * 1000})
+                time.sleep(0.01)
+            # 覆盖已有的键，总大小按新旧大小之差更新
+            cache.put_many({'key7': 'y' * 500})
+            cache.get_many(['key0'])
+            time.sleep(0.01)
+            for i in range(8, 12):
+                cache.put_many({f"key{i}": 'x' * 1000})
+                time.sleep(0.01)
+            
+            conn = cache._connect()
+            recorded = conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+            actual = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            keys = {key for key, in conn.execute("SELECT key FROM entries")}
+            conn.close()
+            cache._local.conn = None
+        
+        if recorded != actual:
+            print(f"[FAIL] 记录的总大小 {recorded} 与实际 {actual} 不一致")
+            return False
+        if actual > cache.max_bytes:
+            print(f"[FAIL] 总大小 {actual} 超过上限 {cache.max_bytes}")
+            return False
+        if 'key0' not in keys or 'key1' in keys or 'key11' not in keys:
+            print(f"[FAIL] 淘汰顺序不对，剩余: {sorted(keys)}")
+            return False
+        print(f"[PASS] 淘汰后剩 {len(keys)} 条，共 {actual} 字节，最近读取的key0保留")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_result_archive():
+    """测试边打包边发送的结果ZIP：数据完整可解压，图片按原样存储，缓存文件与发送的数据相同，中途断开不留临时文件"""
+    print("\n" + "=" * 50)
+    print("测试16: 结果ZIP流式打包")
+    print("-" * 50)
+    
+    try:
+        import io
+        import zipfile
+        from result_archive import results_version, cached_archive, stream_archive, ARCHIVE_CHUNK_SIZE
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            results_dir = os.path.join(temp_dir, 'results')
+            archive_dir = os.path.join(temp_dir, 'archives')
+            files = {
+                'group_1/001_a.jpg': os.urandom(ARCHIVE_CHUNK_SIZE * 2 + 123),
+                'group_1/002_b.png': os.urandom(1000),
+                '相似图片分组记录.csv': '组别,序号\ngroup_1,1\n'.encode('utf-8') * 100,
+            }
+            for arcname, data in files.items():
+                path = os.path.join(results_dir, *arcname.split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            
+            version = results_version(results_dir)
+            chunks = list(stream_archive(results_dir, archive_dir, version))
+            streamed = b''.join(chunks)
+            with zipfile.ZipFile(io.BytesIO(streamed)) as zf:
+                bad = zf.testzip()
+                contents = {info.filename: zf.read(info) for info in zf.infolist()}
+                compress = {info.filename: info.compress_type for info in zf.infolist()}
+            cached = cached_archive(archive_dir, version)
+            with open(cached, 'rb') as f:
+                cached_data = f.read()
+            
+            # 客户端中途断开：生成器被关闭，不留下临时文件
+            with open(os.path.join(results_dir, 'group_1', '001_a.jpg'), 'ab') as f:
+                f.write(b'\0')
+            new_version = results_version(results_dir)
+            partial = stream_archive(results_dir, archive_dir, new_version)
+            next(partial)
+            partial.close()
+            leftovers = sorted(os.listdir(archive_dir))
+        
+        if bad is not None or contents != files:
+            print(f"[FAIL] 解压出的文件与结果目录不一致（损坏的条目: {bad}）")
+            return False
+        if compress['group_1/001_a.jpg'] != zipfile.ZIP_STORED or compress['相似图片分组记录.csv'] != zipfile.ZIP_DEFLATED:
+            print(f"[FAIL] 压缩方式不正确: {compress}")
+            return False
+        if len(chunks) < 3 or cached_data != streamed:
+            print(f"[FAIL] 应分 {len(chunks)} 块发送且缓存文件与发送的数据相同")
+            return False
+        if new_version == version or leftovers != [os.path.basename(cached)]:
+            print(f"[FAIL] 中途断开后缓存目录为 {leftovers}")
+            return False
+        print(f"[PASS] 分 {len(chunks)} 块发送 {len(streamed)} 字节，解压后 {len(contents)} 个文件一致")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_output_store_fallback():
+    """测试结果文件输出：reflink不可用时退回硬链接，硬链接也不可用时复制，不可用的方式不再重复尝试"""
+    print("\n" + "=" * 50)
+    print("测试17: 输出方式退回")
+    print("-" * 50)
+    
+    import errno
+    import output_store
+    original = output_store.link_file
+    try:
+        attempts = []
+        unsupported = set()
+        
+        def fake_link(src, dst, method, relative=True):
+            # 模拟文件系统不支持某些链接方式
+            attempts.append(method)
+            if method in unsupported:
+                raise OSError(errno.EXDEV if method == 'hardlink' else errno.EOPNOTSUPP, f"不支持{method}")
+            return original(src, dst, method, relative)
+        
+        output_store.link_file = fake_link
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src.jpg')
+            with open(src, 'wb') as f:
+                f.write(os.urandom(4096))
+            
+            # reflink不可用：退回硬链接，之后的文件不再尝试reflink
+            unsupported.add('reflink')
+            store = output_store.OutputStore('auto')
+            first = store.place_file(src, os.path.join(temp_dir, 'a.jpg'))
+            second = store.place_file(src, os.path.join(temp_dir, 'b.jpg'))
+            linked = os.path.samefile(src, os.path.join(temp_dir, 'b.jpg'))
+            hardlink_attempts = list(attempts)
+            
+            # reflink和硬链接都不可用：复制，内容相同但是独立的文件
+            unsupported.add('hardlink')
+            attempts.clear()
+            store = output_store.OutputStore('auto')
+            copied = store.place_image({'path': src, 'content_digest': 'same'}, os.path.join(temp_dir, 'c.jpg'))
+            duplicate = store.place_image({'path': src, 'content_digest': 'same'}, os.path.join(temp_dir, 'd.jpg'))
+            with open(src, 'rb') as f_src, open(os.path.join(temp_dir, 'd.jpg'), 'rb') as f_dst:
+                same_content = f_src.read() == f_dst.read()
+            independent = not os.path.samefile(src, os.path.join(temp_dir, 'd.jpg'))
+            copy_attempts = list(attempts)
+            
+            # 目标是源文件的硬链接时，copy模式先删除目标再复制，不会改写源文件
+            os.remove(os.path.join(temp_dir, 'a.jpg'))
+            os.link(src, os.path.join(temp_dir, 'a.jpg'))
+            output_store.OutputStore('copy').place_file(os.path.join(temp_dir, 'c.jpg'), os.path.join(temp_dir, 'a.jpg'))
+            source_kept = not os.path.samefile(src, os.path.join(temp_dir, 'a.jpg'))
+        
+        if (first, second) != ('hardlink', 'hardlink') or not linked or hardlink_attempts != ['reflink', 'hardlink', 'hardlink']:
+            print(f"[FAIL] reflink不可用时应退回硬链接: {first}, {second}, 尝试 {hardlink_attempts}")
+            return False
+        if (copied, duplicate) != ('copy', 'copy') or not same_content or not independent or copy_attempts != ['reflink', 'hardlink']:
+            print(f"[FAIL] 链接都不可用时应复制: {copied}, {duplicate}, 尝试 {copy_attempts}")
+            return False
+        if not source_kept:
+            print("[FAIL] 覆盖硬链接目标时改写了源文件")
+            return False
+        print("[PASS] reflink→硬链接→复制依次退回，不可用的方式只尝试一次")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+    finally:
+        output_store.link_file = original
+
+def test_progress_events():
+    """测试SSE进度推送：事件格式正确，进度不倒退，逐张汇报合并推送，空闲时发送心跳，任务结束时发送done"""
+    print("\n" + "=" * 50)
+    print("测试18: SSE进度推送")
+    print("-" * 50)
+    
+    try:
+        import json
+        import time
+        import threading
+        from progress_events import ProgressChannel, progress_fields, stream_events
+        
+        status = {'status': 'processing', 'progress': 0}
+        status.update(progress_fields())
+        channel = ProgressChannel(status)
+        
+        def run_job():
+            time.sleep(0.2)
+            channel.stage('classify', 50)
+            for _ in range(50):
+                channel.advance(images_classified=1)
+                time.sleep(0.002)
+            channel.stage('hash', 10)
+            channel.advance(3, images_hashed=3)
+            channel.finish_stage()
+            channel.close(status='completed')
+        
+        worker = threading.Thread(target=run_job)
+        worker.start()
+        messages = list(stream_events(channel, min_interval=0.02, heartbeat=0.05))
+        worker.join()
+        
+        snapshots = [json.loads(message[len('data: '):]) for message in messages if message.startswith('data: ')]
+        heartbeats = [message for message in messages if message.startswith(':')]
+        progress = [snapshot['progress'] for snapshot in snapshots]
+        last = snapshots[-1]
+        
+        if not all(message.endswith('\n\n') for message in messages) or messages[-1] != 'event: done\ndata: {}\n\n':
+            print(f"[FAIL] 事件格式不正确或没有以done结束: {messages[-2:]}")
+            return False
+        if progress != sorted(progress) or last['status'] != 'completed' or last['progress'] != 80:
+            print(f"[FAIL] 进度应单调递增并停在哈希阶段结束（80%）: {progress}")
+            return False
+        if last['images_classified'] != 50 or last['images_hashed'] != 3 or last['stage_done'] != 10:
+            print(f"[FAIL] 计数不正确: {last}")
+            return False
+        if not heartbeats or len(snapshots) >= channel.version:
+            print(f"[FAIL] 应有心跳且合并推送：{len(heartbeats)} 次心跳，{len(snapshots)} 次推送/{channel.version} 次变化")
+            return False
+        print(f"[PASS] {channel.version} 次变化合并为 {len(snapshots)} 次推送，{len(heartbeats)} 次心跳，最后发送done")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
+def test_thumbnail_lru():
+    """测试缩略图缓存：命中时更新最近使用时间，超出上限时删除最久未用的缩略图"""
+    print("\n" + "=" * 50)
+    print("测试19: 缩略图缓存淘汰")
+    print("-" * 50)
+    
+    try:
+        import time
+        from PIL import Image
+        from thumbnail_cache import ThumbnailCache
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ThumbnailCache(os.path.join(temp_dir, 'thumbs'), size=64)
+            thumbs = []
+            for i in range(3):
+                source = os.path.join(temp_dir, f'{i}.png')
+                Image.new('RGB', (200, 200), (i * 80, 0, 0)).save(source)
+                path, _, _ = cache.get(source)
+                # 模拟依次在两天前、一天前、一小时多以前生成
+                age = [2 * 86400, 86400, 4000][i]
+                os.utime(path, (time.time() - age, time.time() - age))
+                thumbs.append((source, path))
+            
+            # 最早生成的缩略图再次被查看
+            cache.get(thumbs[0][0])
+            sizes = [os.path.getsize(path) for _, path in thumbs]
+            cache.max_bytes = sum(sizes) - 1
+            cache.prune()
+            kept = [os.path.exists(path) for _, path in thumbs]
+        
+        if kept != [True, False, True]:
+            print(f"[FAIL] 应只删除最久未用的第2张，实际保留情况: {kept}")
+            return False
+        print("[PASS] 最早生成但刚被查看的缩略图保留，删除了最久未用的缩略图")
+        return True
+            
+    except Exception as e:
+        print(f"[ERROR] 错误: {e}")
+        return False
+
 def main():
     print("\n牦牛图片相似度分析系统 - 功能测试\n")
     
@@ -140,6 +825,21 @@ def main():
     results.append(("图片处理", test_image_processing()))
     results.append(("Flask应用", test_flask_app()))
     results.append(("ZIP处理", test_zip_handling()))
+    results.append(("ZIP流式读取", test_zip_streaming()))
+    results.append(("相似度分组", test_similarity_grouping()))
+    results.append(("连通分量分组", test_component_grouping()))
+    results.append(("冷启动耗时", test_startup_time()))
+    results.append(("跨案件索引", test_case_index()))
+    results.append(("增量分组", test_incremental_groups()))
+    results.append(("阈值扫描", test_threshold_sweep()))
+    results.append(("图片清单", test_image_manifest()))
+    results.append(("预取的模型输入", test_prefetch_model_input()))
+    results.append(("INT8退回FP32", test_int8_fallback()))
+    results.append(("特征缓存淘汰", test_feature_cache_eviction()))
+    results.append(("结果ZIP流式打包", test_result_archive()))
+    results.append(("输出方式退回", test_output_store_fallback()))
+    results.append(("SSE进度推送", test_progress_events()))
+    results.append(("缩略图缓存淘汰", test_thumbnail_lru()))
     
     # 输出总结
     print("\n" + "=" * 50)
@@ -0,0 +1,274 @@
+"""ZIP内图片的流式读取
+
+直接从ZIP中央目录列出图片条目，需要时用ZipFile.open读到内存里解码，
+不再把压缩包解压到临时目录再遍历一遍。只有最终的分组结果才写盘。
+"""
+import io
+import os
+import hashlib
+import shutil
+import logging
+import threading
+import zipfile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FILENAME_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'cp437']
+COPY_BUFFER_SIZE = 1024 * 1024
+# 校验文件头时读取的字节数
+MAGIC_HEADER_SIZE = 16
+
+# 已打开的压缩包，按路径复用，避免每读一张图片都重新解析中央目录
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def decode_zip_filename(zip_info):
+    """ZIP内文件名常是GBK编码却被按cp437解析，依次尝试常见编码还原"""
+    for encoding in FILENAME_ENCODINGS:
+        try:
+            return zip_info.filename.encode('cp437').decode(encoding)
+        except (UnicodeDecodeError, UnicodeEncodeError):
+            continue
+    return zip_info.filename
+
+
+def sniff_image_format(header):
+    """根据文件头判断图片格式，不是支持的图片时返回None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'BM'):
+        return 'bmp'
+    if header.startswith((b'II*\x00', b'MM\x00*')):
+        return 'tiff'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def new_scan_stats():
+    """ZIP扫描统计：条目数、图片数、跳过的条目数及其未压缩/压缩字节数"""
+    return {
+        'zip_files': 0,
+        'zip_entries': 0,
+        'image_entries': 0,
+        'skipped_entries': 0,
+        'skipped_bytes': 0,
+        'skipped_compressed_bytes': 0,
+    }
+
+
+def plan_zip_entries(zip_ref, formats, stats=None, check_magic=False):
+    """只根据中央目录挑出图片条目，返回[(zip_info, 解码后的文件名)]
+
+    按扩展名过滤，check_magic=True时再读取每个条目开头几个字节校验图片格式
+    （只解压第一个数据块）。其余条目完全不解压，跳过的数量和字节数计入stats。
+    """
+    planned = []
+    if stats is not None:
+        stats['zip_files'] += 1
+    for zip_info in zip_ref.infolist():
+        if zip_info.is_dir():
+            continue
+        if stats is not None:
+            stats['zip_entries'] += 1
+        filename = decode_zip_filename(zip_info)
+        is_image = filename.lower().endswith(formats)
+        if is_image and check_magic:
+            try:
+                with zip_ref.open(zip_info) as member:
+                    is_image = sniff_image_format(member.read(MAGIC_HEADER_SIZE)) is not None
+            except Exception as e:
+                logger.warning(f"读取zip条目 {filename} 的文件头时出错: {str(e)}")
+                is_image = False
+        if is_image:
+            planned.append((zip_info, filename))
+            if stats is not None:
+                stats['image_entries'] += 1
+        elif stats is not None:
+            stats['skipped_entries'] += 1
+            stats['skipped_bytes'] += zip_info.file_size
+            stats['skipped_compressed_bytes'] += zip_info.compress_size
+    return planned
+
+
+def log_scan_stats(stats):
+    logger.info(f"zip条目 {stats['zip_entries']} 个，其中图片 {stats['image_entries']} 个，"
+                f"跳过 {stats['skipped_entries']} 个非图片条目（{stats['skipped_bytes'] / 1024 / 1024:.1f} MB 未解压）")
+
+
+def find_zip_files(zip_dir):
+    """按os.walk顺序列出目录下所有zip文件"""
+    zip_paths = []
+    for root, _, files in os.walk(zip_dir):
+        for file in files:
+            if file.lower().endswith('.zip'):
+                zip_paths.append(os.path.join(root, file))
+    return zip_paths
+
+
+def list_archive_images(zip_path, formats, stats=None, check_magic=False):
+    """列出单个zip文件中的图片记录（不解压），打不开时抛出异常"""
+    file = os.path.basename(zip_path)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        planned = plan_zip_entries(zip_ref, formats, stats, check_magic)
+
+    image_infos = []
+    for zip_info, filename in planned:
+        relative_path = os.path.normpath(filename.lstrip('/'))
+        image_infos.append({
+            'path': os.path.join(zip_path, relative_path),
+            'source_zip': file,
+            'original_zip_path': zip_path,
+            'relative_path': relative_path,
+            'zip_member': zip_info.filename,
+            'zip_crc': zip_info.CRC,
+            'zip_size': zip_info.file_size,
+        })
+    return image_infos
+
+
+def iter_zip_images(zip_dir, formats, stats=None, check_magic=False):
+    """遍历目录下所有zip文件，逐个产出其中图片的记录（不解压）"""
+    for zip_path in find_zip_files(zip_dir):
+        logger.info(f"正在处理zip文件: {zip_path}")
+        try:
+            image_infos = list_archive_images(zip_path, formats, stats, check_magic)
+        except Exception as e:
+            logger.error(f"处理zip文件 {zip_path} 时出错: {str(e)}")
+            continue
+        yield from image_infos
+
+
+def scan_zip_images(zip_dir, formats, stats=None, check_magic=False):
+    """列出目录下所有zip文件中的图片，stats为None时只在日志里输出统计"""
+    if stats is None:
+        stats = new_scan_stats()
+    image_infos = list(iter_zip_images(zip_dir, formats, stats, check_magic))
+    log_scan_stats(stats)
+    logger.info(f"共找到 {len(image_infos)} 张图片（直接从zip读取，不解压）")
+    return image_infos
+
+
+def content_digest(image_info):
+    """图片内容的摘要，用于确认CRC32相同的条目确实完全一致"""
+    return hashlib.blake2b(read_image_bytes(image_info), digest_size=16).hexdigest()
+
+
+def dedupe_exact_images(image_infos):
+    """找出完全相同的图片，只返回每组的代表（首次出现的那张）
+
+    先按中央目录里的(大小, CRC32)分桶，只有桶内多于一张时才读取内容计算摘要确认。
+    重复的副本挂在代表的'duplicates'列表里，后续解码、YOLO、哈希只处理代表，
+    结果再通过with_duplicates分发给所有副本。没有zip元数据的图片原样保留。
+    """
+    buckets = {}
+    for image_info in image_infos:
+        if 'zip_crc' in image_info:
+            buckets.setdefault((image_info['zip_size'], image_info['zip_crc']), []).append(image_info)
+
+    duplicate_ids = set()
+    for candidates in buckets.values():
+        if len(candidates) < 2:
+            continue
+        by_digest = {}
+        for image_info in candidates:
+            try:
+                digest = content_digest(image_info)
+            except Exception as e:
+                logger.warning(f"计算图片摘要时出错 {image_info['path']}: {str(e)}")
+                continue
+            image_info['content_digest'] = digest
+            by_digest.setdefault(digest, []).append(image_info)
+        for representative, *copies in by_digest.values():
+            if copies:
+                representative['duplicates'] = copies
+                duplicate_ids.update(id(copy) for copy in copies)
+
+    representatives = [info for info in image_infos if id(info) not in duplicate_ids]
+    if duplicate_ids:
+        logger.info(f"发现 {len(duplicate_ids)} 张与其他图片完全相同的副本，只处理 {len(representatives)} 张代表图片")
+    return representatives
+
+
+def with_duplicates(image_info):
+    """代表图片及其所有完全相同的副本"""
+    return [image_info] + image_info.get('duplicates', [])
+
+
+def expand_duplicates(image_infos):
+    """把代表图片展开成代表+副本的完整列表，副本紧跟在代表后面"""
+    return [record for image_info in image_infos for record in with_duplicates(image_info)]
+
+
+def _get_archive(zip_path):
+    with _archives_lock:
+        archive = _archives.get(zip_path)
+        if archive is None:
+            archive = zipfile.ZipFile(zip_path, 'r')
+            _archives[zip_path] = archive
+        return archive
+
+
+def close_archives(zip_dir=None):
+    """关闭缓存的压缩包句柄，指定zip_dir时只关闭该目录下的压缩包"""
+    prefix = os.path.join(os.path.abspath(zip_dir), '') if zip_dir else None
+    with _archives_lock:
+        for zip_path in list(_archives):
+            if prefix is None or os.path.abspath(zip_path).startswith(prefix):
+                _archives.pop(zip_path).close()
+
+
+def read_image_bytes(image_info):
+    """读取图片的原始字节"""
+    if 'zip_member' in image_info:
+        with _get_archive(image_info['original_zip_path']).open(image_info['zip_member']) as member:
+            return member.read()
+    with open(image_info['path'], 'rb') as f:
+        return f.read()
+
+
+def open_image_source(image_info):
+    """返回可供Image.open使用的对象：ZIP内图片为内存缓冲区，磁盘图片为路径"""
+    if 'zip_member' in image_info:
+        return io.BytesIO(read_image_bytes(image_info))
+    return image_info['path']
+
+
+def decode_image(image_info):
+    """读取并完整解码图片，返回已载入像素的PIL图片（未按EXIF旋转），供YOLO和哈希共用"""
+    img = Image.open(open_image_source(image_info))
+    img.load()
+    return img
+
+
+def to_model_input(img):
+    """与cv2.imread读取磁盘文件时一样按EXIF方向摆正"""
+    return ImageOps.exif_transpose(img).convert('RGB')
+
+
+def resize_model_input(img, imgsz):
+    """分类预处理的第一步：短边双线性缩放到imgsz（与torchvision.transforms.Resize(int)相同）
+
+    img应是完整解码并摆正的RGB图片。模型再做同样的缩放时尺寸不变、像素原样保留，
+    只剩中心裁剪，因此与直接送入完整图片的概率相同，排队等待推理时只需保留小图。
+    """
+    width, height = img.size
+    if width <= height:
+        size = (imgsz, int(imgsz * height / width))
+    else:
+        size = (int(imgsz * width / height), imgsz)
+    return img.resize(size, Image.BILINEAR)
+
+
+def copy_image(image_info, dest_path):
+    """把图片写到结果目录：ZIP内图片从压缩包直接流式写出，磁盘图片照旧copy2"""
+    if 'zip_member' not in image_info:
+        shutil.copy2(image_info['path'], dest_path)
+        return
+    archive = _get_archive(image_info['original_zip_path'])
+    with archive.open(image_info['zip_member']) as src, open(dest_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)